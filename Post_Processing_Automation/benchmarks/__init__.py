@@ -0,0 +1,4 @@
+# benchmarks package
+# Package holds the synthetic Tigershark csv file generator and the benchmark runner for the post processing stages,
+# run from the Post_Processing_Automation folder => python -m benchmarks.run_benchmarks --help
+#
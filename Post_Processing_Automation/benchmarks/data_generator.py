@@ -0,0 +1,62 @@
+# data_generator module
+# Module holds the class => DataGenerator - manages the synthetic Tigershark csv file creation
+# Class responsible for writing deterministic pipe delimited *_id.csv and *_upc.csv files with the real column sets,
+# block by block so any size from 10k to 100M rows is written in bounded memory
+#
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class DataGenerator(object):
+    def __init__(self, seed=2019, block_rows=1000000):
+        self.seed = seed
+        self.block_rows = block_rows
+        self.start_time = 1514764800          # 2018-01-01 00:00:00, transactions fall in the following 26 weeks
+        self.time_span = 26 * 7 * 86400
+
+    # Writes the id and upc csv files for a child ticket folder, returns a list of lists with file type and file name
+    #
+    def create_files(self, folder, file_stub, rows):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        id_file_name = os.path.join(folder, '{}_id.csv'.format(file_stub))
+        upc_file_name = os.path.join(folder, '{}_upc.csv'.format(file_stub))
+        with open(id_file_name, 'w') as id_file, open(upc_file_name, 'w') as upc_file:
+            for block_number, block_start in enumerate(range(0, rows, self.block_rows)):
+                block_size = min(self.block_rows, rows - block_start)
+                id_block, upc_block = self.create_blocks(block_number, block_size)
+                id_block.to_csv(id_file, sep='|', index=False, header=block_number == 0)
+                upc_block.to_csv(upc_file, sep='|', index=False, header=block_number == 0)
+        return [['id', id_file_name], ['upc', upc_file_name]]
+
+    # Creates one block of each file, the upc rows reference the txn_ids of the same id block, seeded by block number
+    # so a file of a given size is always written identically
+    #
+    def create_blocks(self, block_number, block_size):
+        random_state = np.random.RandomState(self.seed + block_number)
+        txn_ids = random_state.randint(10 ** 9, 10 ** 12, size=block_size, dtype=np.int64)
+        xids = pd.Series(random_state.randint(0, 2 ** 62, size=block_size, dtype=np.int64)).map('{:016x}'.format)
+        id_block = pd.DataFrame({'xid': xids, 'txn_id': txn_ids}, columns=['xid', 'txn_id'])
+
+        seconds = self.start_time + random_state.randint(0, self.time_span, size=block_size, dtype=np.int64)
+        upc_block = pd.DataFrame({
+            'txn_id': random_state.choice(txn_ids, size=block_size),
+            'transactionDateTime': pd.Series(pd.to_datetime(seconds, unit='s')).dt.strftime('%Y-%m-%d %H:%M:%S'),
+            'upc': random_state.randint(10 ** 10, 10 ** 12, size=block_size, dtype=np.int64),
+            'units': random_state.randint(1, 13, size=block_size)
+        }, columns=['txn_id', 'transactionDateTime', 'upc', 'units'])
+        return id_block, upc_block
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic Tigershark id and upc csv files')
+    parser.add_argument('folder', help='folder to write the csv files into')
+    parser.add_argument('--rows', type=int, default=10000, help='rows per file (10k to 100M)')
+    parser.add_argument('--stub', default='Benchmark_Customer_2018-01-01_2018-06-30', help='csv file name stub')
+    parser.add_argument('--seed', type=int, default=2019)
+    args = parser.parse_args()
+    for file_type, file_name in DataGenerator(args.seed).create_files(args.folder, args.stub, args.rows):
+        print('{}\t{}\t{:,} bytes'.format(file_type, file_name, os.path.getsize(file_name)))
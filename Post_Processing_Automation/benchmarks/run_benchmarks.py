@@ -0,0 +1,370 @@
+# run_benchmarks module
+# Module holds the benchmark runner for the post processing stages - file discovery, structure check, data-frame
+# loads, each column check, zip file creation, the full child_ticket_manager path against a stubbed Jira and the
+# whole run against a replayed Jira.
+# Each benchmark runs in a freshly spawned process so its peak RSS is its own, and the results (wall and cpu time,
+# rows/s, MB/s and peak RSS) are written to a json file for comparison between versions
+#
+from concurrent.futures import ProcessPoolExecutor
+from glob import escape, glob
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+from benchmarks.data_generator import DataGenerator
+
+# Benchmark settings applied over the config.ini settings - no Jira server, zfs or results paths, no stores kept
+# between runs, one child ticket worker and the Jira writes made inline
+BENCHMARK_OVERRIDES = {
+    "jira_url":             '',
+    "jira_token":           ('', ''),
+    "zfs_path":             '',
+    "child_ticket_workers": '1',
+    "profile_cache_path":   '',
+    "sidecar_format":       '',
+    "sidecar_path":         '',
+    "multi_host":           False,
+    "worker_id":            '',
+    "jira_write_workers":   '0',
+    "jira_write_rate":      '0',
+    "jira_write_retries":   '0',
+    "replay_mode":          '',
+    "replay_fixture_path":  '',
+    "history_path":         '',
+    "results_json_path":    '',
+    "results_json_name":    'benchmark'
+}
+
+
+# Returns the post processing settings used by the benchmarks, read from config.ini as main.py reads them with the
+# benchmark overrides applied, so a new setting only has to be added in one place
+#
+def benchmark_config():
+    import configparser
+    from main import config_params_create
+
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.ini'))
+    return dict(config_params_create(config, ('', '')), **BENCHMARK_OVERRIDES)
+
+
+BENCHMARK_CONFIG = benchmark_config()
+
+PARENT_KEY = 'CAM-1000'
+CHILD_KEY = 'CAM-1001'
+
+
+# Stand-in ticket with the attributes the post processing manager reads
+#
+class StubTicket(object):
+    def __init__(self, key, customer_name=None, date_range=None):
+        self.key = key
+        self.customer_name = customer_name
+        self.date_range = date_range
+
+    def __str__(self):
+        return self.key
+
+
+# Stand-in for the JiraManager that records the calls instead of posting to the Jira server
+#
+class StubJiraManager(object):
+    def __init__(self):
+        self.calls = []
+
+    def child_information_pull(self, ticket):
+        self.calls.append(['child_information_pull', ticket.key])
+        return ticket.date_range
+
+    def add_quality_checks_results_comment(self, ticket, quality_checks, rules):
+        self.calls.append(['add_quality_checks_results_comment', ticket.key])
+
+    def add_count_comment(self, ticket, zip_file_name, quality_checks):
+        self.calls.append(['add_count_comment', ticket.key])
+
+    def update_field_value(self, ticket):
+        self.calls.append(['update_field_value', ticket.key])
+
+    def session_pool(self, pool_size):
+        pass
+
+    def ticket_writes_posted(self, ticket, zip_file_name, since=None):
+        self.calls.append(['ticket_writes_posted', ticket.key])
+        return []
+
+    def session_retries(self, max_retries):
+        return None
+
+    def kill_session(self):
+        pass
+
+
+# Times a callable for wall and cpu seconds, returns the measurements and the callable's result
+#
+def timed(function, *args):
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    result = function(*args)
+    return {'seconds': time.perf_counter() - wall_start, 'cpu_seconds': time.process_time() - cpu_start}, result
+
+
+# Returns the peak resident set size of the current process in MB
+#
+def peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    return peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+
+
+# Creates the post processing manager for the benchmark folder
+#
+def benchmark_manager(zfs_path, settings):
+    from turn_post_processing_manager import PostProcessingManager
+    return PostProcessingManager(dict(BENCHMARK_CONFIG, zfs_path=zfs_path, results_json_path=zfs_path, **settings))
+
+
+def bench_discovery(zfs_path, file_names, settings):
+    from csv_manager import CSVManager
+    csv_data = CSVManager(zfs_path)
+    return [timed(lambda: csv_data.sort_file_list(csv_data.find_csv_files(PARENT_KEY, CHILD_KEY)))[0]]
+
+
+def bench_structure_check(zfs_path, file_names, settings):
+    from csv_manager import CSVManager
+    return [timed(CSVManager.file_structure_check, file_name[1])[0] for file_name in file_names]
+
+
+def bench_load_full(zfs_path, file_names, settings):
+    manager = benchmark_manager(zfs_path, dict(settings, pandas_chunk_size='0'))
+    return [timed(manager.pandas_manager_create(file_name[0]).data_frame_load, file_name[1])[0]
+            for file_name in file_names]
+
+
+def bench_load_streaming(zfs_path, file_names, settings):
+    manager = benchmark_manager(zfs_path, settings)
+    return [timed(manager.pandas_manager_create(file_name[0]).data_frame_load, file_name[1])[0]
+            for file_name in file_names]
+
+
+# Times the checks of every column on a full data-frame load, the load itself is not part of the measurement
+#
+def bench_column_checks(zfs_path, file_names, settings):
+    manager = benchmark_manager(zfs_path, dict(settings, pandas_chunk_size='0'))
+    measurements = []
+    for file_type, file_name in file_names:
+        pandas_data_frame = manager.pandas_manager_create(file_type)
+        pandas_data_frame.data_frame_load(file_name)
+        check_plan = manager.rules.check_plan(file_type)
+        for column in pandas_data_frame.data_frame_header_check():
+            checks = [check for check, check_columns in check_plan.items() if column in check_columns]
+            if checks:
+                measurements.append(dict(timed(pandas_data_frame.data_frame_column_checks, column, checks)[0],
+                                         check='{} {} {}'.format(file_type, column, ', '.join(checks))))
+    return measurements
+
+
+def bench_zip(zfs_path, file_names, settings):
+    manager = benchmark_manager(zfs_path, settings)
+    zip_path = os.path.dirname(file_names[0][1]) + '/'
+    measurement = timed(manager.file_zip, zip_path, 'benchmark_zip', file_names)[0]
+    os.remove(os.path.join(zip_path, 'benchmark_zip.zip'))
+    return [measurement]
+
+
+# Removes the results journals and the lease folder (done markers) written by a benchmark manager, every worker's, so
+# the next run in the same work dir starts with no ticket completed
+#
+def journal_remove(manager):
+    for journal_file_name in glob('{}l'.format(escape(manager.results_file_name))) + \
+            glob('{}l.*'.format(escape(manager.results_file_name))):
+        os.remove(journal_file_name)
+    shutil.rmtree('{}.leases'.format(manager.results_file_name), ignore_errors=True)
+
+
+# Runs the full child ticket path - discovery, checks, zip file and the jira calls - against the stubbed Jira
+#
+def bench_child_ticket_manager(zfs_path, file_names, settings):
+    manager = benchmark_manager(zfs_path, settings)
+    manager.jira_pars = StubJiraManager()
+    parent_ticket = StubTicket(PARENT_KEY, customer_name='Benchmark_Customer')
+    child_ticket = StubTicket(CHILD_KEY, date_range='2018-01-01_2018-06-30')
+    manager.child_tickets = [child_ticket]
+    # a results journal left by an earlier benchmark run would mark the child ticket as completed
+    journal_remove(manager)
+    measurement = timed(lambda: manager.child_ticket_manager(manager.child_ticket_jobs(parent_ticket)))[0]
+    for file_name in os.listdir(os.path.dirname(file_names[0][1])):
+        if file_name.endswith('.zip'):
+            os.remove(os.path.join(os.path.dirname(file_names[0][1]), file_name))
+    completed = manager.journal.journal_completed()
+    journal_remove(manager)
+    if CHILD_KEY not in completed:
+        raise RuntimeError('the child ticket failed its data checks')
+    return [measurement]
+
+
+# Writes the Jira fixtures of a run with the benchmark parent and child ticket, as a recorded run would
+#
+def replay_fixture_write(fixture_path):
+    from replay_manager import FIXTURE_FILE_NAME
+
+    parent_search = "project IN (CAM) AND issuetype = " + BENCHMARK_CONFIG['jql_issuetype'] + " AND status in " + \
+                    BENCHMARK_CONFIG['jql_status_parent'] + " AND summary ~ " + BENCHMARK_CONFIG['jql_text']
+    child_search = "parent in (" + PARENT_KEY + ") AND status = " + BENCHMARK_CONFIG['jql_status_child'] + \
+                   " AND labels = " + BENCHMARK_CONFIG['jql_label']
+    fixtures = {
+        'searches': {parent_search: [PARENT_KEY], child_search: [CHILD_KEY]},
+        'issues': {
+            PARENT_KEY: {'key': PARENT_KEY, 'fields': {'summary': 'Turn - BenchmarkCustomer', 'labels': [],
+                                                       'reporter': {'key': 'benchmark'}, 'parent': None}},
+            CHILD_KEY: {'key': CHILD_KEY, 'fields': {'summary': 'Turn - Post Processing', 'labels': ['Empty'],
+                                                     'customfield_10431': '2018-01-01',
+                                                     'customfield_10418': '2018-06-30',
+                                                     'reporter': {'key': 'benchmark'}, 'parent': {'key': PARENT_KEY}}}
+        },
+        'writes': [],
+        'latency': {}
+    }
+    os.makedirs(fixture_path, exist_ok=True)
+    with open(os.path.join(fixture_path, FIXTURE_FILE_NAME), 'w') as fp:
+        json.dump(fixtures, fp, indent=4)
+
+
+# Runs the whole run from the Jira searches on against the replayed Jira, serving the benchmark ticket copied
+# replay_scale times (e.g. --set replay_scale=100 replay_latency_ms=50), each copy checks the same csv files
+#
+def bench_parent_ticket_manager(zfs_path, file_names, settings):
+    fixture_path = os.path.join(zfs_path, 'replay')
+    replay_fixture_write(fixture_path)
+    manager = benchmark_manager(zfs_path, dict(dict(replay_mode='replay', replay_fixture_path=fixture_path),
+                                               **settings))
+    journal_remove(manager)
+    measurement = timed(manager.parent_ticket_manager)[0]
+    completed = manager.journal.journal_completed()
+    journal_remove(manager)
+    if os.path.isfile(manager.results_file_name):
+        os.remove(manager.results_file_name)
+    for file_name in os.listdir(os.path.dirname(file_names[0][1])):
+        if file_name.endswith('.zip'):
+            os.remove(os.path.join(os.path.dirname(file_names[0][1]), file_name))
+    for folder_name in os.listdir(zfs_path):
+        if folder_name.startswith(PARENT_KEY + '-R'):
+            shutil.rmtree(os.path.join(zfs_path, folder_name))
+    if len(completed) != manager.replay_scale:
+        raise RuntimeError('{} of the {} replayed child tickets passed their data checks'.format(
+            len(completed), manager.replay_scale))
+    return [measurement]
+
+
+BENCHMARKS = [
+    ['discovery', bench_discovery],
+    ['structure_check', bench_structure_check],
+    ['load_full', bench_load_full],
+    ['load_streaming', bench_load_streaming],
+    ['column_checks', bench_column_checks],
+    ['zip', bench_zip],
+    ['child_ticket_manager', bench_child_ticket_manager],
+    ['parent_ticket_manager', bench_parent_ticket_manager]
+]
+
+
+# Runs a single benchmark inside its worker process, summing the measurements of every file or check it timed
+#
+def benchmark_run(name, zfs_path, file_names, settings):
+    logging.basicConfig(level=logging.WARNING)
+    measurements = dict(BENCHMARKS)[name](zfs_path, file_names, settings)
+    return {
+        'seconds': sum(measurement['seconds'] for measurement in measurements),
+        'cpu_seconds': sum(measurement['cpu_seconds'] for measurement in measurements),
+        'checks': [measurement for measurement in measurements if 'check' in measurement],
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+# Generates the csv files for a benchmark size, reusing the files already generated by an earlier run
+#
+def benchmark_files(zfs_path, rows):
+    folder = os.path.join(zfs_path, PARENT_KEY, CHILD_KEY)
+    file_stub = 'Benchmark_Customer_2018-01-01_2018-06-30'
+    file_names = [['id', os.path.join(folder, '{}_id.csv'.format(file_stub))],
+                  ['upc', os.path.join(folder, '{}_upc.csv'.format(file_stub))]]
+    if not all(os.path.isfile(file_name[1]) for file_name in file_names):
+        file_names = DataGenerator().create_files(folder, file_stub, rows)
+    return file_names
+
+
+# Returns the current git revision of the code being benchmarked, if available
+#
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the post processing stages on synthetic csv files')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='rows per csv file for each benchmark size (10k to 100M)')
+    parser.add_argument('--work-dir', default='benchmark_data', help='folder for the generated csv files')
+    parser.add_argument('--output', default='benchmark_results.json', help='json file for the results')
+    parser.add_argument('--only', nargs='+', choices=[name for name, bench in BENCHMARKS],
+                        help='run only these benchmarks')
+    parser.add_argument('--set', nargs='+', default=[], metavar='KEY=VALUE',
+                        help='override a post processing setting, e.g. pandas_chunk_size=500000')
+    args = parser.parse_args()
+    settings = {}
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        if isinstance(BENCHMARK_CONFIG.get(key), bool):
+            value = value.lower() in ('1', 'yes', 'true', 'on')
+        settings[key] = value
+
+    run_results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'settings': dict(BENCHMARK_CONFIG, **settings),
+        'benchmarks': []
+    }
+    # spawned workers start clean, so each benchmark's peak RSS is not inflated by the runner or earlier benchmarks,
+    # executor workers (unlike multiprocessing pool workers) may start the child ticket and byte range process pools
+    context = multiprocessing.get_context('spawn')
+    for rows in args.rows:
+        zfs_path = os.path.join(os.path.abspath(args.work_dir), 'rows_{}'.format(rows)) + '/'
+        file_names = benchmark_files(zfs_path, rows)
+        file_bytes = sum(os.path.getsize(file_name[1]) for file_name in file_names)
+
+        for name, bench in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(benchmark_run, name, zfs_path, file_names, settings).result()
+            seconds = max(result['seconds'], 1e-9)
+            result.update({
+                'benchmark': name,
+                'rows': rows * len(file_names),
+                'bytes': file_bytes,
+                'rows_per_second': rows * len(file_names) / seconds,
+                'mb_per_second': file_bytes / seconds / (1024 * 1024)
+            })
+            run_results['benchmarks'].append(result)
+            print('{:<22}{:>12,} rows {:>10.3f} s {:>14,.0f} rows/s {:>9.1f} MB/s {:>9.1f} MB peak RSS'.format(
+                name, result['rows'], result['seconds'], result['rows_per_second'], result['mb_per_second'],
+                result['peak_rss_mb']))
+
+    with open(args.output, 'w') as fp:
+        json.dump(run_results, fp, indent=4)
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
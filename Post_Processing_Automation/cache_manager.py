@@ -0,0 +1,98 @@
+# cache_manager module
+# Module holds the class => CacheManager - manages the profiling results cache interface
+# Class responsible for storing and retrieving the data check results of each csv file on disk, keyed by the file
+# path, size, modified time and optionally a hash of the file contents, and for evicting the least recently used
+# results once the cache grows past its size limit
+#
+import hashlib
+import json
+import os
+import logging
+
+
+class CacheManager(object):
+    def __init__(self, cache_path, max_bytes, content_hash=False, refresh=False, check_settings=''):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.refresh = refresh
+        self.check_settings = check_settings
+        self.logger = logging.getLogger(__name__)
+
+    # Returns the stored data check results for a csv file, None when the file has no entry, has changed since it was
+    # profiled or a refresh was requested
+    #
+    def cache_get(self, file_name):
+        if self.refresh:
+            return None
+        try:
+            entry_name = self.cache_entry_name(file_name)
+            with open(entry_name, 'r') as fp:
+                results = json.load(fp)
+            # touch the entry so eviction removes the least recently used results first
+            os.utime(entry_name, None)
+        except (IOError, OSError, ValueError):
+            return None
+        else:
+            self.logger.info("Profile cache hit, the data checks were skipped for {}".format(file_name))
+            return results
+
+    # Stores the data check results for a csv file, then evicts old entries if the cache is over its size limit
+    #
+    def cache_put(self, file_name, results):
+        try:
+            if not os.path.isdir(self.cache_path):
+                os.makedirs(self.cache_path)
+            entry_name = self.cache_entry_name(file_name)
+            temp_name = '{}.{}.tmp'.format(entry_name, os.getpid())
+            with open(temp_name, 'w') as fp:
+                json.dump(results, fp)
+            os.replace(temp_name, entry_name)
+        except Exception as e:
+            self.logger.warning("There was a problem writing the profile cache entry for {} - {}".format(file_name, e))
+        else:
+            self.cache_evict()
+
+    # Removes the least recently used entries until the cache is back under its size limit
+    #
+    def cache_evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_path):
+            if entry.name.endswith('.json'):
+                try:
+                    entry_stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append([entry_stat.st_mtime, entry_stat.st_size, entry.path])
+
+        cache_bytes = sum(entry[1] for entry in entries)
+        for mtime, size, path in sorted(entries):
+            if cache_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            cache_bytes -= size
+
+    # Creates the cache entry file name from the file path, size, modified time, optional content hash and the data
+    # check settings, so a changed file or a changed set of checks never matches an old entry
+    #
+    def cache_entry_name(self, file_name):
+        file_stat = os.stat(file_name)
+        key_parts = [os.path.abspath(file_name), str(file_stat.st_size), str(file_stat.st_mtime_ns),
+                     self.check_settings]
+        if self.content_hash:
+            key_parts.append(self.file_hash(file_name))
+        cache_key = hashlib.sha256('|'.join(key_parts).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_path, '{}.json'.format(cache_key))
+
+    # Returns the SHA-256 hash of the file contents, read in blocks
+    #
+    @staticmethod
+    def file_hash(file_name, block_size=8 * 1024 * 1024):
+        file_hash = hashlib.sha256()
+        with open(file_name, 'rb') as fp:
+            for block in iter(lambda: fp.read(block_size), b''):
+                file_hash.update(block)
+        return file_hash.hexdigest()
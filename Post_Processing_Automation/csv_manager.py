@@ -1,8 +1,26 @@
 # csv_manager module
 # Module holds the class => CVSManager - manages the CVS File Interface
+# Module holds the class => StructureScan - counts the lines and field separators of a csv file's raw bytes
 # Class responsible for the CVS file name search, file type assignment and returns list of file names with file types
 #
 from glob import glob
+import mmap
+import os
+
+# Schema registry keyed by the file nickname => the column names in file order, the dtypes to read them as and the
+# columns to load, any column left out of dtypes is inferred by the parser (units stays numeric)
+CSV_SCHEMAS = {
+    'id': {
+        'columns': ['xid', 'txn_id'],
+        'dtypes': {'xid': str, 'txn_id': str},
+        'usecols': ['xid', 'txn_id']
+    },
+    'upc': {
+        'columns': ['txn_id', 'transactionDateTime', 'upc', 'units'],
+        'dtypes': {'txn_id': str, 'transactionDateTime': str, 'upc': str},
+        'usecols': ['txn_id', 'transactionDateTime', 'upc', 'units']
+    }
+}
 
 
 class CSVManager(object):
@@ -13,11 +31,49 @@ class CSVManager(object):
 
     # Locate and format the 2 csv file names, returns a list of lists with the full file path+name and type for each
     #
-    def find_csv_files(self, parent_ticket, child_ticket):
-        self.path = '{}{}/{}/'.format(self.zfs_path, parent_ticket.key, child_ticket.key)
+    def find_csv_files(self, parent_key, child_key):
+        self.path = '{}{}/{}/'.format(self.zfs_path, parent_key, child_key)
         file_names = self.get_file_names('{}*.csv'.format(self.path))
         return file_names
 
+    # Lists the child ticket folders of every parent ticket once, with one stat per csv file, returns a dict of
+    # (parent key, child key) => the csv file names with file types (as sort_file_list), their sizes and modified
+    # times, the total size, and the registered file types that are missing or csv files that are extra
+    #
+    def folder_index(self, parent_keys):
+        index = {}
+        for parent_key in parent_keys:
+            try:
+                child_entries = [entry for entry in os.scandir('{}{}/'.format(self.zfs_path, parent_key))
+                                 if entry.is_dir()]
+            except OSError:
+                continue
+            for child_entry in child_entries:
+                self.path = '{}{}/{}/'.format(self.zfs_path, parent_key, child_entry.name)
+                folder = {'files': [], 'sizes': {}, 'mtimes': {}, 'total bytes': 0, 'missing': [], 'extra': []}
+                try:
+                    csv_entries = sorted((entry for entry in os.scandir(self.path)
+                                          if entry.name.endswith('.csv') and not entry.name.startswith('.')),
+                                         key=lambda entry: entry.name)
+                    for csv_entry in csv_entries:
+                        file_name = self.path + csv_entry.name
+                        file_stat = csv_entry.stat()
+                        file_type = self.file_name_type(file_name)
+                        if file_type not in CSV_SCHEMAS or file_type in dict(folder['files']):
+                            # an unregistered or second file of a type is reported, it is never checked or zipped
+                            folder['extra'].append(csv_entry.name)
+                            continue
+                        folder['files'].append([file_type, file_name])
+                        folder['sizes'][file_name] = file_stat.st_size
+                        folder['mtimes'][file_name] = file_stat.st_mtime
+                        folder['total bytes'] += file_stat.st_size
+                except OSError:
+                    continue
+                file_types = dict(folder['files'])
+                folder['missing'] = [file_type for file_type in CSV_SCHEMAS if file_type not in file_types]
+                index[(parent_key, child_entry.name)] = folder
+        return index
+
     # sort list so id file is first and upc file is second, and add a file type to each, returning a list of lists
     #
     def sort_file_list(self, file_names):
@@ -38,6 +94,12 @@ class CSVManager(object):
         self.file_type = file_stub.split('.')[0]
         return self.file_type
 
+    # Returns the registered schema for a file nickname, None when the file type is not registered
+    #
+    @staticmethod
+    def file_schema(file_type):
+        return CSV_SCHEMAS.get(file_type)
+
     # Search specified zfs folder for what should be 2 files, get names and return as a list of file names
     #
     @staticmethod
@@ -46,3 +108,115 @@ class CSVManager(object):
         for file_name in glob(path):
             both_files.append(file_name)
         return both_files
+
+    # Scans the raw bytes of a csv file through a memory map, counting the newlines and '|' separators of every line
+    # with vectorized byte comparisons a window at a time, returns the data row count, the line numbers of rows whose
+    # field count differs from the header, and whether the file ends in a newline
+    #
+    @staticmethod
+    def file_structure_check(file_name, report_lines=20, window_size=64 * 1024 * 1024):
+        import numpy as np
+
+        scan = StructureScan(report_lines)
+        file_size = os.path.getsize(file_name)
+        if not file_size:
+            return scan.scan_result()
+
+        with open(file_name, 'rb') as csv:
+            mapped = mmap.mmap(csv.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in range(0, file_size, window_size):
+                    scan.window_scan(np.frombuffer(mapped, dtype=np.uint8,
+                                                   count=min(window_size, file_size - offset), offset=offset))
+            finally:
+                mapped.close()
+        return scan.scan_result()
+
+
+# Counts the newlines and '|' separators of every line of a csv file from its raw bytes, fed a window at a time from a
+# memory map or block by block from a stream (blocks are gathered into windows so numpy works on large arrays)
+#
+class StructureScan(object):
+    def __init__(self, report_lines=20, window_size=8 * 1024 * 1024):
+        self.report_lines = report_lines
+        self.window_size = window_size
+        self.structure = {'rows': 0, 'fields': 0, 'bad line count': 0, 'bad lines': [], 'ends with newline': False}
+        self.line_count = 0             # completed lines so far
+        self.line_pipes = 0             # separators seen so far in the line that is still open
+        self.header_pipes = None
+        self.last_byte = None
+        self.blocks = []                # stream blocks not scanned yet
+        self.block_bytes = 0
+
+    # Adds a bytes block read from a stream, scanning the gathered blocks once they fill a window
+    #
+    def scan_update(self, block):
+        self.blocks.append(block)
+        self.block_bytes += len(block)
+        if self.block_bytes >= self.window_size:
+            self.blocks_scan()
+
+    def blocks_scan(self):
+        import numpy as np
+
+        if self.blocks:
+            window = b''.join(self.blocks)
+            self.blocks = []
+            self.block_bytes = 0
+            self.window_scan(np.frombuffer(window, dtype=np.uint8))
+
+    # Scans the next window of the file, a numpy uint8 array
+    #
+    def window_scan(self, window):
+        import numpy as np
+
+        if not window.shape[0]:
+            return
+        self.last_byte = int(window[-1])
+        newline_positions = np.flatnonzero(window == 10)
+        pipe_positions = np.flatnonzero(window == 124)
+        if not newline_positions.shape[0]:
+            self.line_pipes += pipe_positions.shape[0]
+            return
+
+        # separators before each newline in the window, differenced into separators per line
+        pipes_before = np.searchsorted(pipe_positions, newline_positions)
+        line_field_pipes = np.diff(np.concatenate(([0], pipes_before)))
+        line_field_pipes[0] += self.line_pipes
+        if self.header_pipes is None:
+            self.header_pipes = int(line_field_pipes[0])
+
+        bad_lines = np.flatnonzero(line_field_pipes != self.header_pipes)
+        self.structure['bad line count'] += int(bad_lines.shape[0])
+        room = self.report_lines - len(self.structure['bad lines'])
+        self.structure['bad lines'].extend((bad_lines[:max(room, 0)] + self.line_count + 1).tolist())
+
+        self.line_count += newline_positions.shape[0]
+        self.line_pipes = pipe_positions.shape[0] - int(pipes_before[-1])
+
+    # Returns the structure of the file scanned so far, with the data row count and whether it is valid
+    #
+    def scan_result(self):
+        self.blocks_scan()
+        structure = self.structure
+        if self.last_byte is None:
+            structure['valid'] = False
+            return structure
+        structure['ends with newline'] = self.last_byte == 10
+
+        # a last line without a newline is still a row, checked against the header like every other row
+        line_count = self.line_count
+        header_pipes = self.header_pipes
+        if not structure['ends with newline']:
+            line_count += 1
+            if header_pipes is None:
+                header_pipes = self.line_pipes
+            elif self.line_pipes != header_pipes:
+                structure['bad line count'] += 1
+                if len(structure['bad lines']) < self.report_lines:
+                    structure['bad lines'].append(line_count)
+
+        structure['rows'] = line_count - 1
+        structure['fields'] = header_pipes + 1
+        structure['valid'] = structure['ends with newline'] and not structure['bad line count']
+        return structure
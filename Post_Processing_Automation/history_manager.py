@@ -0,0 +1,190 @@
+# history_manager module
+# Module holds the class => HistoryManager - manages the run history store interface
+# Class responsible for loading the per-file statistics of each run's results (row counts, distinct values, date
+# spans and min/max lengths) into a local SQLite store indexed by customer, file type, ticket and run date, and for
+# comparing a ticket's files with the same customer's files over the trailing weeks, flagging the statistics that
+# moved from their trailing median by more than the allowed deviation
+#
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import re
+import sqlite3
+
+HISTORY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS file_statistics (
+        ticket      TEXT NOT NULL,
+        file_type   TEXT NOT NULL,
+        run_date    TEXT NOT NULL,
+        statistic   TEXT NOT NULL,
+        customer    TEXT NOT NULL,
+        file_name   TEXT,
+        value       REAL NOT NULL,
+        PRIMARY KEY (ticket, file_type, run_date, statistic)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS file_statistics_customer ON file_statistics (customer, file_type, run_date);
+    CREATE INDEX IF NOT EXISTS file_statistics_run_date ON file_statistics (run_date);
+"""
+
+# results key suffixes of the per-column statistics kept in the history, with the file row count and date spans
+HISTORY_STATISTICS = [' distinct values', ' max length', ' min length']
+
+
+class HistoryManager(object):
+    def __init__(self, history_path, weeks=8, deviation=0.4, min_runs=2):
+        self.history_path = history_path
+        self.weeks = weeks
+        self.deviation = deviation          # change from the trailing median that is flagged, 0.4 is 40%
+        self.min_runs = min_runs            # earlier runs of a statistic needed before it is compared
+        self.connection = None
+        self.logger = logging.getLogger(__name__)
+
+    # Opens the store on first use, creating its table and indexes
+    #
+    def history_connect(self):
+        if self.connection is None:
+            history_folder = os.path.dirname(self.history_path)
+            if history_folder and not os.path.isdir(history_folder):
+                os.makedirs(history_folder, exist_ok=True)
+            self.connection = sqlite3.connect(self.history_path, timeout=60)
+            self.connection.executescript(HISTORY_SCHEMA)
+        return self.connection
+
+    def history_close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # Loads the file statistics of every ticket in a results json file, dated by the date in the file name (or the
+    # file's modified time), a ticket already loaded for the same date is replaced, returns the number of files loaded
+    #
+    def results_ingest(self, results_file_name, run_date=None):
+        run_date = run_date or self.results_run_date(results_file_name)
+        try:
+            with open(results_file_name, 'r') as fp:
+                run_results = json.load(fp)
+        except (OSError, ValueError) as e:
+            self.logger.error("The results file {} could not be read into the history - {}".format(
+                results_file_name, e))
+            return 0
+        rows = []
+        file_count = 0
+        for ticket_key, ticket_results in run_results.items():
+            if not isinstance(ticket_results, dict):
+                continue
+            for file_type, file_results in ticket_results.items():
+                if not isinstance(file_results, dict) or 'file name' not in file_results:
+                    continue
+                customer = ticket_results.get('customer name') or self.file_customer(file_results['file name'])
+                file_count += 1
+                for statistic, value in self.file_statistics(file_results).items():
+                    rows.append((ticket_key, file_type, run_date, statistic, customer, file_results['file name'],
+                                 value))
+        connection = self.history_connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO file_statistics (ticket, file_type, run_date, statistic, "
+                                   "customer, file_name, value) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.logger.info("{} file(s) of {} ticket(s) from {} were loaded into the history for {}".format(
+            file_count, len(run_results), results_file_name, run_date))
+        return file_count
+
+    # Compares each checked file of a ticket with the customer's files of the same type over the trailing weeks before
+    # the run date, returns the statistics compared and the ones that deviate from their trailing median, None when
+    # the customer has no earlier runs to compare with
+    #
+    def history_compare(self, customer, run_date, ticket_key, checked_files):
+        window_start = (datetime.strptime(run_date, '%Y-%m-%d') - timedelta(weeks=self.weeks)).strftime('%Y-%m-%d')
+        connection = self.history_connect()
+        compared = 0
+        deviations = []
+        for file_type, file_results in checked_files.items():
+            if not isinstance(file_results, dict) or 'file name' not in file_results:
+                continue
+            trailing = {}
+            for statistic, value in connection.execute(
+                    "SELECT statistic, value FROM file_statistics WHERE customer = ? AND file_type = ? AND "
+                    "run_date >= ? AND run_date < ? AND ticket != ?",
+                    (customer, file_type, window_start, run_date, ticket_key)):
+                trailing.setdefault(statistic, []).append(value)
+            for statistic, value in self.file_statistics(file_results).items():
+                if len(trailing.get(statistic, [])) < self.min_runs:
+                    continue
+                compared += 1
+                baseline = self.median(trailing[statistic])
+                if baseline and abs(value - baseline) / baseline > self.deviation:
+                    deviations.append({'file type': file_type, 'statistic': statistic,
+                                       'this run': self.value_format(value),
+                                       'trailing median': self.value_format(baseline),
+                                       'change': '{:+.0%}'.format((value - baseline) / baseline),
+                                       'runs': len(trailing[statistic])})
+        if not compared:
+            return None
+        if deviations:
+            self.logger.warning("{} statistic(s) of ticket {} moved by more than {:.0%} from the trailing {} week(s) "
+                                "of {} - {}".format(len(deviations), ticket_key, self.deviation, self.weeks, customer,
+                                                    [deviation['statistic'] for deviation in deviations]))
+        return {'weeks': self.weeks, 'allowed deviation': '{:.0%}'.format(self.deviation),
+                'statistics compared': compared, 'deviations': deviations}
+
+    # Returns the statistics of a file's results kept in the history - the row count, each column's distinct values
+    # and min/max lengths, and the days between the min and max value of each date column
+    #
+    @classmethod
+    def file_statistics(cls, file_results):
+        statistics = {}
+        for result_key, result in file_results.items():
+            if result_key == 'file rows' or any(result_key.endswith(suffix) for suffix in HISTORY_STATISTICS):
+                value = cls.number_parse(result)
+                if value is not None:
+                    statistics[result_key] = value
+            elif result_key.endswith(' max value'):
+                column = result_key[:-len(' max value')]
+                max_date = cls.date_parse(result)
+                min_date = cls.date_parse(file_results.get('{} min value'.format(column)))
+                if max_date is not None and min_date is not None:
+                    statistics['{} date span days'.format(column)] = float((max_date - min_date).days)
+        return statistics
+
+    # Returns the date a results file was written for, from its name (<app name>_YYYYMMDD.json) or modified time
+    #
+    @staticmethod
+    def results_run_date(results_file_name):
+        match = re.search(r'_(\d{8})\.json$', results_file_name)
+        if match:
+            return datetime.strptime(match.group(1), '%Y%m%d').strftime('%Y-%m-%d')
+        return datetime.fromtimestamp(os.path.getmtime(results_file_name)).strftime('%Y-%m-%d')
+
+    # Returns the customer part of a csv file name (<customer>_<start date>_<end date>_<file type>.csv), for results
+    # written before the customer name was kept with them
+    #
+    @staticmethod
+    def file_customer(file_name):
+        match = re.match(r'(.+?)_\d{4}-\d{2}-\d{2}_\d{4}-\d{2}-\d{2}', file_name)
+        if match:
+            return match.group(1)
+        return file_name.rsplit('_', 1)[0]
+
+    @staticmethod
+    def number_parse(result):
+        try:
+            return float(str(result).replace(',', ''))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def date_parse(result):
+        try:
+            return datetime.strptime(str(result)[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+
+    @staticmethod
+    def median(values):
+        values = sorted(values)
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+    @staticmethod
+    def value_format(value):
+        return '{:,.0f}'.format(value) if value == int(value) else '{:,.1f}'.format(value)
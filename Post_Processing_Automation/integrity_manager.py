@@ -0,0 +1,126 @@
+# integrity_manager module
+# Module holds the class => IntegrityManager - manages the cross-file referential integrity check interface
+# Class responsible for checking that every txn_id in the upc file exists in the id file and the reverse, using a
+# sorted array of 64 bit hashes of the id file txn_ids as the index (8 bytes per distinct key plus a 1 byte seen flag,
+# built from the distinct keys of each chunk, 8 bytes per key before the keys repeated across chunks are dropped) and
+# streaming the upc file against it a chunk at a time, returns the orphan counts and a sample of orphan keys
+#
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+class IntegrityManager(object):
+    def __init__(self, chunk_size=1000000, sample_size=10, column='txn_id'):
+        self.chunk_size = chunk_size
+        self.sample_size = sample_size
+        self.column = column
+        self.logger = logging.getLogger(__name__)
+
+    # Runs the check in both directions, upc file keys missing from the id file and id file keys never used in the
+    # upc file, a hash collision between two different keys (odds of about n*m/2^64) could hide a single orphan
+    #
+    def integrity_check(self, id_file_name, upc_file_name):
+        index = self.key_index(id_file_name)
+        seen = np.zeros(index.shape[0], dtype=bool)
+        upc_rows = 0
+        orphan_rows = 0
+        orphan_hashes = []
+        upc_sample = []
+
+        for keys in self.key_chunks(upc_file_name):
+            hashes = self.key_hashes(keys)
+            positions = np.searchsorted(index, hashes)
+            found = positions < index.shape[0]
+            found[found] = index[positions[found]] == hashes[found]
+            seen[positions[found]] = True
+
+            upc_rows += hashes.shape[0]
+            orphan_rows += int(np.count_nonzero(~found))
+            if not found.all():
+                orphan_hashes.append(np.unique(hashes[~found]))
+                if len(upc_sample) < self.sample_size:
+                    upc_sample = self.key_sample(upc_sample, keys.values[~found])
+
+        upc_orphans = np.unique(np.concatenate(orphan_hashes)).shape[0] if orphan_hashes else 0
+        id_orphans = int(index.shape[0] - np.count_nonzero(seen))
+        id_sample = self.unseen_sample(id_file_name, index, seen) if id_orphans else []
+
+        integrity = {
+            'id distinct txn_ids': '{:,}'.format(index.shape[0]),
+            'upc rows checked': '{:,}'.format(upc_rows),
+            'upc orphan rows': '{:,}'.format(orphan_rows),
+            'upc orphan txn_ids': '{:,}'.format(upc_orphans),
+            'upc orphan sample': upc_sample,
+            'id orphan txn_ids': '{:,}'.format(id_orphans),
+            'id orphan sample': id_sample
+        }
+        self.logger.info("txn_id integrity: {:,} upc row(s) ({:,} distinct txn_id(s)) are missing from the id file, "
+                         "{:,} id txn_id(s) have no upc rows".format(orphan_rows, upc_orphans, id_orphans))
+        return integrity
+
+    # Builds the index of the id file keys, the sorted distinct hashes, the keys repeated across chunks are dropped in
+    # place and the array is shrunk to the distinct keys
+    #
+    def key_index(self, file_name):
+        chunk_hashes = [np.unique(self.key_hashes(keys)) for keys in self.key_chunks(file_name)]
+        if not chunk_hashes:
+            return np.empty(0, dtype=np.uint64)
+        index = np.concatenate(chunk_hashes)
+        del chunk_hashes
+        index.sort()
+        index.resize(self.sorted_dedupe(index, self.chunk_size), refcheck=False)
+        return index
+
+    # Moves the distinct values of a sorted array to its front a block at a time behind a write cursor, returns their
+    # count, the write cursor never passes the block being read so the only copy made is of one block
+    #
+    @staticmethod
+    def sorted_dedupe(values, block_size):
+        cursor = 0
+        for start in range(0, values.shape[0], block_size):
+            block = values[start:start + block_size]
+            keep = np.empty(block.shape[0], dtype=bool)
+            keep[0] = cursor == 0 or block[0] != values[cursor - 1]
+            np.not_equal(block[1:], block[:-1], out=keep[1:])
+            kept = block[keep]
+            values[cursor:cursor + kept.shape[0]] = kept
+            cursor += kept.shape[0]
+        return cursor
+
+    # Returns a sample of the id file keys whose index entries were never seen in the upc file, a second read of the
+    # id file only made when there are such keys
+    #
+    def unseen_sample(self, file_name, index, seen):
+        sample = []
+        for keys in self.key_chunks(file_name):
+            unseen = ~seen[np.searchsorted(index, self.key_hashes(keys))]
+            if unseen.any():
+                sample = self.key_sample(sample, keys.values[unseen])
+                if len(sample) >= self.sample_size:
+                    break
+        return sample
+
+    # Yields the non-null keys of a csv file as string series, a chunk at a time, the file is closed when the chunks
+    # are not all read
+    #
+    def key_chunks(self, file_name):
+        with pd.read_csv(file_name, sep='|', usecols=[self.column], dtype={self.column: str},
+                         chunksize=self.chunk_size, engine='c') as reader:
+            for chunk in reader:
+                yield chunk[self.column].dropna()
+
+    # Adds new distinct keys to the sample, up to the sample size
+    #
+    def key_sample(self, sample, keys):
+        for key in keys:
+            if len(sample) >= self.sample_size:
+                break
+            if key not in sample:
+                sample.append(key)
+        return sample
+
+    @staticmethod
+    def key_hashes(keys):
+        return pd.util.hash_pandas_object(keys, index=False).values.astype(np.uint64)
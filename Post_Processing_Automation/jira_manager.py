@@ -4,16 +4,18 @@
 # posting and field updating.
 #
 from jira import JIRA
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import re
 import logging
+import threading
 
 
 class JiraManager(object):
-    def __init__(self, url, jira_token):
+    def __init__(self, url, jira_token, jira_client=None):
         self.parent_tickets = []
         self.child_tickets = []
-        self.jira = JIRA(url, basic_auth=jira_token)
+        # a client recording the run's traffic, or replaying a recorded run, is used in place of the server session
+        self.jira = jira_client if jira_client is not None else JIRA(url, basic_auth=jira_token)
         self.date_range = ""
         self.file_name = ""
         self.advert_field_name = ""
@@ -23,6 +25,13 @@ class JiraManager(object):
         self.comment_alert = 'zack.batt'
         self.zip_file_created_alert = 'The zip file has been created and the file counts are below:'
         self.quality_results_alert = 'These are the results of the quality checks: '
+        self.issue_fields = 'summary,customfield_10431,customfield_10418,reporter,labels,parent'
+        self.search_page_size = 100         # issues requested per search page, the server may return fewer
+        self.parent_batch_size = 50         # parent keys per bulk sub-task search, keeps the jql a sensible length
+        self.issue_cache = {}               # ticket key => issue, seeded from the search results for the run
+        self.issue_cache_hits = 0
+        self.issue_cache_misses = 0
+        self.issue_cache_lock = threading.Lock()   # the cache is shared with the background Jira write threads
 
     # Searches Jira for all tickets that match the parent ticket query criteria
     #
@@ -30,13 +39,13 @@ class JiraManager(object):
         # Query to find qualified Jira Tickets, includes matches for text: including 'Turn' but excluding 'Test'
         jql_query = "project IN (CAM) AND issuetype = " + issuetype + " AND status in " + status + " AND summary ~ " \
                     + text
-        self.parent_tickets = self.jira.search_issues(jql_query)
+        self.parent_tickets = self.search_all_issues(jql_query)
         return self.parent_tickets
 
     # Retrieves the required data from parent ticket to populate email
     #
     def parent_information_pull(self, ticket):
-        ticket = self.jira.issue(ticket.key)
+        ticket = self.issue_fetch(ticket)
         # Selects the final split value in the 'Summary' field and strips it of beginning and ending whitespace
         self.advert_field_name = ticket.fields.summary.split('-')[-1].strip()
         # Creates a name list split along whitespace and also splits if CamelHump notation exists
@@ -46,17 +55,36 @@ class JiraManager(object):
         self.advertiser_name = self.normalize_name(split_name)
         return self.advertiser_name
 
-    # Searches Jira for tickets that are sub-tasks of the list of parent tickets and require an email to be sent
+    # Searches Jira for the sub-tasks of all the parent tickets at once, returns a dict of parent key => sub-tasks
     #
-    def find_child_tickets(self, ticket, status, label):
-        jql_query = "parent in (" + ticket.key + ") AND status = " + status + " AND labels = " + label
-        self.child_tickets.extend(self.jira.search_issues(jql_query))
-        return self.child_tickets
+    def find_child_tickets_bulk(self, parent_tickets, status, label):
+        child_tickets = dict((ticket.key, []) for ticket in parent_tickets)
+        parent_keys = list(child_tickets)
+        for batch_start in range(0, len(parent_keys), self.parent_batch_size):
+            jql_query = "parent in (" + ", ".join(parent_keys[batch_start:batch_start + self.parent_batch_size]) \
+                        + ") AND status = " + status + " AND labels = " + label
+            for ticket in self.search_all_issues(jql_query):
+                child_tickets.setdefault(ticket.fields.parent.key, []).append(ticket)
+        self.child_tickets = [ticket for tickets in child_tickets.values() for ticket in tickets]
+        return child_tickets
+
+    # Runs a jql search page by page until every matching issue is returned, adding the issues to the issue cache
+    #
+    def search_all_issues(self, jql_query):
+        issues = []
+        while True:
+            page = self.jira.search_issues(jql_query, startAt=len(issues), maxResults=self.search_page_size,
+                                           fields=self.issue_fields)
+            issues.extend(page)
+            if not page or len(issues) >= page.total:
+                break
+        self.issue_cache_seed(issues)
+        return issues
 
     # Retrieves the required data from child ticket to populate email
     #
     def child_information_pull(self, ticket):
-        ticket = self.jira.issue(ticket.key)
+        ticket = self.issue_fetch(ticket)
         start_date = datetime.strptime(ticket.fields.customfield_10431, "%Y-%m-%d").strftime("%Y-%m-%d")
         end_date = datetime.strptime(ticket.fields.customfield_10418, "%Y-%m-%d").strftime("%Y-%m-%d")
         self.date_range = '{}_{}'.format(start_date, end_date)
@@ -65,7 +93,7 @@ class JiraManager(object):
     # Add a comment on ticket with zip file creation alert and csv file counts
     #
     def add_count_comment(self, ticket, zip_file_name, quality_checks):
-        ticket = self.jira.issue(ticket.key)
+        ticket = self.issue_fetch(ticket)
         reporter = ticket.fields.reporter.key
         message = """[~{attention}]
                      {zip_alert}
@@ -89,66 +117,157 @@ class JiraManager(object):
 
     # Add a comment to ticket with the quality checks results
     #
-    def add_quality_checks_results_comment(self, ticket, quality_checks):
-        ticket = self.jira.issue(ticket.key)
+    def add_quality_checks_results_comment(self, ticket, quality_checks, rules):
+        ticket = self.issue_fetch(ticket)
         reporter = ticket.fields.reporter.key
         message = """[~{attention}]
                      {quality_results_alert}
-        
-                     *{first_file_name}*
-                     ||Column Header||Quality Check||Result||
-                     |{first1_header}||Max Length||{max_lengths1}|
-                     | ||Min Length||{min_lengths1}|
-                     |{second1_header}||Max Length||{max_lengths2}|
-                     | ||Min Length||{min_lengths2}|
-                     |{second1_header}||Distinct Values||{dist_values}|
-                     | ||Total Values||{total_values}|
-                     
-                     *{second_file_name}*
-                     ||Column Header||Quality Check||Result||
-                     |{first2_header}||Max Length||{max_lengths3}|
-                     | ||Min Length||{min_lengths3}|
-                     |{second2_header}||Max Date||{max_dates}|
-                     | ||Min Date||{min_dates}|
-                     |{third2_header}||Max Length||{max_lengths4}|
-                     | ||Min Length||{min_lengths4}|
-                     |{fourth2_header}||Max Value||{max_values}|
-                     | ||Min Value||{min_values}|
-                     """.format(reporter, attention=self.comment_alert,
-                                quality_results_alert=self.quality_results_alert,
-                                first_file_name=quality_checks.get('id', {}).get('file name'),
-                                first1_header=quality_checks.get('id', {}).get('column headers')[0],
-                                max_lengths1=quality_checks.get('id', {}).get('xid max length'),
-                                min_lengths1=quality_checks.get('id', {}).get('xid min length'),
-                                second1_header=quality_checks.get('id', {}).get('column headers')[1],
-                                max_lengths2=quality_checks.get('id', {}).get('txn_id max length'),
-                                min_lengths2=quality_checks.get('id', {}).get('txn_id min length'),
-                                dist_values=quality_checks.get('id', {}).get('txn_id distinct values'),
-                                total_values=quality_checks.get('id', {}).get('txn_id count'),
-                                second_file_name=quality_checks.get('upc', {}).get('file name'),
-                                first2_header=quality_checks.get('upc', {}).get('column headers')[0],
-                                max_lengths3=quality_checks.get('upc', {}).get('txn_id max length'),
-                                min_lengths3=quality_checks.get('upc', {}).get('txn_id min length'),
-                                second2_header=quality_checks.get('upc', {}).get('column headers')[1],
-                                max_dates=quality_checks.get('upc', {}).get('transactionDateTime max value'),
-                                min_dates=quality_checks.get('upc', {}).get('transactionDateTime min value'),
-                                third2_header=quality_checks.get('upc', {}).get('column headers')[2],
-                                max_lengths4=quality_checks.get('upc', {}).get('upc max length'),
-                                min_lengths4=quality_checks.get('upc', {}).get('upc min length'),
-                                fourth2_header=quality_checks.get('upc', {}).get('column headers')[3],
-                                max_values=quality_checks.get('upc', {}).get('units max value'),
-                                min_values=quality_checks.get('upc', {}).get('units min value')
-                                )
+        """.format(reporter, attention=self.comment_alert, quality_results_alert=self.quality_results_alert)
+        # one results table per checked file, laid out from the file type's check rules
+        for file_type in rules.file_types():
+            if quality_checks.get(file_type):
+                message += self.check_results_message(quality_checks[file_type],
+                                                      rules.comment_rows(file_type, quality_checks[file_type]))
+        if quality_checks.get('integrity'):
+            message += self.integrity_results_message(quality_checks['integrity'])
+        if quality_checks.get('history'):
+            message += self.history_results_message(quality_checks['history'])
         self.jira.add_comment(issue=ticket, body=message)
         self.logger.info("The quality checks results have been added as a comment to "
                          "Jira Ticket: {}".format(ticket.key))
 
-    # Change the field 'labels' in the child ticket to the value 'CVSFiles_Counted' to omit from future search results
+    # Returns the results table of a file for the quality checks comment, one row per [column header, check, result]
+    #
+    @staticmethod
+    def check_results_message(file_results, rows):
+        message = """
+                     *{file_name}*
+""".format(file_name=file_results.get('file name'))
+        if file_results.get('empty value columns'):
+            message += "                     *FAILED - empty values in {}, the zip file was not created*\n".format(
+                ', '.join(file_results['empty value columns']))
+        message += "                     ||Column Header||Quality Check||Result||\n"
+        for column, check, result in rows:
+            message += "                     |{}||{}||{}|\n".format(column, check, result)
+        return message + "                     "
+
+    # Returns the txn_id cross-file check results table for the quality checks comment
     #
     @staticmethod
-    def update_field_value(ticket):
-        ticket.fields.labels.append(u'ZipFile_Created')
-        ticket.update(fields={'labels': ticket.fields.labels})
+    def integrity_results_message(integrity):
+        return """
+                     *txn_id cross-file check*
+                     ||Quality Check||Result||
+                     |upc rows with a txn_id missing from the id file|{upc_rows}|
+                     |upc txn_ids missing from the id file|{upc_orphans}|
+                     |Sample|{upc_sample}|
+                     |id txn_ids without upc rows|{id_orphans}|
+                     |Sample|{id_sample}|
+                     """.format(upc_rows=integrity.get('upc orphan rows'),
+                                upc_orphans=integrity.get('upc orphan txn_ids'),
+                                upc_sample=', '.join(integrity.get('upc orphan sample', [])) or '-',
+                                id_orphans=integrity.get('id orphan txn_ids'),
+                                id_sample=', '.join(integrity.get('id orphan sample', [])) or '-')
+
+    # Returns the run-over-run comparison table for the quality checks comment, the statistics that moved from their
+    # trailing median by more than the allowed deviation
+    #
+    @staticmethod
+    def history_results_message(history):
+        message = """
+                     *Run-over-run check against the trailing {weeks} week(s)*
+""".format(weeks=history.get('weeks'))
+        if not history.get('deviations'):
+            return message + "                     No change over {} from the trailing median in the {} statistics " \
+                             "compared\n                     ".format(history.get('allowed deviation'),
+                                                                      history.get('statistics compared'))
+        message += "                     ||File||Statistic||This Run||Trailing Median||Change||Runs||\n"
+        for deviation in history['deviations']:
+            message += "                     |{}|{}|{}|{}|{}|{}|\n".format(
+                deviation['file type'], deviation['statistic'], deviation['this run'], deviation['trailing median'],
+                deviation['change'], deviation['runs'])
+        return message + "                     "
+
+    # Change the field 'labels' in the child ticket to the value 'CVSFiles_Counted' to omit from future search results,
+    # the cached copy of the issue is dropped as it no longer matches the server, the label list is built fresh so a
+    # retried update sends the same labels and a ticket that already has the label is not updated
+    #
+    def update_field_value(self, ticket):
+        labels = list(ticket.fields.labels)
+        if u'ZipFile_Created' not in labels:
+            labels.append(u'ZipFile_Created')
+            ticket.update(fields={'labels': labels})
+        with self.issue_cache_lock:
+            self.issue_cache.pop(ticket.key, None)
+
+    # Returns the writes of a run already on a ticket - a quality checks or count comment (for this zip file) posted in
+    # the last day, or since the given time, and the zip file label, read fresh from the server for a ticket taken
+    # over from another worker or a comment whose answer was lost
+    #
+    def ticket_writes_posted(self, ticket, zip_file_name, since=None):
+        issue = self.jira.issue(ticket.key, fields='labels,comment')
+        since = since or datetime.now(timezone.utc) - timedelta(days=1)
+        comments = [comment.body for comment in issue.fields.comment.comments
+                    if datetime.strptime(comment.created, '%Y-%m-%dT%H:%M:%S.%f%z') >= since]
+        posted = []
+        if any(self.quality_results_alert in body for body in comments):
+            posted.append('jira quality comment')
+        if any(self.zip_file_created_alert in body and zip_file_name in body for body in comments):
+            posted.append('jira count comment')
+        if u'ZipFile_Created' in issue.fields.labels:
+            posted.append('jira label update')
+        return posted
+
+    # Adds the issues returned by a search to the run issue cache
+    #
+    def issue_cache_seed(self, tickets):
+        with self.issue_cache_lock:
+            for ticket in tickets:
+                self.issue_cache[ticket.key] = ticket
+
+    # Resets the per-run state of a session that is kept open between runs by the daemon - the issue cache and its
+    # counters, and the date used in the comments
+    #
+    def session_refresh(self):
+        with self.issue_cache_lock:
+            self.issue_cache = {}
+            self.issue_cache_hits = 0
+            self.issue_cache_misses = 0
+        self.today_date = (datetime.now() - timedelta(hours=6)).strftime('%m/%d/%Y')
+
+    # Sizes the session's connection pool for the background write threads, so each thread reuses a kept-alive
+    # connection instead of opening a new one per request, retries are left to the JiraWriteManager
+    #
+    def session_pool(self, pool_size):
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.jira._session.mount('https://', adapter)
+        self.jira._session.mount('http://', adapter)
+
+    # Sets the retries the jira client makes on its own for a 429 or 503 answer or a lost connection, returns the
+    # previous setting, None when the client has no such setting (a replayed run)
+    #
+    def session_retries(self, max_retries):
+        session = getattr(self.jira, '_session', None)
+        previous_retries = getattr(session, 'max_retries', None)
+        if previous_retries is not None:
+            session.max_retries = max_retries
+        return previous_retries
+
+    # Returns the issue from the run issue cache, only fetching it from the Jira server on a cache miss, the lock is
+    # not held during the fetch so a slow request does not hold up the other threads' cache hits
+    #
+    def issue_fetch(self, ticket):
+        with self.issue_cache_lock:
+            issue = self.issue_cache.get(ticket.key)
+            if issue is not None:
+                self.issue_cache_hits += 1
+                return issue
+            self.issue_cache_misses += 1
+        issue = self.jira.issue(ticket.key, fields=self.issue_fields)
+        with self.issue_cache_lock:
+            return self.issue_cache.setdefault(ticket.key, issue)
 
     # Applies rules to normalize the Advertiser names into Data Enablement accepted file-naming convention
     #
@@ -179,4 +298,7 @@ class JiraManager(object):
     # Ends the current JIRA session
     #
     def kill_session(self):
+        with self.issue_cache_lock:
+            self.logger.info("Jira issue cache: {} hit(s), {} fetch(es)".format(self.issue_cache_hits,
+                                                                               self.issue_cache_misses))
         self.jira.kill_session()
@@ -0,0 +1,226 @@
+# jira_write_manager module
+# Module holds the class => JiraWriteManager - manages the background Jira write interface
+# Class responsible for posting the comments and label updates of each child ticket from a bounded pool of threads
+# sharing the pooled Jira session, so the data checks of the next ticket run while the previous ticket's writes wait
+# on Jira, every request is held to the configured rate and retried with backoff on a 429 or 5xx answer, a comment
+# that may have been posted despite the error is only posted again once the ticket shows it is not there, and with
+# several hosts sharing the run nothing is posted once the worker has lost the ticket's lease
+#
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import logging
+import threading
+import time
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# writes that are not idempotent, posting one again after an answer that was lost would add a second comment
+COMMENT_WRITES = ['jira quality comment', 'jira count comment']
+
+# error of a write that was not made because another worker took over the ticket's lease and posts its writes
+LEASE_LOST = 'skipped, the lease of the ticket was taken over by another worker'
+
+
+class JiraWriteManager(object):
+    def __init__(self, jira_pars, metrics, workers=4, rate_per_second=5.0, retries=5, backoff_seconds=1.0):
+        self.jira_pars = jira_pars
+        self.metrics = metrics
+        self.workers = workers                  # threads posting the writes, 0 posts them in the calling thread
+        self.rate_interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.rate_lock = threading.Lock()
+        self.rate_next = 0.0                    # earliest time the next request may be sent
+        self.executor = None
+        self.pending = []                       # [ticket key, results, future] in submission order
+        self.logger = logging.getLogger(__name__)
+        # the jira client would retry a lost comment on its own, the retries are made here where they are checked
+        self.session_retries = self.jira_pars.session_retries(0)
+        if self.workers > 0:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.jira_pars.session_pool(self.workers)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    # Queues the writes of a child ticket, they are posted in order - the quality checks comment, then the count
+    # comment and the label update when the zip file was created, a recovered ticket (taken over from a worker that
+    # died) first checks Jira for the writes that worker already posted, lease_check returns whether the worker still
+    # holds the ticket's lease and is asked before each request
+    #
+    def ticket_writes_submit(self, child_ticket, zip_file_name, checked_files, zip_created, rules, recovered=False,
+                             lease_check=None):
+        writes = [['jira quality comment', self.jira_pars.add_quality_checks_results_comment,
+                   [child_ticket, checked_files, rules]]]
+        if zip_created:
+            writes.append(['jira count comment', self.jira_pars.add_count_comment,
+                           [child_ticket, zip_file_name, checked_files]])
+            writes.append(['jira label update', self.jira_pars.update_field_value, [child_ticket]])
+        posted_check = [self.jira_pars.ticket_writes_posted, [child_ticket, zip_file_name]]
+
+        if self.executor is None:
+            failures = self.ticket_writes(child_ticket.key, writes, posted_check, recovered, lease_check)
+            self.pending.append([child_ticket.key, checked_files, None])
+            checked_files['jira write failures'] = failures
+        else:
+            self.pending.append([child_ticket.key, checked_files,
+                                 self.executor.submit(self.ticket_writes, child_ticket.key, writes, posted_check,
+                                                      recovered, lease_check)])
+
+    # Returns the [ticket key, results] of each ticket whose writes have finished, in submission order, with any
+    # write that failed recorded in the results, wait blocks until every queued ticket has finished
+    #
+    def ticket_writes_done(self, wait=False):
+        done = []
+        while self.pending and (wait or self.pending[0][2] is None or self.pending[0][2].done()):
+            ticket_key, checked_files, future = self.pending.pop(0)
+            if future is not None:
+                try:
+                    checked_files['jira write failures'] = future.result()
+                except Exception as e:
+                    checked_files['jira write failures'] = [{'write': 'all', 'error': str(e), 'attempts': 0}]
+            if checked_files['jira write failures']:
+                self.logger.error("{} Jira write(s) failed for ticket {}, they are recorded in the results "
+                                  "file".format(len(checked_files['jira write failures']), ticket_key))
+            done.append([ticket_key, checked_files])
+        return done
+
+    # Waits for every queued write to finish and stops the threads, must be called before the session is ended, the
+    # jira client's own retries are put back for the reads of a session kept open by the daemon
+    #
+    def writes_drain(self):
+        done = self.ticket_writes_done(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.session_retries is not None:
+            self.jira_pars.session_retries(self.session_retries)
+        return done
+
+    # Posts the writes of a ticket one after another, a write that still fails after its retries is recorded and the
+    # ticket's later writes are skipped, so the label is never updated on a ticket that is missing its comments, a
+    # recovered ticket first reads the writes already on it (posted_check) and does not post them again
+    #
+    def ticket_writes(self, ticket_key, writes, posted_check, recovered=False, lease_check=None):
+        failures = []
+        posted = []
+        if recovered:
+            with self.metrics.stage('jira posted check', ticket=ticket_key):
+                self.rate_wait()
+                try:
+                    posted = posted_check[0](*posted_check[1])
+                except Exception as e:
+                    # nothing is posted when the ticket's earlier writes cannot be seen, a duplicate is worse
+                    self.logger.error("The posted writes check for ticket {} failed - {}".format(ticket_key, e))
+                    return [{'write': stage, 'error': 'skipped, the posted writes check failed - {}'.format(e),
+                             'attempts': 0} for stage, write, arguments in writes]
+            if posted:
+                self.logger.info("Ticket {} already has the {} write(s), they are not posted again".format(
+                    ticket_key, posted))
+        for stage, write, arguments in writes:
+            if stage in posted:
+                continue
+            if failures:
+                failures.append({'write': stage, 'error': 'skipped after an earlier write failed', 'attempts': 0})
+                continue
+            # a comment is only posted again once the ticket is read and has no such comment from this write, the
+            # minutes before it allow for the Jira server's clock
+            landed_check = None
+            if stage in COMMENT_WRITES:
+                landed_check = partial(self.write_landed, stage, posted_check,
+                                       datetime.now(timezone.utc) - timedelta(minutes=5))
+            with self.metrics.stage(stage, ticket=ticket_key):
+                error, attempts = self.write_retry(write, arguments, landed_check, lease_check)
+            if error is not None:
+                self.logger.error("The {} for ticket {} failed after {} attempt(s) - {}".format(stage, ticket_key,
+                                                                                              attempts, error))
+                failures.append({'write': stage, 'error': str(error), 'attempts': attempts})
+        return failures
+
+    # Runs a single write, retrying a 429 or 5xx answer or a lost connection with exponential backoff (or the wait
+    # the server asked for), returns the last error (None on success) and the number of attempts, a write that may
+    # have landed despite the error is only retried once landed_check reads that it did not, and no attempt is made
+    # once lease_check reads that the ticket's lease was lost to another worker
+    #
+    def write_retry(self, write, arguments, landed_check=None, lease_check=None):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_wait()
+            if lease_check is not None and not lease_check():
+                return LEASE_LOST, attempt - 1
+            try:
+                write(*arguments)
+            except Exception as e:
+                if attempt > self.retries or not self.write_retryable(e):
+                    return e, attempt
+                if landed_check is not None and self.write_maybe_landed(e):
+                    self.rate_wait()
+                    try:
+                        landed = landed_check()
+                    except Exception as check_error:
+                        # unknown whether the write landed, not posting it again is safer than a duplicate
+                        self.logger.error("The Jira write may have landed and the ticket could not be read to check, "
+                                          "it is not retried - {}".format(check_error))
+                        return e, attempt
+                    if landed:
+                        self.logger.warning("The Jira write failed ({}: {}) but is on the ticket, it is not posted "
+                                            "again".format(type(e).__name__, e))
+                        return None, attempt
+                delay = self.retry_after(e) or self.backoff_seconds * 2 ** (attempt - 1)
+                self.logger.warning("Jira write attempt {} failed, retrying in {:.1f} seconds - {}".format(
+                    attempt, delay, e))
+                time.sleep(delay)
+            else:
+                return None, attempt
+
+    # Returns True when the ticket has the comment of the write stage, posted since the given time
+    #
+    @staticmethod
+    def write_landed(stage, posted_check, since):
+        return stage in posted_check[0](*posted_check[1], since=since)
+
+    # Holds the calling thread until the next request is allowed by the rate limit, shared across every thread
+    #
+    def rate_wait(self):
+        if not self.rate_interval:
+            return
+        with self.rate_lock:
+            now = time.monotonic()
+            send_time = max(now, self.rate_next)
+            self.rate_next = send_time + self.rate_interval
+        if send_time > now:
+            time.sleep(send_time - now)
+
+    # Returns True for a rate limited or server side failure, or a lost connection, which are worth retrying
+    #
+    @staticmethod
+    def write_retryable(error):
+        status_code = getattr(error, 'status_code', None)
+        if status_code is None and getattr(error, 'response', None) is not None:
+            status_code = error.response.status_code
+        if status_code is not None:
+            return status_code in RETRY_STATUS_CODES
+        return isinstance(error, (ConnectionError, TimeoutError)) or \
+            type(error).__name__ in ('ConnectionError', 'Timeout', 'ReadTimeout', 'ConnectTimeout')
+
+    # Returns True for a failure the server may have answered after making the write - a 5xx answer, a read timeout or a
+    # connection lost after the request was sent, a 429 answer or a connection that was never made did not write
+    #
+    @staticmethod
+    def write_maybe_landed(error):
+        status_code = getattr(error, 'status_code', None)
+        if status_code is None and getattr(error, 'response', None) is not None:
+            status_code = error.response.status_code
+        if status_code is not None:
+            return status_code != 429
+        return type(error).__name__ != 'ConnectTimeout'
+
+    # Returns the seconds given in the Retry-After header of a rate limited answer, None when there is none
+    #
+    @staticmethod
+    def retry_after(error):
+        response = getattr(error, 'response', None)
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (AttributeError, TypeError, ValueError):
+            return None
@@ -0,0 +1,106 @@
+# journal_manager module
+# Module holds the class => JournalManager - manages the run results journal interface
+# Class responsible for appending each finished child ticket's results and status to a JSON Lines journal as the
+# ticket finishes, for finding the tickets a restarted run has already completed, and for compacting the journal into
+# the combined results json file, with several workers sharing a run each appends to a journal of its own and the
+# journals of every worker are read together
+#
+from glob import escape, glob
+import json
+import logging
+import os
+
+
+class JournalManager(object):
+    def __init__(self, results_file_name, worker_id=None):
+        self.results_file_name = results_file_name
+        self.journal_file_name = '{}l'.format(results_file_name)
+        if worker_id:
+            self.journal_file_name = '{}l.{}'.format(results_file_name, worker_id)
+        self.logger = logging.getLogger(__name__)
+
+    # Returns the set of ticket keys whose latest record in the journal is completed, a ticket whose zip file was
+    # blocked or whose Jira writes failed is worked again by a restarted run
+    #
+    def journal_completed(self):
+        return set(ticket_key for ticket_key, status in self.journal_statuses().items() if status == 'completed')
+
+    # Returns the status of the latest record of each ticket in the journal, a record cut short by a crash is removed
+    # so the next record is appended on a line of its own
+    #
+    def journal_statuses(self):
+        self.journal_repair()
+        statuses = {}
+        for record_position, ticket_key, record_line in self.journal_lines():
+            statuses[ticket_key] = json.loads(record_line).get('status')
+        return statuses
+
+    # Appends a finished ticket's results to the journal with its status - completed, blocked (no zip file was
+    # created) or write failed (a Jira write failed), the record is on disk before the method returns
+    #
+    def journal_append(self, ticket_key, results, status='completed'):
+        record_line = json.dumps({'ticket': ticket_key, 'status': status, 'results': results})
+        with open(self.journal_file_name, 'a') as fp:
+            fp.write(record_line + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    # Writes the combined results json file from the journal, one ticket at a time, in the same layout as a single
+    # json.dump of a dict of ticket results, the latest record of a ticket that was journaled twice is the one kept
+    # whatever its status
+    #
+    def journal_compact(self):
+        latest_records = {}
+        for record_position, ticket_key, record_line in self.journal_lines():
+            latest_records[ticket_key] = record_position
+
+        temp_name = '{}.{}.tmp'.format(self.results_file_name, os.getpid())
+        with open(temp_name, 'w') as fp:
+            fp.write('{')
+            separator = '\n'
+            # records another worker appends after the first pass are left for its own compaction
+            for record_position, ticket_key, record_line in self.journal_lines():
+                if latest_records.get(ticket_key) != record_position:
+                    continue
+                results = json.dumps(json.loads(record_line)['results'], indent=4).replace('\n', '\n    ')
+                fp.write('{}    {}: {}'.format(separator, json.dumps(ticket_key), results))
+                separator = ',\n'
+            fp.write('\n}' if latest_records else '}')
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_name, self.results_file_name)
+        return len(latest_records)
+
+    # Truncates the journal back to its last complete record
+    #
+    def journal_repair(self):
+        if not os.path.isfile(self.journal_file_name):
+            return
+        with open(self.journal_file_name, 'rb+') as fp:
+            journal = fp.read()
+            if journal and not journal.endswith(b'\n'):
+                self.logger.warning("Removing an incomplete record from the end of {}".format(self.journal_file_name))
+                fp.truncate(journal.rfind(b'\n') + 1)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    # Yields the position ([journal file name, line number]), ticket key and raw line of each record, the single
+    # worker journal first and then the worker journals in name order
+    #
+    def journal_lines(self):
+        journal_file_names = glob('{}l'.format(escape(self.results_file_name))) + \
+            sorted(glob('{}l.*'.format(escape(self.results_file_name))))
+        for journal_file_name in journal_file_names:
+            with open(journal_file_name, 'r') as fp:
+                for line_number, record_line in enumerate(fp):
+                    if not record_line.endswith('\n'):
+                        # another worker's journal may be part way through a record
+                        self.logger.warning("Ignoring an incomplete record at the end of {}".format(journal_file_name))
+                        break
+                    try:
+                        record = json.loads(record_line)
+                    except ValueError:
+                        self.logger.warning("Ignoring an unreadable record in {}".format(journal_file_name))
+                        continue
+                    if 'ticket' in record:
+                        yield (journal_file_name, line_number), record['ticket'], record_line
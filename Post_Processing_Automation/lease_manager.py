@@ -0,0 +1,246 @@
+# lease_manager module
+# Module holds the class => LeaseManager - manages the multi-host child ticket lease interface
+# Class responsible for sharing the child tickets of a run between workers on several hosts through lease files on
+# the zfs results share - a ticket is worked by the one worker whose exclusive create of its lease file succeeded,
+# the lease is kept alive by a heartbeat and taken over by another worker once it expires, and a done marker records
+# each finished ticket so it is never worked (or its Jira writes posted) twice in a run, a ticket whose zip file was
+# blocked or whose Jira writes failed is worked again by a later run (a done marker with another run id)
+#
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# lease key of the lock held while a worker merges every worker's journal into the results file
+MERGE_LOCK_KEY = '_results_merge'
+
+
+class LeaseManager(object):
+    def __init__(self, lease_path, worker_id=None, lease_seconds=600, heartbeat_seconds=60, run_id=''):
+        self.lease_path = lease_path
+        self.worker_id = worker_id or '{}.{}'.format(socket.gethostname(), os.getpid())
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.run_id = run_id                # shared by every worker of a run, recorded in the done markers
+        self.held_leases = set()            # ticket keys whose lease this worker holds
+        self.held_lock = threading.Lock()
+        self.heartbeat_thread = None
+        self.heartbeat_stop = threading.Event()
+        self.logger = logging.getLogger(__name__)
+        if not os.path.isdir(self.lease_path):
+            os.makedirs(self.lease_path, exist_ok=True)
+
+    def lease_name(self, ticket_key):
+        return os.path.join(self.lease_path, '{}.lease'.format(ticket_key))
+
+    def done_name(self, ticket_key):
+        return os.path.join(self.lease_path, '{}.done'.format(ticket_key))
+
+    # Tries to take the lease of a ticket, returns 'acquired', 'recovered' when an expired lease of another worker
+    # was taken over or an earlier run's Jira writes failed (its Jira writes may be partly posted), 'done' when the
+    # ticket was finished by any worker, or 'held' while another worker holds a live lease
+    #
+    def lease_acquire(self, ticket_key):
+        done_marker = self.done_marker(ticket_key)
+        if done_marker is not None and not self.done_retry(ticket_key, done_marker):
+            return 'done'
+        status = 'recovered' if done_marker is not None and done_marker['status'] == 'write failed' else 'acquired'
+        if not self.lease_create(ticket_key):
+            # a lease left by an earlier run of this same worker id is taken back straight away
+            if self.lease_owned(ticket_key):
+                status = 'recovered'
+            elif not self.lease_steal(ticket_key):
+                return 'held'
+            else:
+                status = 'recovered'
+        # a worker may have finished the ticket between the done check and the create
+        if os.path.exists(self.done_name(ticket_key)):
+            self.lease_release(ticket_key)
+            return 'done'
+        with self.held_lock:
+            self.held_leases.add(ticket_key)
+        self.heartbeat_start()
+        return status
+
+    # Records the ticket as finished with a done marker, its status (completed, blocked or write failed) and the run
+    # id, and gives up its lease, returns False without a marker when the lease was taken over by another worker,
+    # which then finishes the ticket
+    #
+    def lease_complete(self, ticket_key, status='completed'):
+        if not self.lease_owned(ticket_key):
+            self.logger.error("The lease of ticket {} was taken over by another worker, its done marker is left to "
+                              "that worker".format(ticket_key))
+            self.lease_release(ticket_key)
+            return False
+        try:
+            with open(self.done_name(ticket_key), 'w') as fp:
+                json.dump({'worker': self.worker_id, 'status': status, 'run': self.run_id, 'time': time.time()}, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+        except OSError as e:
+            self.logger.error("There was a problem writing the done marker of ticket {} - {}".format(ticket_key, e))
+        self.lease_release(ticket_key)
+        return True
+
+    # Returns the done marker of a ticket, None when the ticket has none
+    #
+    def done_marker(self, ticket_key):
+        return self.marker_read(self.done_name(ticket_key))
+
+    # Reads a done marker file, None when there is none, a marker that cannot be read is taken as completed so the
+    # ticket is not worked twice
+    #
+    @staticmethod
+    def marker_read(marker_name):
+        try:
+            with open(marker_name, 'r') as fp:
+                done_marker = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            return {'status': 'completed'}
+        done_marker.setdefault('status', 'completed')
+        return done_marker
+
+    # Moves the done marker of a blocked or write failed ticket out of the way when another run wrote it, so this run
+    # works the ticket again, returns False for a completed ticket or one finished by any worker of this run
+    #
+    def done_retry(self, ticket_key, done_marker):
+        if done_marker['status'] == 'completed' or done_marker.get('run') == self.run_id:
+            return False
+        done_name = self.done_name(ticket_key)
+        retry_name = '{}.retry.{}'.format(done_name, self.worker_id)
+        try:
+            os.rename(done_name, retry_name)
+        except FileNotFoundError:
+            # another worker moved it first, the lease decides which of them works the ticket
+            pass
+        else:
+            # a worker of this run may have worked the ticket and replaced the marker since it was read
+            moved_marker = self.marker_read(retry_name)
+            if moved_marker is not None and moved_marker.get('run') == self.run_id:
+                os.rename(retry_name, done_name)
+                return False
+            os.remove(retry_name)
+        self.logger.info("Ticket {} was {} in run {}, it is worked again".format(ticket_key, done_marker['status'],
+                                                                                done_marker.get('run')))
+        return True
+
+    # Takes the merge lock, the lease of MERGE_LOCK_KEY, waiting while another worker merges, the heartbeat renews it
+    # for a long merge and the lock of a worker that died is taken over once it expires like any other lease
+    #
+    def merge_lock_acquire(self, wait_seconds=1.0):
+        while self.lease_acquire(MERGE_LOCK_KEY) == 'held':
+            time.sleep(wait_seconds)
+
+    def merge_lock_release(self):
+        self.lease_release(MERGE_LOCK_KEY)
+        self.lease_stop()
+
+    # Gives up the lease of a ticket without finishing it, another worker can take it straight away
+    #
+    def lease_release(self, ticket_key):
+        with self.held_lock:
+            self.held_leases.discard(ticket_key)
+        if self.lease_owned(ticket_key):
+            try:
+                os.remove(self.lease_name(ticket_key))
+            except OSError:
+                pass
+
+    # Creates the lease file of a ticket, the exclusive create is atomic on the share so only one worker succeeds
+    #
+    def lease_create(self, ticket_key):
+        try:
+            lease_fd = os.open(self.lease_name(ticket_key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        self.lease_write(lease_fd)
+        return True
+
+    def lease_write(self, lease_fd):
+        with os.fdopen(lease_fd, 'w') as fp:
+            json.dump({'worker': self.worker_id, 'time': time.time()}, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    # Takes over an expired lease by renaming a fresh lease file of this worker over it, the rename replaces the file
+    # atomically so its holder never finds the lease missing, when several workers take it over at once the last
+    # rename wins and the others read another owner afterwards and leave it
+    #
+    def lease_steal(self, ticket_key):
+        lease_name = self.lease_name(ticket_key)
+        if not self.lease_expired(lease_name):
+            return False
+        expired_owner = self.lease_owner(lease_name)
+        fresh_name = '{}.take.{}'.format(lease_name, self.worker_id)
+        self.lease_write(os.open(fresh_name, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o644))
+        # the holder may have renewed the lease, or another worker taken it over, while the fresh one was written
+        if not self.lease_expired(lease_name):
+            os.remove(fresh_name)
+            return False
+        os.rename(fresh_name, lease_name)
+        if not self.lease_owned(ticket_key):
+            return False
+        self.logger.warning("Taking over the expired lease of ticket {} from worker {}".format(ticket_key,
+                                                                                             expired_owner))
+        return True
+
+    # Returns True when the lease file has not been renewed within the lease time, the age is taken from the file's
+    # modified time on the share so the hosts' clocks only need to agree to well within the lease time
+    #
+    def lease_expired(self, lease_name):
+        try:
+            return time.time() - os.stat(lease_name).st_mtime > self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def lease_owned(self, ticket_key):
+        return self.lease_owner(self.lease_name(ticket_key)) == self.worker_id
+
+    @staticmethod
+    def lease_owner(lease_name):
+        try:
+            with open(lease_name, 'r') as fp:
+                return json.load(fp).get('worker')
+        except (OSError, ValueError):
+            return None
+
+    # Starts the heartbeat thread that renews the held leases, once per worker
+    #
+    def heartbeat_start(self):
+        if self.heartbeat_thread is None:
+            self.heartbeat_stop.clear()
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat, name='lease-heartbeat', daemon=True)
+            self.heartbeat_thread.start()
+
+    # Renews every held lease each heartbeat, a lease found taken over by another worker is dropped and logged
+    #
+    def heartbeat(self):
+        while not self.heartbeat_stop.wait(self.heartbeat_seconds):
+            with self.held_lock:
+                held_leases = list(self.held_leases)
+            for ticket_key in held_leases:
+                try:
+                    if not self.lease_owned(ticket_key):
+                        raise OSError('the lease is held by worker {}'.format(
+                            self.lease_owner(self.lease_name(ticket_key))))
+                    os.utime(self.lease_name(ticket_key))
+                except OSError as e:
+                    self.logger.error("The lease of ticket {} was lost - {}".format(ticket_key, e))
+                    with self.held_lock:
+                        self.held_leases.discard(ticket_key)
+
+    # Stops the heartbeat and releases any lease still held
+    #
+    def lease_stop(self):
+        self.heartbeat_stop.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        with self.held_lock:
+            held_leases = list(self.held_leases)
+        for ticket_key in held_leases:
+            self.lease_release(ticket_key)
@@ -21,8 +21,22 @@
 # Required modules:     main.py,
 #                       turn_post_processing_manager.py,
 #                       jira_manager.py,
+#                       jira_write_manager.py,
 #                       csv_manager.py,
 #                       pandas_manager.py,
+#                       profile_manager.py,
+#                       cache_manager.py,
+#                       pipeline_manager.py,
+#                       sketch_manager.py,
+#                       sidecar_manager.py,
+#                       integrity_manager.py,
+#                       rule_manager.py,
+#                       metrics_manager.py,
+#                       journal_manager.py,
+#                       history_manager.py,
+#                       lease_manager.py,
+#                       replay_manager.py,
+#                       watcher_manager.py,
 #                       zip_manager.py,
 #                       config.ini
 # Deployed Location:    //prd-use1a-pr-34-ci-operations-01/home/bradley.ruck/Projects/data_enablement_pp/
@@ -43,13 +57,25 @@
 # the Data Enablement Post Processing Manager (TPPM), finally it launches the purge_files method to remove log files
 # that are older than a prescribed retention period
 #
+import argparse
 import configparser
+import importlib
 from datetime import datetime, timedelta
 import os
 import logging
+import socket
+import subprocess
+import sys
+import tempfile
 
-from VaultClient3 import VaultClient3 as VaultClient
 from turn_post_processing_manager import PostProcessingManager
+from watcher_manager import WatcherManager, RunLock
+
+LOG_FORMAT = '%(asctime)s: %(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s'
+LOG_DATE_FORMAT = '%m/%d/%Y %H:%M:%S'
+
+# modules the daemon imports before its first trigger, a single run only imports them when it has tickets to process
+DAEMON_WARM_MODULES = ['pandas_manager', 'profile_manager', 'zip_manager']
 
 
 # Define a console logger for development purposes
@@ -65,49 +91,143 @@ def console_logger():
     logging.getLogger('').addHandler(console)
 
 
-def main(con_opt='n'):
-    today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
-
-    # Get config files
+# Reads the configuration settings file
+#
+def config_read():
     config = configparser.ConfigParser()
     config.read('config.ini')
+    return config
+
+
+# Fetches the Jira credential from Vault, imported here so a replayed run does not need the Vault client
+#
+def vault_credential(config):
+    from VaultClient3 import VaultClient3 as VaultClient
 
-    # Vault Client Object
     VC_Obj = VaultClient("prod")
     pd = VC_Obj.VaultSecret('jira', str(config.get('Jira', 'authorization')))
+    return tuple([config.get('Jira', 'authorization'), pd])
+
+
+# Returns the run lock file name, in the local lock folder as the lock only has to keep out the runs on the same host,
+# with [MultiHost] enabled each worker id locks a file of its own so workers started on one host do not shut each
+# other out
+#
+def run_lock_name(config, app_name):
+    lock_path = config.get('LogFile', 'lock_path') or tempfile.gettempdir()
+    if config.getboolean('MultiHost', 'enabled'):
+        worker_id = config.get('MultiHost', 'worker_id') or socket.gethostname()
+        return os.path.join(lock_path, '{}.{}.lock'.format(app_name, worker_id))
+    return os.path.join(lock_path, '{}.lock'.format(app_name))
 
-    # Create a dictionary of configuration parameters
-    config_params = {
+
+# Creates a dictionary of configuration parameters
+#
+def config_params_create(config, jira_token):
+    return {
         "jira_url":             config.get('Jira', 'url'),
-        "jira_token":           tuple([config.get('Jira', 'authorization'), pd]),
+        "jira_token":           jira_token,
         "jql_status_parent":    config.get('Jira', 'status_parent'),
         "jql_status_child":     config.get('Jira', 'status_child'),
         "jql_issuetype":        config.get('Jira', 'issuetype'),
         "jql_label":            config.get('Jira', 'label'),
         "jql_text":             config.get('Jira', 'text'),
         "zfs_path":             config.get('cvsFile', 'path'),
+        "structure_check":      config.getboolean('cvsFile', 'structure_check'),
+        "structure_report_lines": config.get('cvsFile', 'report_lines'),
+        "child_ticket_workers": config.get('Processing', 'workers'),
+        "pipeline_mode":        config.getboolean('Processing', 'pipeline'),
+        "pandas_chunk_size":    config.get('Pandas', 'chunk_size'),
+        "pandas_engine":        config.get('Pandas', 'engine'),
+        "pandas_shard_workers": config.get('Pandas', 'shard_workers'),
+        "pandas_shard_min_mb":  config.get('Pandas', 'shard_min_mb'),
+        "distinct_error":       config.get('Pandas', 'distinct_error'),
+        "empty_report_rows":    config.get('Pandas', 'empty_report_rows'),
+        "profile_cache_path":   config.get('ProfileCache', 'path'),
+        "profile_cache_max_mb": config.get('ProfileCache', 'max_mb'),
+        "profile_cache_content_hash": config.getboolean('ProfileCache', 'content_hash'),
+        "profile_cache_refresh": config.getboolean('ProfileCache', 'refresh'),
+        "sidecar_format":       config.get('Sidecar', 'format'),
+        "sidecar_path":         config.get('Sidecar', 'path'),
+        "integrity_check":      config.getboolean('Integrity', 'check'),
+        "integrity_sample_size": config.get('Integrity', 'sample_size'),
+        "check_rules":          dict(config.items('Rules')),
+        "zip_compression":      config.get('ZipFile', 'compression'),
+        "zip_level":            config.get('ZipFile', 'level'),
+        "zip_workers":          config.get('ZipFile', 'workers'),
+        "multi_host":           config.getboolean('MultiHost', 'enabled'),
+        "worker_id":            config.get('MultiHost', 'worker_id'),
+        "lease_seconds":        config.get('MultiHost', 'lease_seconds'),
+        "heartbeat_seconds":    config.get('MultiHost', 'heartbeat_seconds'),
+        "run_id":               config.get('MultiHost', 'run_id'),
+        "jira_write_workers":   config.get('JiraWrites', 'workers'),
+        "jira_write_rate":      config.get('JiraWrites', 'rate_per_second'),
+        "jira_write_retries":   config.get('JiraWrites', 'retries'),
+        "jira_write_backoff":   config.get('JiraWrites', 'backoff_seconds'),
+        "replay_mode":          config.get('Replay', 'mode'),
+        "replay_fixture_path":  config.get('Replay', 'fixture_path'),
+        "replay_scale":         config.get('Replay', 'scale'),
+        "replay_latency_ms":    config.get('Replay', 'latency_ms'),
+        "replay_read_error_rate": config.get('Replay', 'read_error_rate'),
+        "replay_write_error_rate": config.get('Replay', 'write_error_rate'),
+        "replay_seed":          config.get('Replay', 'seed'),
+        "history_path":         config.get('History', 'path'),
+        "history_weeks":        config.get('History', 'weeks'),
+        "history_deviation":    config.get('History', 'deviation'),
+        "history_min_runs":     config.get('History', 'min_runs'),
         "results_json_path":    config.get('ResultsFile', 'path'),
         "results_json_name":    config.get('Project Details', 'app_name')
     }
 
+
+# Adds a log file to the root logger, for a single daemon run or the watcher itself, returns the handler
+#
+def file_logger(logfile_name):
+    file_handler = logging.FileHandler(logfile_name)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    logging.getLogger('').addHandler(file_handler)
+    return file_handler
+
+
+def main(con_opt='n', replay_mode=None, run_id=None):
+    today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
+
+    # Get config files
+    config = config_read()
+    if replay_mode is not None:
+        config.set('Replay', 'mode', replay_mode)
+    if run_id is not None:
+        config.set('MultiHost', 'run_id', run_id)
+
+    # Fetch the Jira credential from Vault and create the dictionary of configuration parameters, a replayed run
+    # never talks to Vault or the Jira server
+    if config.get('Replay', 'mode') == 'replay':
+        jira_token = (config.get('Jira', 'authorization'), '')
+    else:
+        jira_token = vault_credential(config)
+    config_params = config_params_create(config, jira_token)
+
     # Logfile path to point to the Operations_limited drive on zfs
     purge_days = config.get('LogFile', 'retention_days')
     log_file_path = config.get('LogFile', 'path')
     logfile_name = '{}{}_{}.log'.format(log_file_path, config.get('Project Details', 'app_name'), today_date)
 
-    # Check to see if log file already exits for the day to avoid duplicate execution
-    if not os.path.isfile(logfile_name):
-        logging.basicConfig(filename=logfile_name,
-                            level=logging.INFO,
-                            format='%(asctime)s: %(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s',
-                            datefmt='%m/%d/%Y %H:%M:%S')
+    logging.basicConfig(filename=logfile_name, level=logging.INFO, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
 
-        logger = logging.getLogger(__name__)
+    logger = logging.getLogger(__name__)
 
-        # this is only enacted if main.py is run as the executable
-        if con_opt and con_opt in ['y', 'Y']:
-            console_logger()
+    # this is only enacted if main.py is run as the executable
+    if con_opt and con_opt in ['y', 'Y']:
+        console_logger()
 
+    # Takes the run lock to avoid duplicate execution, a run already in progress (started by ActiveBatch or the
+    # daemon) ends this one
+    run_lock = RunLock(run_lock_name(config, config.get('Project Details', 'app_name')))
+    if not run_lock.acquire(wait=False):
+        logger.info("Another post processing run is in progress, this run has been skipped - {}".format(today_date))
+        return
+
+    try:
         logger.info("Process Start - Weekly Turn Post-Processing for Data Enablement - {}\n".format(today_date))
 
         # Create TPPM object and launch the Post Processor
@@ -116,10 +236,142 @@ def main(con_opt='n'):
 
         # Search logfile directory for old log files to purge
         de_turn_pp.purge_files(purge_days, log_file_path)
+    finally:
+        run_lock.release()
+
+
+# Runs as a long-running daemon, watching the trigger folder and running the Post Processor for each trigger drop
+# with the modules, configuration, Vault credential and Jira session already loaded, each run has its own log file
+#
+def daemon(con_opt='n'):
+    config = config_read()
+    app_name = config.get('Project Details', 'app_name')
+    purge_days = config.get('LogFile', 'retention_days')
+    log_file_path = config.get('LogFile', 'path')
+
+    logging.getLogger('').setLevel(logging.INFO)
+    file_logger('{}{}_watcher.log'.format(log_file_path, app_name))
+    logger = logging.getLogger(__name__)
+    if con_opt and con_opt in ['y', 'Y']:
+        console_logger()
+
+    watcher = WatcherManager(config.get('Watcher', 'trigger_path'), float(config.get('Watcher', 'poll_seconds')),
+                             lambda: vault_credential(config), float(config.get('Watcher', 'credential_ttl')),
+                             config.get('Jira', 'url'))
+    run_lock = RunLock(run_lock_name(config, app_name))
+
+    # loads the data check and zip modules, that a single run only imports when it has tickets to process, up front
+    # so the first trigger does not wait for them
+    for module_name in DAEMON_WARM_MODULES:
+        importlib.import_module(module_name)
+
+    for claimed in watcher.trigger_jobs():
+        today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
+        run_logger = file_logger('{}{}_{}.log'.format(log_file_path, app_name, today_date))
+        run_lock.acquire()
+        try:
+            logger.info("Process Start - Weekly Turn Post-Processing for Data Enablement - {} - triggered by "
+                        "{}\n".format(today_date, [os.path.basename(claim_name) for claim_name in claimed]))
+
+            # Create TPPM object with the warm Jira session and launch the Post Processor
+            jira_pars = watcher.jira_session()
+            de_turn_pp = PostProcessingManager(config_params_create(config, watcher.jira_token), jira_pars)
+            de_turn_pp.parent_ticket_manager()
+
+            # Search logfile directory for old log files to purge
+            de_turn_pp.purge_files(purge_days, log_file_path)
+        except Exception as e:
+            logger.exception("The post processing run failed, the Jira session will be reconnected - {}".format(e))
+            watcher.jira_reset()
+        finally:
+            run_lock.release()
+            watcher.trigger_complete(claimed)
+            logging.getLogger('').removeHandler(run_logger)
+            run_logger.close()
+
+
+# Loads the existing results json files into the run history store, every results file in the results folder when
+# no files are given, the files may be loaded again as each ticket's statistics are replaced
+#
+def history_backfill(file_patterns):
+    from glob import glob
+    from history_manager import HistoryManager
+
+    config = config_read()
+    if not config.get('History', 'path'):
+        print('The [History] path is not set in config.ini')
+        return 1
+    if not file_patterns:
+        file_patterns = ['{}{}_*.json'.format(config.get('ResultsFile', 'path'),
+                                              config.get('Project Details', 'app_name'))]
+    history = HistoryManager(config.get('History', 'path'))
+    file_count = 0
+    results_file_names = sorted(set(file_name for pattern in file_patterns for file_name in glob(pattern)))
+    try:
+        for results_file_name in results_file_names:
+            file_count += history.results_ingest(results_file_name)
+    finally:
+        history.history_close()
+    print('{:,} file(s) from {} results file(s) were loaded into {}'.format(file_count, len(results_file_names),
+                                                                            config.get('History', 'path')))
+    return 0
+
+
+# Re-runs main.py under python -X importtime with the same arguments and reports the modules that took the longest
+# to import, cumulative time including the modules they import and their own time
+#
+def import_time_report(argv, report_lines=25):
+    run = subprocess.Popen([sys.executable, '-X', 'importtime', os.path.abspath(__file__)] + argv,
+                           stderr=subprocess.PIPE, universal_newlines=True)
+    import_times = []
+    for line in run.stderr:
+        if not line.startswith('import time:'):
+            sys.stderr.write(line)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if fields[0].strip().isdigit():
+            import_times.append([int(fields[1]), int(fields[0]), fields[2].strip()])
+    run.wait()
+
+    print('\n{:>12} {:>12}  {}'.format('cumulative', 'self', 'module (microseconds)'))
+    for cumulative, own, module in sorted(import_times, reverse=True)[:report_lines]:
+        print('{:>12,} {:>12,}  {}'.format(cumulative, own, module))
+    print('{:>12,} {:>12}  total of {} module imports'.format(
+        sum(import_time[1] for import_time in import_times), '', len(import_times)))
+    return run.returncode
 
 
 if __name__ == '__main__':
-    # prompt user for use of console logging -> for use in development not production
-    ans = input("\nWould you like to enable a console logger for this run?\n Please enter y or n:\t")
-    print()
-    main(ans)
+    parser = argparse.ArgumentParser(description='Weekly Turn Post-Processing for Data Enablement')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, watching the trigger folder and processing each trigger drop')
+    parser.add_argument('--console', choices=['y', 'n'], help='enable the console logger without the prompt')
+    parser.add_argument('--replay', choices=['record', 'replay'],
+                        help='record the Jira traffic of the run into the [Replay] fixture_path, or replay a recorded '
+                             'run from it with no Jira server or Vault')
+    parser.add_argument('--run-id',
+                        help='id shared by the hosts of a [MultiHost] run, overrides the [MultiHost] run_id setting')
+    parser.add_argument('--history-backfill', nargs='*', metavar='RESULTS_FILE',
+                        help='load existing results json files into the [History] store, every results file in the '
+                             '[ResultsFile] path when none are given')
+    parser.add_argument('--importtime', action='store_true',
+                        help='run under python -X importtime and report the slowest module imports')
+    args = parser.parse_args()
+
+    if args.history_backfill is not None:
+        logging.getLogger('').setLevel(logging.INFO)
+        console_logger()
+        sys.exit(history_backfill(args.history_backfill))
+
+    if args.importtime:
+        sys.exit(import_time_report([arg for arg in sys.argv[1:] if arg != '--importtime']))
+
+    ans = args.console
+    if ans is None and not args.daemon:
+        # prompt user for use of console logging -> for use in development not production
+        ans = input("\nWould you like to enable a console logger for this run?\n Please enter y or n:\t")
+        print()
+    if args.daemon:
+        daemon(ans)
+    else:
+        main(ans, args.replay, args.run_id)
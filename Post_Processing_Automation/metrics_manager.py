@@ -0,0 +1,92 @@
+# metrics_manager module
+# Module holds the class => MetricsManager - manages the run instrumentation interface
+# Class responsible for timing each stage of the run (wall time, cpu time, bytes read/written and peak RSS) per ticket
+# and per file, and for the per-run summary table in the log, the bytes read/written come from the process wide
+# /proc/self/io counters so a stage run while other threads (Jira writes, lease heartbeat) were running also counts
+# their reads and writes, such a stage is flagged as io shared
+#
+from contextlib import contextmanager
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+
+class MetricsManager(object):
+    def __init__(self):
+        self.records = []
+        self.current_ticket = None          # ticket key recorded on stages that do not name their own ticket
+        self.logger = logging.getLogger(__name__)
+
+    # Measures the enclosed block as a stage, the yielded record can be given extra values such as a byte count for
+    # reads the process counters cannot see (memory mapped files), the cpu time is process wide like the bytes
+    #
+    @contextmanager
+    def stage(self, stage, file_name=None, ticket=None):
+        record = {'stage': stage, 'ticket': ticket or self.current_ticket,
+                  'file': os.path.basename(file_name) if file_name else None, 'bytes read': 0, 'bytes written': 0}
+        threads_start = threading.active_count()
+        read_start, written_start = self.process_io()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            read_end, written_end = self.process_io()
+            record['wall seconds'] = round(time.perf_counter() - wall_start, 4)
+            record['cpu seconds'] = round(time.process_time() - cpu_start, 4)
+            record['bytes read'] = max(record['bytes read'], read_end - read_start)
+            record['bytes written'] = max(record['bytes written'], written_end - written_start)
+            record['io shared'] = max(threads_start, threading.active_count()) > 1
+            record['peak rss mb'] = self.peak_rss_mb()
+            self.records.append(record)
+
+    # Returns the stage records for a single ticket
+    #
+    def ticket_records(self, ticket):
+        return [record for record in self.records if record['ticket'] == ticket]
+
+    # Logs the per-run summary table, one line per stage with the totals across every ticket and file, a stage marked
+    # with * ran alongside other threads and its bytes include theirs
+    #
+    def metrics_summary(self):
+        stages = {}
+        for record in self.records:
+            totals = stages.setdefault(record['stage'], [0, 0.0, 0.0, 0, 0, 0.0, False])
+            totals[0] += 1
+            totals[1] += record['wall seconds']
+            totals[2] += record['cpu seconds']
+            totals[3] += record['bytes read']
+            totals[4] += record['bytes written']
+            totals[5] = max(totals[5], record['peak rss mb'])
+            totals[6] = totals[6] or record['io shared']
+
+        lines = ['{:<40}{:>7}{:>12}{:>12}{:>12}{:>12}{:>12}'.format('Stage', 'Count', 'Wall s', 'CPU s', 'Read MB',
+                                                                  'Write MB', 'Peak MB')]
+        for stage, totals in sorted(stages.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<40}{:>7}{:>12.2f}{:>12.2f}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                stage + (' *' if totals[6] else ''), totals[0], totals[1], totals[2], totals[3] / 1048576.0,
+                totals[4] / 1048576.0, totals[5]))
+        if any(totals[6] for totals in stages.values()):
+            lines.append('* other threads were running, the read/write bytes and cpu time are for the whole process')
+        self.logger.info("Run stage summary:\n\t{}".format('\n\t'.join(lines)))
+
+    # Returns the bytes read and written by this process so far, from /proc where it exists, otherwise zeros
+    #
+    @staticmethod
+    def process_io():
+        try:
+            with open('/proc/self/io', 'r') as io_counters:
+                counters = dict(line.split(': ') for line in io_counters.read().splitlines())
+        except (IOError, OSError, ValueError):
+            return 0, 0
+        return int(counters.get('rchar', 0)), int(counters.get('wchar', 0))
+
+    # Returns the peak resident set size of this process in MB
+    #
+    @staticmethod
+    def peak_rss_mb():
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports kilobytes, macOS reports bytes
+        return round(peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0, 1)
@@ -2,63 +2,189 @@
 # Module holds the class => PandasManager - manages the Pandas data-frame interface
 # Class responsible for the Pandas data-frame creation and all pandas related functions
 #
+import numpy as np
 import pandas as pd
 import logging
 
+from sketch_manager import SketchManager
+
 
 class PandasManager(object):
-    def __init__(self):
+    def __init__(self, schema=None, engine='c', distinct_error=None, sidecar=None, empty_report_rows=10,
+                 check_columns=None):
         self.data_frame = pd.DataFrame()        # creates a new empty pandas data frame
+        self.schema = schema
+        self.engine = engine
+        self.distinct_error = distinct_error    # standard error of the distinct count estimate, None counts exactly
+        self.sidecar = sidecar                  # SidecarManager for the columnar copies of the csv files, or None
+        self.empty_report_rows = empty_report_rows  # file line numbers of empty values reported for each column
+        self.check_columns = check_columns      # columns the data checks read from a sidecar, None reads every column
+        self.col_headers = []                   # every column of a file loaded from its sidecar
+        self.string_columns = []
         self.logger = logging.getLogger(__name__)
 
-    # Load the contents of csv file into a pandas data-frame
+    # Load the contents of csv file into a pandas data-frame, read from an already open stream of the file if given,
+    # or from the file's columnar sidecar when it has a current one, a clean csv load writes the sidecar
     #
-    def data_frame_load(self, file_name):
-        with open(file_name, 'rb') as csv:
-            try:
-                self.data_frame = pd.read_csv(csv, sep='|')
-            except Exception as e:
-                self.logger.error("Data load problem, check the csv file: {} - {}".format(file_name, e))
+    def data_frame_load(self, file_name, csv_stream=None):
+        read_options = self.data_frame_read_options(file_name)
+        sidecar_settings = self.data_frame_sidecar_settings(read_options)
+        if csv_stream is None and self.data_frame_sidecar_read(file_name, sidecar_settings):
+            # a sidecar is only written for a file with values
+            return self.data_frame
+
+        sidecar_writer = self.sidecar.sidecar_writer(file_name, sidecar_settings) if self.sidecar else None
+        try:
+            if csv_stream is None:
+                with open(file_name, 'rb') as csv:
+                    self.data_frame = pd.read_csv(csv, **read_options)
+            else:
+                self.data_frame = pd.read_csv(csv_stream, **read_options)
+        except Exception as e:
+            self.logger.error("Data load problem, check the csv file: {} - {}".format(file_name, e))
+            if sidecar_writer:
+                sidecar_writer.discard()
+            return None
+        else:
+            # Check for any missing values
+            if self.data_frame.notnull().any().any():
+                if sidecar_writer:
+                    sidecar_writer.write(self.data_frame)
+                    sidecar_writer.close()
+                return self.data_frame
+            else:
                 return None
+
+    # Loads the data-frame from the csv file's columnar sidecar, only the columns with data checks are read, returns
+    # False when there is no current sidecar or it could not be read, so the csv file is read instead
+    #
+    def data_frame_sidecar_read(self, file_name, sidecar_settings):
+        if self.sidecar is None or not self.sidecar.sidecar_valid(file_name, sidecar_settings):
+            return False
+        try:
+            self.col_headers = self.sidecar.sidecar_columns(file_name)
+            self.data_frame = self.sidecar.sidecar_read(file_name, self.data_frame_check_columns(self.col_headers),
+                                                        sidecar_settings)
+        except Exception as e:
+            self.logger.warning("The sidecar for {} could not be read, reading the csv file - {}".format(file_name, e))
+            self.col_headers = []
+            return False
+        self.logger.info("Loaded {} from its columnar sidecar".format(file_name))
+        return True
+
+    # Returns the columns of a file that the data checks read, None when every column is read
+    #
+    def data_frame_check_columns(self, col_headers):
+        if self.check_columns is None:
+            return None
+        return [column for column in col_headers if column in self.check_columns]
+
+    # Returns the read settings a sidecar is written with, a sidecar is only read back with the same dtypes and columns
+    #
+    @staticmethod
+    def data_frame_sidecar_settings(read_options):
+        return repr([sorted(read_options.get('dtype', {}).items()), read_options.get('usecols')])
+
+    # Builds the read_csv options from the file schema, the declared dtypes and columns are only applied when the csv
+    # header matches the schema, otherwise the parser falls back to inferring every dtype
+    #
+    def data_frame_read_options(self, file_name):
+        read_options = {'sep': '|', 'engine': self.engine}
+        if self.schema:
+            with open(file_name, 'r') as csv:
+                header = csv.readline().rstrip('\r\n').split('|')
+            if header == self.schema['columns']:
+                read_options['dtype'] = self.schema['dtypes']
+                read_options['usecols'] = self.schema['usecols']
+                self.string_columns = [column for column, dtype in self.schema['dtypes'].items() if dtype is str]
             else:
-                # Check for any missing values
-                if self.data_frame.notnull().any().any():
-                    return self.data_frame
-                else:
-                    return None
+                self.logger.warning("The csv header {} does not match the schema columns {} - {}, reading with "
+                                    "inferred dtypes".format(header, self.schema['columns'], file_name))
+        return read_options
 
-    # Returns the number of rows and columns in the data-frame
+    # Returns the number of rows and columns in the data-frame, the columns of the file when only the checked columns
+    # were read from its sidecar
     #
     def data_frame_shape(self):
         rows = '{:,}'.format(self.data_frame.shape[0])
-        columns = '{:,}'.format(self.data_frame.shape[1])
+        columns = '{:,}'.format(len(self.col_headers) if self.col_headers else self.data_frame.shape[1])
         return rows, columns
 
-    # Returns the data-frame column headers as a list
+    # Returns the data-frame column headers as a list, every column of the file when it was read from its sidecar
     #
     def data_frame_header_check(self):
-        col_headers = self.data_frame.columns.tolist()
+        col_headers = list(self.col_headers) if self.col_headers else self.data_frame.columns.tolist()
         return col_headers
 
-    # Returns the maximum and minimum value for a given data-frame column
+    # Returns the results of the planned checks of a column (value, length, distinct and empty), keyed by result name,
+    # in one pass over the column for each aggregate - the value and the length ranges are each taken with a single
+    # agg, and the missing values mask is shared by the value range, the total count and the empty values check,
+    # missing values are left out of the value range so a string column with blanks is still compared
     #
-    def data_frame_min_max_col_value(self, column):
-        col_max = self.data_frame[column].max()
-        col_min = self.data_frame[column].min()
-        return str(col_max), str(col_min)
+    def data_frame_column_checks(self, column, checks):
+        column_data = self.data_frame[column]
+        null_mask = column_data.isna()
+        null_count = int(null_mask.sum())
+        column_checks = {}
+        if 'value' in checks:
+            col_min, col_max = column_data[~null_mask].agg(['min', 'max']) if null_count else \
+                column_data.agg(['min', 'max'])
+            column_checks['max value'] = str(col_max)
+            column_checks['min value'] = str(col_min)
+        if 'length' in checks:
+            min_len, max_len = self.data_frame_column_lengths(column_data).agg(['min', 'max'])
+            column_checks['max length'] = str(max_len)
+            column_checks['min length'] = str(min_len)
+        if 'distinct' in checks:
+            # counted exactly, or estimated with a HyperLogLog sketch when a distinct error is set
+            if self.distinct_error:
+                sketch = SketchManager(self.distinct_error)
+                sketch.sketch_update(column_data)
+                distinct_count = sketch.sketch_estimate()
+            else:
+                distinct_count = column_data.nunique()
+            column_checks['distinct values'] = '{:,}'.format(distinct_count)
+            column_checks['distinct method'] = self.data_frame_distinct_method()
+            column_checks['count'] = '{:,}'.format(column_data.shape[0] - null_count)
+        if 'empty' in checks:
+            null_mask, blank_mask = self.data_frame_column_empty(column_data, null_mask)
+            empty_rows = np.flatnonzero((null_mask | blank_mask).values)[:self.empty_report_rows] + 2
+            column_checks.update(self.data_frame_empty_results(null_count, int(blank_mask.sum()), empty_rows.tolist()))
+        return column_checks
 
-    # Returns the number of distinct and total values for a given data-frame column
+    # Returns the empty values check results of a column from its missing and whitespace-only value counts and the
+    # file line numbers of the first empty values
     #
-    def data_frame_distinct_values(self, column):
-        distinct_values_list = self.data_frame[column].value_counts()
-        col_list = self.data_frame[column].count()
-        distinct_values = '{:,}'.format(len(distinct_values_list))
-        col_count = '{:,}'.format(col_list)
-        return distinct_values, col_count
-
-    # Returns the largest and shortest lengths for a given data-frame column
+    @staticmethod
+    def data_frame_empty_results(null_count, blank_count, empty_rows):
+        return {'null values': '{:,}'.format(null_count), 'blank values': '{:,}'.format(blank_count),
+                'empty values': '{:,}'.format(null_count + blank_count), 'empty rows': empty_rows}
+
+    # Returns how the distinct values are counted, for the results and the quality checks comment
+    #
+    def data_frame_distinct_method(self):
+        if self.distinct_error:
+            return 'estimated'
+        return 'exact'
+
+    # Returns the masks of the missing (no value, or an empty field) and the whitespace-only values of a column, a
+    # missing values mask already taken is reused
+    #
+    @staticmethod
+    def data_frame_column_empty(column_data, null_mask=None):
+        if null_mask is None:
+            null_mask = column_data.isna()
+        if column_data.dtype == object:
+            # missing values strip to NaN, which never equals ''
+            blank_mask = column_data.str.strip().eq('')
+        else:
+            blank_mask = pd.Series(False, index=column_data.index)
+        return null_mask, blank_mask
+
+    # Returns the value lengths of a column, a vectorized string length for the schema string columns (blank values
+    # are skipped) and the string conversion of every value for inferred columns
     #
-    def data_frame_min_max_lengths(self, column):
-        max_len = self.data_frame[column].map(str).apply(len).max()
-        min_len = self.data_frame[column].map(str).apply(len).min()
-        return str(max_len), str(min_len)
+    def data_frame_column_lengths(self, column_data):
+        if column_data.name in self.string_columns:
+            return column_data.str.len().dropna().astype('int64')
+        return column_data.map(str).apply(len)
@@ -0,0 +1,52 @@
+# pipeline_manager module
+# Module holds the class => PipelineManager - manages the single-pass fused read interface
+# Class responsible for reading a csv file from zfs exactly once, handing every block to the data-frame reader while
+# also feeding it to a SHA-256 checksum, to the compressor of the file's zip member and, when given, to the csv
+# structure scan
+#
+import hashlib
+import io
+
+
+class PipelineManager(io.RawIOBase):
+    def __init__(self, csv, zip_member, structure_scan=None):
+        super(PipelineManager, self).__init__()
+        self.csv = csv
+        self.zip_member = zip_member
+        self.structure_scan = structure_scan
+        self.checksum = hashlib.sha256()
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    # Reads the next block of the csv file into the caller's buffer, passing the same bytes to the checksum and zip
+    #
+    def readinto(self, buffer):
+        size = self.csv.readinto(buffer)
+        if size:
+            block = bytes(memoryview(buffer)[:size])
+            self.checksum.update(block)
+            self.zip_member.write(block)
+            if self.structure_scan is not None:
+                self.structure_scan.scan_update(block)
+            self.bytes_read += size
+        return size
+
+    # Reads whatever the data-frame reader left unread, so the checksum and zip member always cover the whole file
+    #
+    def drain(self, block_size=8 * 1024 * 1024):
+        buffer = bytearray(block_size)
+        while self.readinto(buffer):
+            pass
+
+    # Returns the csv structure of the whole file, reading through whatever is left of it first
+    #
+    def file_structure(self):
+        self.drain()
+        return self.structure_scan.scan_result()
+
+    # Returns the SHA-256 checksum of the file contents read so far
+    #
+    def file_checksum(self):
+        return self.checksum.hexdigest()
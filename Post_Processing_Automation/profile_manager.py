@@ -0,0 +1,361 @@
+# profile_manager module
+# Module holds the class => ProfileManager - manages the streaming column profile interface
+# Class responsible for reading a csv file in fixed-size chunks and keeping running aggregates for every data check,
+# answering the same calls as the PandasManager while holding one chunk of the file in memory, a large file can be
+# split into newline aligned byte ranges profiled in separate processes and merged - the exact distinct count keeps a
+# set of every distinct value, which grows with the file, only the distinct estimate (distinct_error) is bounded
+#
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from pandas_manager import PandasManager
+from sketch_manager import SketchManager
+
+
+class ProfileManager(PandasManager):
+    def __init__(self, chunk_size, value_columns, length_columns, distinct_columns, schema=None, engine='c',
+                 distinct_error=None, sidecar=None, shard_workers=1, shard_min_bytes=0, empty_columns=(),
+                 empty_report_rows=10):
+        super(ProfileManager, self).__init__(schema, engine, distinct_error, sidecar, empty_report_rows,
+                                             list(value_columns) + list(length_columns) + list(distinct_columns) +
+                                             list(empty_columns))
+        self.chunk_size = chunk_size
+        self.value_columns = value_columns
+        self.length_columns = length_columns
+        self.distinct_columns = distinct_columns
+        self.empty_columns = empty_columns
+        self.shard_workers = shard_workers      # processes profiling byte ranges of one file, 1 reads it in one pass
+        self.shard_min_bytes = shard_min_bytes  # smallest file that is split into byte ranges
+        self.data_frame_reset()
+
+    # Clears the running aggregates
+    #
+    def data_frame_reset(self):
+        self.row_count = 0
+        self.col_headers = []
+        self.has_values = False
+        self.col_max_values = {}        # column => list of the maximum value found in each chunk
+        self.col_min_values = {}        # column => list of the minimum value found in each chunk
+        self.col_max_lengths = {}       # column => running maximum length
+        self.col_min_lengths = {}       # column => running minimum length
+        self.col_distinct_values = {}   # column => set of the distinct values found so far, or their sketch
+        self.col_dtypes = {}            # column => type the column is read as, for columns left out of the schema
+        self.col_counts = {}            # column => running count of non-null values
+        self.col_null_counts = {}       # column => running count of missing values
+        self.col_blank_counts = {}      # column => running count of whitespace-only values
+        self.col_empty_rows = {}        # column => file line numbers of the first empty values
+
+    # Stream the contents of csv file through the running aggregates one chunk at a time, read from an already open
+    # stream of the file if given, or from the file's columnar sidecar when it has a current one, the chunks of a clean
+    # csv load are written to the sidecar as they are read
+    #
+    def data_frame_load(self, file_name, csv_stream=None):
+        read_options = self.data_frame_read_options(file_name)
+        # the pyarrow engine cannot read in chunks, the streaming read always uses the c parser
+        read_options['engine'] = 'c'
+        sidecar_settings = self.data_frame_sidecar_settings(read_options)
+        if csv_stream is None and self.data_frame_sidecar_read(file_name, sidecar_settings):
+            return self
+        if csv_stream is None and self.shard_workers > 1 and os.path.getsize(file_name) >= self.shard_min_bytes:
+            return self.data_frame_load_sharded(file_name, read_options)
+
+        sidecar_writer = self.sidecar.sidecar_writer(file_name, sidecar_settings) if self.sidecar else None
+        try:
+            if csv_stream is None:
+                with open(file_name, 'rb') as csv:
+                    self.data_frame_stream(csv, read_options, sidecar_writer)
+            else:
+                self.data_frame_stream(csv_stream, read_options, sidecar_writer)
+        except Exception as e:
+            self.logger.error("Data load problem, check the csv file: {} - {}".format(file_name, e))
+            if sidecar_writer:
+                sidecar_writer.discard()
+            return None
+        else:
+            # Check for any missing values
+            if self.has_values:
+                if sidecar_writer:
+                    sidecar_writer.close()
+                return self
+            else:
+                if sidecar_writer:
+                    sidecar_writer.discard()
+                return None
+
+    # Reads the csv stream in chunks into the running aggregates, and into the sidecar writer if given
+    #
+    def data_frame_stream(self, csv_stream, read_options, sidecar_writer=None):
+        for chunk in pd.read_csv(csv_stream, chunksize=self.chunk_size, **read_options):
+            self.data_frame_update(chunk)
+            if sidecar_writer:
+                sidecar_writer.write(chunk)
+
+    # Splits the csv file into one newline aligned byte range per worker, profiles the ranges in parallel processes
+    # and merges their aggregates, every statistic except the distinct estimate is identical to a single pass and the
+    # estimate is too as the sketches merge losslessly, no sidecar is written by a sharded load
+    #
+    def data_frame_load_sharded(self, file_name, read_options):
+        from concurrent.futures import ProcessPoolExecutor
+
+        byte_ranges, header = self.byte_ranges(file_name, self.shard_workers)
+        # the header is read here once, each range is parsed headerless with the header's column names
+        shard_options = dict(read_options, header=None, names=header)
+        profile_settings = {'chunk_size': self.chunk_size, 'value_columns': self.value_columns,
+                            'length_columns': self.length_columns, 'distinct_columns': self.distinct_columns,
+                            'schema': self.schema, 'engine': self.engine, 'distinct_error': self.distinct_error,
+                            'empty_columns': self.empty_columns, 'empty_report_rows': self.empty_report_rows}
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.shard_workers, len(byte_ranges) or 1)) as executor:
+                shards = [executor.submit(profile_shard_worker, profile_settings, self.string_columns, file_name,
+                                          start, end, shard_options) for start, end in byte_ranges]
+                # merged in file order, the per-chunk value lists end up as they would from a single pass
+                for shard in shards:
+                    self.data_frame_merge(shard.result())
+        except Exception as e:
+            self.logger.error("Data load problem, check the csv file: {} - {}".format(file_name, e))
+            return None
+        self.logger.info("Profiled {} in {} byte range(s) with {} worker(s)".format(file_name, len(byte_ranges),
+                                                                                  self.shard_workers))
+        if not self.col_headers:
+            self.col_headers = [column for column in header if column in read_options.get('usecols', header)]
+        # Check for any missing values
+        if self.has_values:
+            return self
+        else:
+            return None
+
+    # Folds the aggregates of another profiler, of a different part of the same file, into this one
+    #
+    def data_frame_merge(self, other):
+        if not self.col_headers:
+            self.col_headers = other.col_headers
+        # the other profiler's line numbers start from the beginning of its own part of the file
+        for column, rows in other.col_empty_rows.items():
+            empty_rows = self.col_empty_rows.setdefault(column, [])
+            empty_rows.extend(row + self.row_count for row in rows[:self.empty_report_rows - len(empty_rows)])
+        for column, count in other.col_null_counts.items():
+            self.col_null_counts[column] = self.col_null_counts.get(column, 0) + count
+        for column, count in other.col_blank_counts.items():
+            self.col_blank_counts[column] = self.col_blank_counts.get(column, 0) + count
+        self.row_count += other.row_count
+        self.has_values = self.has_values or other.has_values
+        for column, values in other.col_max_values.items():
+            self.col_max_values.setdefault(column, []).extend(values)
+        for column, values in other.col_min_values.items():
+            self.col_min_values.setdefault(column, []).extend(values)
+        for column, length in other.col_max_lengths.items():
+            self.col_max_lengths[column] = max(self.col_max_lengths.get(column, 0), length)
+        for column, length in other.col_min_lengths.items():
+            self.col_min_lengths[column] = min(self.col_min_lengths.get(column, length), length)
+        for column, distinct in other.col_distinct_values.items():
+            if column not in self.col_distinct_values:
+                self.col_distinct_values[column] = distinct
+            elif self.distinct_error:
+                self.col_distinct_values[column].sketch_merge(distinct)
+            else:
+                self.col_distinct_values[column].update(distinct)
+        for column, count in other.col_counts.items():
+            self.col_counts[column] = self.col_counts.get(column, 0) + count
+
+    # Returns the byte ranges [start, end] of the data rows split into about equal parts, each starting at the
+    # beginning of a line, and the header column names, the files are unquoted so a newline always ends a row
+    #
+    @staticmethod
+    def byte_ranges(file_name, range_count):
+        file_size = os.path.getsize(file_name)
+        with open(file_name, 'rb') as csv:
+            header = csv.readline().decode().rstrip('\r\n').split('|')
+            boundaries = [csv.tell()]
+            for range_number in range(1, range_count):
+                target = boundaries[0] + (file_size - boundaries[0]) * range_number // range_count
+                # the byte before the target is read so a target that already starts a line is kept
+                csv.seek(max(target, boundaries[-1]) - 1)
+                csv.readline()
+                boundaries.append(min(csv.tell(), file_size))
+            boundaries.append(file_size)
+        return [[start, end] for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start], header
+
+    # Streams the columns with data checks of the csv file's columnar sidecar through the running aggregates, returns
+    # False when there is no current sidecar or it could not be read, so the csv file is read instead
+    #
+    def data_frame_sidecar_read(self, file_name, sidecar_settings):
+        if self.sidecar is None or not self.sidecar.sidecar_valid(file_name, sidecar_settings):
+            return False
+        try:
+            self.col_headers = self.sidecar.sidecar_columns(file_name)
+            for chunk in self.sidecar.sidecar_batches(file_name, self.chunk_size,
+                                                      self.data_frame_check_columns(self.col_headers)):
+                self.data_frame_update(chunk)
+            # a sidecar is only written for a file with values
+            self.has_values = True
+        except Exception as e:
+            self.logger.warning("The sidecar for {} could not be read, reading the csv file - {}".format(file_name, e))
+            self.data_frame_reset()
+            return False
+        self.logger.info("Profiled {} from its columnar sidecar".format(file_name))
+        return True
+
+    # Folds a single chunk into the running aggregates for each checked column
+    #
+    def data_frame_update(self, chunk):
+        if not self.col_headers:
+            self.col_headers = chunk.columns.tolist()
+        first_line = self.row_count + 2     # file line number of the chunk's first row, after the header line
+        self.data_frame_dtypes_force(chunk, first_line)
+        self.row_count += chunk.shape[0]
+        self.has_values = self.has_values or bool(chunk.notnull().any().any())
+
+        for column in self.col_headers:
+            if column in self.value_columns:
+                values = chunk[column].dropna()
+                self.col_max_values.setdefault(column, []).append(values.max())
+                self.col_min_values.setdefault(column, []).append(values.min())
+
+            if column in self.length_columns:
+                lengths = self.data_frame_column_lengths(chunk[column])
+                if lengths.shape[0]:
+                    self.col_max_lengths[column] = max(self.col_max_lengths.get(column, 0), lengths.max())
+                    self.col_min_lengths[column] = min(self.col_min_lengths.get(column, lengths.min()), lengths.min())
+
+            if column in self.distinct_columns:
+                if self.distinct_error:
+                    self.col_distinct_values.setdefault(column, SketchManager(self.distinct_error)).sketch_update(
+                        chunk[column])
+                else:
+                    self.col_distinct_values.setdefault(column, set()).update(chunk[column].dropna().unique())
+                self.col_counts[column] = self.col_counts.get(column, 0) + chunk[column].count()
+
+            if column in self.empty_columns:
+                null_mask, blank_mask = self.data_frame_column_empty(chunk[column])
+                self.col_null_counts[column] = self.col_null_counts.get(column, 0) + int(null_mask.sum())
+                self.col_blank_counts[column] = self.col_blank_counts.get(column, 0) + int(blank_mask.sum())
+                empty_rows = self.col_empty_rows.setdefault(column, [])
+                if len(empty_rows) < self.empty_report_rows:
+                    empty_rows.extend((np.flatnonzero((null_mask | blank_mask).values)[
+                        :self.empty_report_rows - len(empty_rows)] + first_line).tolist())
+
+    # Holds each column the schema leaves to the parser at the type inferred from the first chunk, so every chunk of
+    # the column is measured the same way, a chunk that type cannot hold without loss (a blank in an integer column,
+    # text in a numeric one) widens the column to the common type, logged as its max/min and lengths from then on may
+    # differ from a full data-frame load
+    #
+    def data_frame_dtypes_force(self, chunk, first_line):
+        if not self.col_dtypes:
+            declared = (self.schema or {}).get('dtypes', {})
+            self.col_dtypes = dict((column, chunk[column].dtype) for column in chunk.columns if column not in declared)
+            return
+        for column, dtype in self.col_dtypes.items():
+            if column not in chunk.columns or chunk[column].dtype == dtype:
+                continue
+            if np.can_cast(chunk[column].dtype, dtype, 'safe'):
+                chunk[column] = chunk[column].astype(dtype)
+                continue
+            common = np.result_type(chunk[column].dtype, dtype) \
+                if dtype != object and chunk[column].dtype != object else np.dtype(object)
+            self.logger.warning("Column {} was read as {} up to line {} and as {} after it, the column is widened to "
+                                "{}".format(column, dtype, first_line - 1, chunk[column].dtype, common))
+            self.col_dtypes[column] = common
+            chunk[column] = chunk[column].astype(common)
+
+    # Returns the number of rows and columns in the profiled file
+    #
+    def data_frame_shape(self):
+        rows = '{:,}'.format(self.row_count)
+        columns = '{:,}'.format(len(self.col_headers))
+        return rows, columns
+
+    # Returns the profiled file column headers as a list
+    #
+    def data_frame_header_check(self):
+        return list(self.col_headers)
+
+    # Returns the results of the planned checks of a column, keyed by result name, from the aggregates kept while the
+    # chunks were read
+    #
+    def data_frame_column_checks(self, column, checks):
+        column_checks = {}
+        if 'value' in checks:
+            column_checks['max value'], column_checks['min value'] = self.data_frame_min_max_col_value(column)
+        if 'length' in checks:
+            column_checks['max length'], column_checks['min length'] = self.data_frame_min_max_lengths(column)
+        if 'distinct' in checks:
+            distinct_values, col_count = self.data_frame_distinct_values(column)
+            column_checks['distinct values'] = distinct_values
+            column_checks['distinct method'] = self.data_frame_distinct_method()
+            column_checks['count'] = col_count
+        if 'empty' in checks:
+            column_checks.update(self.data_frame_empty_results(*self.data_frame_empty_values(column)))
+        return column_checks
+
+    # Returns the maximum and minimum value for a given column, the per-chunk results are reduced the same way pandas
+    # reduces a whole column so the values (and their formatting) match a full data-frame load, a column inferred as
+    # numbers in some chunks and as strings in others (a stray blank) is compared as strings
+    #
+    def data_frame_min_max_col_value(self, column):
+        max_values = pd.Series(self.col_max_values[column]).dropna()
+        min_values = pd.Series(self.col_min_values[column]).dropna()
+        try:
+            col_max, col_min = max_values.max(), min_values.min()
+        except TypeError:
+            col_max, col_min = max_values.astype(str).max(), min_values.astype(str).min()
+        return str(col_max), str(col_min)
+
+    # Returns the number of distinct and total values for a given column
+    #
+    def data_frame_distinct_values(self, column):
+        if self.distinct_error:
+            distinct_count = self.col_distinct_values[column].sketch_estimate() \
+                if column in self.col_distinct_values else 0
+        else:
+            distinct_count = len(self.col_distinct_values.get(column, ()))
+        distinct_values = '{:,}'.format(distinct_count)
+        col_count = '{:,}'.format(self.col_counts.get(column, 0))
+        return distinct_values, col_count
+
+    # Returns the number of missing and whitespace-only values for a given column, and the file line numbers of the
+    # first empty values
+    #
+    def data_frame_empty_values(self, column):
+        return self.col_null_counts.get(column, 0), self.col_blank_counts.get(column, 0), \
+            list(self.col_empty_rows.get(column, []))
+
+    # Returns the largest and shortest lengths for a given column
+    #
+    def data_frame_min_max_lengths(self, column):
+        max_len = self.col_max_lengths.get(column, float('nan'))
+        min_len = self.col_min_lengths.get(column, float('nan'))
+        return str(max_len), str(min_len)
+
+
+# Helper class for the sharded load - reads one byte range of an open csv file and then reports the end of the file
+#
+class ByteRange(io.RawIOBase):
+    def __init__(self, csv, start, end):
+        super(ByteRange, self).__init__()
+        self.csv = csv
+        self.csv.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        size = self.csv.readinto(memoryview(buffer)[:size])
+        self.remaining -= size
+        return size
+
+
+# Profiles one byte range of a csv file in a worker process, returns the profiler with the range's aggregates
+#
+def profile_shard_worker(profile_settings, string_columns, file_name, start, end, read_options):
+    profiler = ProfileManager(**profile_settings)
+    profiler.string_columns = string_columns
+    with open(file_name, 'rb') as csv:
+        profiler.data_frame_stream(io.BufferedReader(ByteRange(csv, start, end)), read_options)
+    return profiler
@@ -0,0 +1,351 @@
+# replay_manager module
+# Module holds the class => ReplayManager - manages the recorded Jira traffic interface
+# Class responsible for recording the searches, issue fetches, comments and label updates of a real run into a local
+# fixture file, and for serving a recorded run back from a local stand-in for the Jira client, with injected latency
+# and errors and the recorded tickets copied scale times over, so the whole run can be profiled and load tested with
+# no Jira server, Vault or network
+#
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import copy
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+FIXTURE_FILE_NAME = 'jira_fixtures.json'
+WRITES_FILE_NAME = 'replay_writes.json'
+WRITE_REQUESTS = ['comment', 'update']
+
+
+class ReplayManager(object):
+    def __init__(self, mode, fixture_path, scale=1, latency_ms=None, read_error_rate=0.0, write_error_rate=0.0,
+                 seed=2019):
+        self.mode = mode                            # record or replay
+        self.fixture_file_name = os.path.join(fixture_path, FIXTURE_FILE_NAME)
+        self.writes_file_name = os.path.join(fixture_path, WRITES_FILE_NAME)
+        self.scale = max(scale, 1)                  # copies of each recorded ticket served by the replay
+        self.latency_ms = latency_ms                # added to each replayed request, None for the recorded times
+        self.read_error_rate = read_error_rate
+        self.write_error_rate = write_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.fixtures = {'searches': {}, 'issues': {}, 'writes': [], 'latency': {}}
+        self.child_keys = set()                     # keys returned by a recorded sub-task search
+        self.replay_writes = []
+        self.request_counts = {}                    # request => [requests, injected errors]
+        self.logger = logging.getLogger(__name__)
+
+    # Returns the Jira client for the run - the real client wrapped to record its traffic, or the local stand-in
+    # serving the recorded fixtures
+    #
+    def jira_client(self, url, jira_token):
+        if self.mode == 'record':
+            from jira import JIRA
+
+            self.logger.info("Recording the Jira traffic of the run into {}".format(self.fixture_file_name))
+            return JiraRecorder(JIRA(url, basic_auth=jira_token), self)
+        self.fixture_load()
+        return JiraReplay(self)
+
+    # Reads the recorded fixtures and adds the scaled copies of every ticket, copy 1 keeps the recorded keys
+    #
+    def fixture_load(self):
+        with open(self.fixture_file_name, 'r') as fp:
+            self.fixtures = json.load(fp)
+        issues = self.fixtures['issues']
+        for copy_number in range(2, self.scale + 1):
+            for key, raw in list(issues.items()):
+                if self.scaled_key_original(key) != key:
+                    continue
+                scaled_raw = copy.deepcopy(raw)
+                scaled_raw['key'] = self.scaled_key(key, copy_number)
+                if scaled_raw['fields'].get('parent'):
+                    scaled_raw['fields']['parent']['key'] = self.scaled_key(scaled_raw['fields']['parent']['key'],
+                                                                            copy_number)
+                issues[scaled_raw['key']] = scaled_raw
+        for jql, keys in self.fixtures['searches'].items():
+            self.fixtures['searches'][jql] = [self.scaled_key(key, copy_number) for copy_number
+                                              in range(1, self.scale + 1) for key in keys]
+            if self.sub_task_parents(jql) is not None:
+                self.child_keys.update(self.fixtures['searches'][jql])
+        self.logger.info("Replaying {} recorded Jira issue(s) from {}, scaled {} time(s) to {} issue(s)".format(
+            len(issues) // self.scale, self.fixture_file_name, self.scale, len(issues)))
+
+    # Writes the recorded fixtures at the end of a recorded run
+    #
+    def fixture_save(self):
+        with self.lock:
+            fixtures = dict(self.fixtures, recorded=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            if not os.path.isdir(os.path.dirname(self.fixture_file_name) or '.'):
+                os.makedirs(os.path.dirname(self.fixture_file_name), exist_ok=True)
+            with open(self.fixture_file_name, 'w') as fp:
+                json.dump(fixtures, fp, indent=4)
+        self.logger.info("{} Jira search(es), {} issue(s) and {} write(s) were recorded into {}".format(
+            len(fixtures['searches']), len(fixtures['issues']), len(fixtures['writes']), self.fixture_file_name))
+
+    # Records a search page, the issues returned and the time the request took
+    #
+    def search_record(self, jql, start_at, issues, seconds):
+        with self.lock:
+            keys = self.fixtures['searches'].setdefault(jql, [])
+            if start_at == 0:
+                del keys[:]
+            keys.extend(issue.key for issue in issues)
+            for issue in issues:
+                self.issue_merge(issue.raw)
+            self.fixtures['latency'].setdefault('search', []).append(round(seconds, 4))
+
+    # Records a fetched issue and the time the request took
+    #
+    def issue_record(self, issue, seconds):
+        with self.lock:
+            self.issue_merge(issue.raw)
+            self.fixtures['latency'].setdefault('issue', []).append(round(seconds, 4))
+
+    # Records a comment or label update and the time the request took
+    #
+    def write_record(self, request, key, content, seconds):
+        with self.lock:
+            self.fixtures['writes'].append({'request': request, 'key': key, 'content': content})
+            self.fixtures['latency'].setdefault(request, []).append(round(seconds, 4))
+
+    # Adds the fields of a fetched issue to its recorded fields, each request may ask for different fields
+    #
+    def issue_merge(self, raw):
+        recorded = self.fixtures['issues'].setdefault(raw['key'], {'key': raw['key'], 'fields': {}})
+        recorded['fields'].update(raw.get('fields', {}))
+
+    # Returns a replayed search page and the total matches, a sub-task search is answered for its parent keys (so the
+    # scaled parents' batches match), any other search must have been recorded with the same jql
+    #
+    def search_replay(self, jql, start_at, max_results):
+        self.request_wait('search')
+        parent_keys = self.sub_task_parents(jql)
+        if parent_keys is not None:
+            keys = [key for key, raw in self.fixtures['issues'].items() if key in self.child_keys and
+                    (raw['fields'].get('parent') or {}).get('key') in parent_keys]
+        elif jql in self.fixtures['searches']:
+            keys = self.fixtures['searches'][jql]
+        else:
+            self.logger.warning("The search was not recorded, it returns no issues - {}".format(jql))
+            keys = []
+        return [self.issue_replay(key) for key in keys[start_at:start_at + max_results]], len(keys)
+
+    # Returns a replayed copy of an issue, its changes are only kept through a replayed comment or update
+    #
+    def issue_replay(self, key):
+        with self.lock:
+            raw = copy.deepcopy(self.fixtures['issues'].get(key))
+        if raw is None:
+            raise ReplayError(404, 'Issue {} Does Not Exist'.format(key))
+        return ReplayIssue(raw, self)
+
+    # Replays a comment or label update, the issue's recorded fields are changed so a later fetch sees the write
+    #
+    def write_replay(self, request, key, content):
+        self.request_wait(request)
+        with self.lock:
+            fields = self.fixtures['issues'][key]['fields']
+            if request == 'comment':
+                comment = {'body': content,
+                           'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f%z')}
+                fields.setdefault('comment', {}).setdefault('comments', []).append(comment)
+            else:
+                fields.update(content)
+            self.replay_writes.append({'request': request, 'key': key, 'content': content})
+
+    # Holds a replayed request for its injected latency, the recorded time of a random request of the same kind when
+    # latency_ms is not set, and fails it at the configured read or write error rate with a retryable 503 answer
+    #
+    def request_wait(self, request):
+        with self.lock:
+            counts = self.request_counts.setdefault(request, [0, 0])
+            counts[0] += 1
+            if self.latency_ms is not None:
+                latency = self.latency_ms / 1000.0
+            else:
+                latency = self.random.choice(self.fixtures['latency'].get(request) or [0.0])
+            error_rate = self.write_error_rate if request in WRITE_REQUESTS else self.read_error_rate
+            failed = self.random.random() < error_rate
+            if failed:
+                counts[1] += 1
+        time.sleep(latency)
+        if failed:
+            raise ReplayError(503, 'Injected {} error'.format(request))
+
+    # Writes the replayed writes for comparison with the recorded ones and logs the replayed requests
+    #
+    def replay_close(self):
+        with self.lock:
+            with open(self.writes_file_name, 'w') as fp:
+                json.dump(self.replay_writes, fp, indent=4)
+            for request, (requests, errors) in sorted(self.request_counts.items()):
+                self.logger.info("Replayed Jira {} requests: {}, injected errors: {}".format(request, requests,
+                                                                                           errors))
+        self.logger.info("{} replayed write(s) written to {}".format(len(self.replay_writes), self.writes_file_name))
+
+    # Creates the ticket folders of the scaled copies under zfs_path, each holding links to the recorded ticket's csv
+    # files, so every copy is checked and zipped in its own folder, returns the number of folders created
+    #
+    def csv_folders_scale(self, zfs_path):
+        folders_created = 0
+        for key in self.child_keys:
+            original_key = self.scaled_key_original(key)
+            parent_key = self.fixtures['issues'][key]['fields']['parent']['key']
+            if original_key == key:
+                continue
+            source_path = '{}{}/{}/'.format(zfs_path, self.scaled_key_original(parent_key), original_key)
+            target_path = '{}{}/{}/'.format(zfs_path, parent_key, key)
+            if not os.path.isdir(source_path):
+                self.logger.warning("No csv folder {} to copy for the scaled ticket {}".format(source_path, key))
+                continue
+            os.makedirs(target_path, exist_ok=True)
+            for file_name in os.listdir(source_path):
+                if file_name.endswith('.csv') and not os.path.lexists(target_path + file_name):
+                    os.symlink(os.path.abspath(source_path + file_name), target_path + file_name)
+            folders_created += 1
+        return folders_created
+
+    # Returns the parent keys of a sub-task search, None for any other search
+    #
+    @staticmethod
+    def sub_task_parents(jql):
+        match = re.match(r'\s*parent in \(([^)]*)\)', jql)
+        if match is None:
+            return None
+        return set(key.strip() for key in match.group(1).split(','))
+
+    @staticmethod
+    def scaled_key(key, copy_number):
+        return key if copy_number == 1 else '{}-R{}'.format(key, copy_number)
+
+    @staticmethod
+    def scaled_key_original(key):
+        return re.sub(r'-R\d+$', '', key)
+
+
+# Error answered by a replayed request, with the status code the write retries look at
+#
+class ReplayError(Exception):
+    def __init__(self, status_code, text):
+        super(ReplayError, self).__init__('{} {}'.format(status_code, text))
+        self.status_code = status_code
+        self.text = text
+        self.response = None
+
+
+# Search page with the total match count, as returned by the Jira client
+#
+class ReplayResults(list):
+    def __init__(self, issues, total):
+        super(ReplayResults, self).__init__(issues)
+        self.total = total
+
+
+# Replayed issue, its fields read as attributes and its label update replayed by the stand-in
+#
+class ReplayIssue(object):
+    def __init__(self, raw, replay):
+        self.key = raw['key']
+        self.raw = raw
+        self.fields = self.raw_fields(raw['fields'])
+        self.replay = replay
+
+    def update(self, fields=None, **kwargs):
+        self.replay.write_replay('update', self.key, fields or {})
+
+    def __str__(self):
+        return self.key
+
+    @classmethod
+    def raw_fields(cls, value):
+        if isinstance(value, dict):
+            return SimpleNamespace(**dict((name, cls.raw_fields(item)) for name, item in value.items()))
+        if isinstance(value, list):
+            return [cls.raw_fields(item) for item in value]
+        return value
+
+
+# Local stand-in for the Jira client serving a recorded run, with the requests the JiraManager makes
+#
+class JiraReplay(object):
+    def __init__(self, replay):
+        import requests
+
+        self.replay = replay
+        self._session = requests.Session()      # mounted by the session pool sizing, never sends a request
+
+    def search_issues(self, jql_str, startAt=0, maxResults=50, fields=None, **kwargs):
+        issues, total = self.replay.search_replay(jql_str, startAt, maxResults)
+        return ReplayResults(issues, total)
+
+    def issue(self, id, fields=None, expand=None):
+        self.replay.request_wait('issue')
+        return self.replay.issue_replay(str(id))
+
+    def add_comment(self, issue, body, **kwargs):
+        self.replay.write_replay('comment', str(issue), body)
+
+    def kill_session(self):
+        self.replay.replay_close()
+        self._session.close()
+
+
+# Recorded issue, the real issue with its label update recorded
+#
+class RecordedIssue(object):
+    def __init__(self, issue, replay):
+        self.issue = issue
+        self.replay = replay
+
+    def __getattr__(self, name):
+        return getattr(self.issue, name)
+
+    def update(self, fields=None, **kwargs):
+        start = time.monotonic()
+        self.issue.update(fields=fields, **kwargs)
+        self.replay.write_record('update', self.issue.key, fields, time.monotonic() - start)
+
+    def __str__(self):
+        return self.issue.key
+
+
+# Jira client wrapper recording the requests the JiraManager makes, the fixtures are written when the session ends
+#
+class JiraRecorder(object):
+    def __init__(self, jira, replay):
+        self.jira = jira
+        self.replay = replay
+
+    @property
+    def _session(self):
+        return self.jira._session
+
+    def search_issues(self, jql_str, startAt=0, maxResults=50, fields=None, **kwargs):
+        start = time.monotonic()
+        page = self.jira.search_issues(jql_str, startAt=startAt, maxResults=maxResults, fields=fields, **kwargs)
+        self.replay.search_record(jql_str, startAt, page, time.monotonic() - start)
+        return ReplayResults([RecordedIssue(issue, self.replay) for issue in page], page.total)
+
+    def issue(self, id, fields=None, expand=None):
+        start = time.monotonic()
+        issue = self.jira.issue(id, fields=fields, expand=expand)
+        self.replay.issue_record(issue, time.monotonic() - start)
+        return RecordedIssue(issue, self.replay)
+
+    def add_comment(self, issue, body, **kwargs):
+        start = time.monotonic()
+        comment = self.jira.add_comment(str(issue), body, **kwargs)
+        self.replay.write_record('comment', str(issue), body, time.monotonic() - start)
+        return comment
+
+    def kill_session(self):
+        try:
+            self.replay.fixture_save()
+        except (OSError, TypeError, ValueError) as e:
+            self.replay.logger.error("There was a problem writing the Jira fixtures - {}".format(e))
+        self.jira.kill_session()
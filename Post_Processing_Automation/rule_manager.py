@@ -0,0 +1,92 @@
+# rule_manager module
+# Module holds the class => RuleManager - manages the declarative data check rules interface
+# Class responsible for reading the data check rules of each file type from the configuration, planning them into the
+# column sets the profiler checks in its single pass of each file, and laying out the quality checks comment table
+#
+import logging
+
+# check name => the comment label and results key suffix of each result the check produces
+RULE_CHECKS = {
+    'value':    [['Max Value', 'max value'], ['Min Value', 'min value']],
+    'date':     [['Max Date', 'max value'], ['Min Date', 'min value']],
+    'length':   [['Max Length', 'max length'], ['Min Length', 'min length']],
+    'distinct': [['Distinct Values ({method})', 'distinct values'], ['Total Values', 'count']],
+    'empty':    [['Empty Values', 'empty values'], ['First Empty Lines', 'empty rows']]
+}
+
+# check name => the profiler pass that computes it, a date is checked as a min/max value
+RULE_PASSES = {'value': 'value', 'date': 'value', 'length': 'length', 'distinct': 'distinct', 'empty': 'empty'}
+
+
+class RuleManager(object):
+    def __init__(self, rule_settings):
+        self.logger = logging.getLogger(__name__)
+        self.file_rules = {}        # file type => list of [column, check] in the configured order
+        for file_type, rule_text in rule_settings.items():
+            self.file_rules[file_type] = self.rules_parse(file_type, rule_text)
+
+    # Parses the rules of a file type written as 'column: check, check; column: check', a malformed rule or an
+    # unknown check is logged and left out
+    #
+    def rules_parse(self, file_type, rule_text):
+        rules = []
+        for column_rules in rule_text.split(';'):
+            if not column_rules.strip():
+                continue
+            column, separator, checks = column_rules.partition(':')
+            if not separator or not column.strip() or not checks.strip():
+                self.logger.error("Malformed rule '{}' in the [Rules] {} setting, expected 'column: check, check', the "
+                                  "rule is left out".format(column_rules.strip(), file_type))
+                continue
+            for check in checks.split(','):
+                check = check.strip().lower()
+                if not check:
+                    continue
+                if check in RULE_CHECKS:
+                    rules.append([column.strip(), check])
+                else:
+                    self.logger.error("Unknown data check '{}' for column {} of the {} files, expected one of "
+                                      "{}".format(check, column.strip(), file_type, sorted(RULE_CHECKS)))
+        return rules
+
+    # Returns the file types with rules, in the configured order
+    #
+    def file_types(self):
+        return list(self.file_rules)
+
+    # Returns the [column, check] rules of a file type
+    #
+    def rules(self, file_type):
+        return self.file_rules.get(file_type, [])
+
+    # Plans the rules of a file type into the columns of each profiler pass - value (min/max), length, distinct and
+    # empty, a column named by several rules that share a pass is only computed once
+    #
+    def check_plan(self, file_type):
+        plan = {'value': [], 'length': [], 'distinct': [], 'empty': []}
+        for column, check in self.rules(file_type):
+            if column not in plan[RULE_PASSES[check]]:
+                plan[RULE_PASSES[check]].append(column)
+        return plan
+
+    # Returns the quality checks comment rows of a file, [column header, check label, result] in the configured rule
+    # order, the header is only shown on the first row of each check
+    #
+    def comment_rows(self, file_type, file_results):
+        rows = []
+        for column, check in self.rules(file_type):
+            if column not in file_results.get('column headers', []):
+                continue
+            for row_number, (label, result_key) in enumerate(RULE_CHECKS[check]):
+                label = label.format(method=file_results.get('{} distinct method'.format(column), 'exact'))
+                result = file_results.get('{} {}'.format(column, result_key))
+                if isinstance(result, list):
+                    result = ', '.join(str(value) for value in result) or '-'
+                rows.append([column if row_number == 0 else ' ', label, result])
+        return rows
+
+    # Returns a stable description of every rule, part of the profile cache key so a rule change is never answered
+    # with results of the old rules
+    #
+    def rules_settings(self):
+        return repr(sorted(self.file_rules.items()))
@@ -0,0 +1,178 @@
+# sidecar_manager module
+# Module holds the class => SidecarManager - manages the columnar sidecar file interface
+# Class responsible for writing a typed columnar copy (Arrow IPC or Parquet) of a csv file to the sidecar folder once
+# the file has loaded cleanly, and for reading it back in place of the csv file, memory mapped and with column
+# projection, for as long as the csv file's size and modified time match the ones recorded in the sidecar
+#
+import hashlib
+import logging
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SIDECAR_FORMATS = ['arrow', 'parquet']
+
+
+class SidecarManager(object):
+    def __init__(self, sidecar_format='arrow', sidecar_path=''):
+        self.sidecar_format = sidecar_format
+        self.sidecar_path = sidecar_path        # folder the sidecars are kept in, away from the delivered csv files
+        self.logger = logging.getLogger(__name__)
+        if pa is None:
+            self.logger.warning("pyarrow is not installed, the columnar sidecar files are disabled")
+
+    # Returns the sidecar file name for a csv file, named from a hash of the csv file path so the files of different
+    # tickets with the same name do not share a sidecar, and a csv file written again replaces its sidecar
+    #
+    def sidecar_name(self, file_name):
+        path_hash = hashlib.sha256(os.path.abspath(file_name).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.sidecar_path, '{}_{}.{}'.format(path_hash, os.path.basename(file_name),
+                                                                 self.sidecar_format))
+
+    # Returns True when the csv file has a sidecar written from its current contents, and with the same read settings
+    # unless settings is None
+    #
+    def sidecar_valid(self, file_name, settings=None):
+        if pa is None or not os.path.isfile(self.sidecar_name(file_name)):
+            return False
+        try:
+            metadata = self.sidecar_schema(file_name).metadata or {}
+        except Exception as e:
+            self.logger.warning("The sidecar for {} could not be read, ignoring it - {}".format(file_name, e))
+            return False
+        current = self.sidecar_metadata(file_name, settings or '')
+        if settings is None:
+            current[b'read_settings'] = metadata.get(b'read_settings')
+        return metadata == current
+
+    # Returns the column names of the csv file held in its sidecar, only call once sidecar_valid has returned True
+    #
+    def sidecar_columns(self, file_name):
+        return self.sidecar_schema(file_name).names
+
+    # Returns the schema of a sidecar, read without reading its data
+    #
+    def sidecar_schema(self, file_name):
+        if self.sidecar_format == 'parquet':
+            return pq.read_schema(self.sidecar_name(file_name))
+        with pa.memory_map(self.sidecar_name(file_name)) as source:
+            return ipc.open_file(source).schema
+
+    # Returns the sidecar contents as a data-frame, only the given columns are read, or None when there is no valid
+    # sidecar, numeric columns without missing values are not copied out of the memory mapped Arrow file
+    #
+    def sidecar_read(self, file_name, columns=None, settings=None):
+        if not self.sidecar_valid(file_name, settings):
+            return None
+        if self.sidecar_format == 'parquet':
+            table = pq.read_table(self.sidecar_name(file_name), columns=columns, memory_map=True)
+        else:
+            # the map is left to close with the last buffer that uses it
+            table = ipc.open_file(pa.memory_map(self.sidecar_name(file_name))).read_all()
+            if columns is not None:
+                table = table.select(columns)
+        return table.to_pandas(split_blocks=True)
+
+    # Yields the sidecar contents as data-frames of at most batch_size rows, for the streaming profiler, only call
+    # once sidecar_valid has returned True
+    #
+    def sidecar_batches(self, file_name, batch_size, columns=None):
+        if self.sidecar_format == 'parquet':
+            for batch in pq.ParquetFile(self.sidecar_name(file_name), memory_map=True).iter_batches(
+                    batch_size=batch_size, columns=columns):
+                yield batch.to_pandas(split_blocks=True)
+        else:
+            reader = ipc.open_file(pa.memory_map(self.sidecar_name(file_name)))
+            for batch_number in range(reader.num_record_batches):
+                batch = reader.get_batch(batch_number)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for offset in range(0, batch.num_rows, batch_size):
+                    yield batch.slice(offset, batch_size).to_pandas(split_blocks=True)
+
+    # Returns a writer for the sidecar of a csv file that is being loaded, None when pyarrow is not installed
+    #
+    def sidecar_writer(self, file_name, settings=''):
+        if pa is None:
+            return None
+        return SidecarWriter(self, file_name, self.sidecar_metadata(file_name, settings))
+
+    # Returns the schema metadata tying a sidecar to the csv file contents (size and modified time) and read settings
+    #
+    @staticmethod
+    def sidecar_metadata(file_name, settings=''):
+        file_stat = os.stat(file_name)
+        return {b'source_size': str(file_stat.st_size).encode(), b'source_mtime': str(file_stat.st_mtime_ns).encode(),
+                b'read_settings': settings.encode()}
+
+
+# Helper class for the SidecarManager - writes the sidecar a data-frame (or chunk) at a time to a temporary file that
+# is renamed into place once the csv file has loaded cleanly, any problem abandons the sidecar and not the load
+#
+class SidecarWriter(object):
+    def __init__(self, sidecar_manager, file_name, metadata):
+        self.sidecar_manager = sidecar_manager
+        self.file_name = file_name
+        self.metadata = metadata
+        self.sidecar_name = sidecar_manager.sidecar_name(file_name)
+        self.temp_name = '{}.{}.partial'.format(self.sidecar_name, os.getpid())
+        self.writer = None
+        self.schema = None
+        self.failed = False
+        self.logger = logging.getLogger(__name__)
+
+    # Adds a data-frame to the sidecar, later chunks are cast to the column types of the first
+    #
+    def write(self, data_frame):
+        if self.failed:
+            return
+        try:
+            if self.writer is None:
+                self.schema = pa.Schema.from_pandas(data_frame, preserve_index=False).with_metadata(self.metadata)
+                os.makedirs(os.path.dirname(self.temp_name), exist_ok=True)
+                if self.sidecar_manager.sidecar_format == 'parquet':
+                    self.writer = pq.ParquetWriter(self.temp_name, self.schema)
+                else:
+                    self.writer = ipc.new_file(self.temp_name, self.schema)
+            self.writer.write_table(pa.Table.from_pandas(data_frame, schema=self.schema, preserve_index=False))
+        except Exception as e:
+            self.logger.warning("The sidecar for {} was not written - {}".format(self.file_name, e))
+            self.discard()
+
+    # Finishes the sidecar and renames it into place, unless the csv file changed while it was being read
+    #
+    def close(self):
+        if self.failed or self.writer is None:
+            self.discard()
+            return False
+        try:
+            self.writer.close()
+            self.writer = None
+            if SidecarManager.sidecar_metadata(self.file_name, self.metadata[b'read_settings'].decode()) != \
+                    self.metadata:
+                raise ValueError('the csv file changed while it was being read')
+            os.replace(self.temp_name, self.sidecar_name)
+        except Exception as e:
+            self.logger.warning("The sidecar for {} was not written - {}".format(self.file_name, e))
+            self.discard()
+            return False
+        self.logger.info("The columnar sidecar {} has been written".format(self.sidecar_name))
+        return True
+
+    # Abandons the sidecar and removes the temporary file
+    #
+    def discard(self):
+        self.failed = True
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+            self.writer = None
+        if os.path.exists(self.temp_name):
+            os.remove(self.temp_name)
@@ -0,0 +1,69 @@
+# sketch_manager module
+# Module holds the class => SketchManager - manages the approximate distinct count interface
+# Class responsible for a HyperLogLog sketch of a column's values, updated a chunk at a time with vectorized hashing,
+# mergeable with the sketches of other chunks or worker processes, and estimating the number of distinct values
+#
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class SketchManager(object):
+    def __init__(self, error_rate=0.01):
+        # the standard error of a sketch with m registers is 1.04 / sqrt(m), m is rounded up to a power of two
+        self.precision = min(max(int(math.ceil(math.log((1.04 / error_rate) ** 2, 2))), 4), 18)
+        self.register_count = 1 << self.precision
+        self.registers = np.zeros(self.register_count, dtype=np.uint8)
+
+    # Adds the non-null values of a column (or a chunk of it) to the sketch
+    #
+    def sketch_update(self, column_data):
+        hashes = self.sketch_hashes(column_data.dropna())
+        if not hashes.shape[0]:
+            return
+        # the top bits pick the register, the rank is the position of the first set bit in the remaining bits
+        register_index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remaining = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        np.maximum.at(self.registers, register_index, self.sketch_rank(remaining))
+
+    # Returns the 64 bit hashes of the values, a whole number read as a float hashes as the integer, so a column read as
+    # integers in some chunks (or byte ranges) and as floats in others (a missing value) counts each value once
+    #
+    @staticmethod
+    def sketch_hashes(values):
+        if values.dtype.kind != 'f':
+            return pd.util.hash_pandas_object(values, index=False).values.astype(np.uint64)
+        whole = ((values == np.floor(values)) & (values.abs() < 2.0 ** 63)).values
+        hashes = np.empty(values.shape[0], dtype=np.uint64)
+        hashes[whole] = pd.util.hash_pandas_object(values[whole].astype(np.int64), index=False).values
+        hashes[~whole] = pd.util.hash_pandas_object(values[~whole], index=False).values
+        return hashes
+
+    # Folds another sketch of the same precision into this one
+    #
+    def sketch_merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    # Returns the estimated number of distinct values added to the sketch
+    #
+    def sketch_estimate(self):
+        register_count = float(self.register_count)
+        alpha = 0.7213 / (1 + 1.079 / register_count)
+        estimate = alpha * register_count ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty_registers = int(np.count_nonzero(self.registers == 0))
+        # small cardinalities are estimated more accurately by linear counting of the empty registers
+        if estimate <= 2.5 * register_count and empty_registers:
+            estimate = register_count * math.log(register_count / empty_registers)
+        return int(round(estimate))
+
+    # Returns the number of leading zero bits plus one for each 64 bit value, found exactly by splitting each value
+    # into two 32 bit halves that a float64 represents without rounding
+    #
+    @staticmethod
+    def sketch_rank(values):
+        high = (values >> np.uint64(32)).astype(np.float64)
+        low = (values & np.uint64(0xffffffff)).astype(np.float64)
+        top_bit = np.where(high > 0, 32 + np.floor(np.log2(np.maximum(high, 1))),
+                           np.floor(np.log2(np.maximum(low, 1))))
+        return (64 - top_bit).astype(np.uint8)
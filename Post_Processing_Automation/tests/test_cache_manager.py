@@ -0,0 +1,63 @@
+# test_cache_manager module
+# Tests for the CacheManager - the results of a csv file are only reused for the same file checked the same way
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from cache_manager import CacheManager
+
+RESULTS = {'file name': 'cust_id.csv', 'file rows': '2'}
+
+
+class CacheManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.folder, 'cache')
+        self.file_name = os.path.join(self.folder, 'cust_id.csv')
+        self.file_write(b'xid|txn_id\n1|a\n2|b\n', 1000000000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def file_write(self, contents, mtime):
+        with open(self.file_name, 'wb') as fp:
+            fp.write(contents)
+        os.utime(self.file_name, (mtime, mtime))
+
+    def test_hit(self):
+        CacheManager(self.cache_path, 1024 * 1024, check_settings='a').cache_put(self.file_name, RESULTS)
+        self.assertEqual(CacheManager(self.cache_path, 1024 * 1024, check_settings='a').cache_get(self.file_name),
+                         RESULTS)
+
+    def test_changed_settings_miss(self):
+        CacheManager(self.cache_path, 1024 * 1024, check_settings='a').cache_put(self.file_name, RESULTS)
+        self.assertIsNone(CacheManager(self.cache_path, 1024 * 1024, check_settings='b').cache_get(self.file_name))
+
+    def test_changed_file_miss(self):
+        cache = CacheManager(self.cache_path, 1024 * 1024)
+        cache.cache_put(self.file_name, RESULTS)
+        self.file_write(b'xid|txn_id\n1|a\n2|c\n', 1000000001)
+        self.assertIsNone(cache.cache_get(self.file_name))
+
+    # Rewritten contents with the same size and modified time are only caught by the content hash
+    #
+    def test_content_hash_miss(self):
+        cache = CacheManager(self.cache_path, 1024 * 1024, content_hash=True)
+        cache.cache_put(self.file_name, RESULTS)
+        self.file_write(b'xid|txn_id\n1|a\n2|c\n', 1000000000)
+        self.assertIsNone(cache.cache_get(self.file_name))
+
+    def test_refresh_miss(self):
+        CacheManager(self.cache_path, 1024 * 1024).cache_put(self.file_name, RESULTS)
+        self.assertIsNone(CacheManager(self.cache_path, 1024 * 1024, refresh=True).cache_get(self.file_name))
+
+    def test_eviction(self):
+        cache = CacheManager(self.cache_path, 1)
+        cache.cache_put(self.file_name, RESULTS)
+        self.assertEqual(os.listdir(self.cache_path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# test_csv_manager module
+# Tests for the CSVManager - the csv files indexed for each child ticket folder, and the StructureScan of a csv file's
+# rows and field counts
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from csv_manager import CSVManager, StructureScan
+
+# lines 3 and 5 have a field too many and too few, line numbers count the header as line 1
+MALFORMED = b'xid|txn_id\n1|a\n2|b|x\n3|c\n4\n5|e\n'
+
+
+class CSVManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.zfs_path = tempfile.mkdtemp() + '/'
+        self.path = os.path.join(self.zfs_path, 'CAM-1', 'CAM-2') + '/'
+        os.makedirs(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.zfs_path)
+
+    def file_write(self, file_name, contents):
+        with open(self.path + file_name, 'wb') as fp:
+            fp.write(contents)
+
+    # A csv file of an unregistered type, or a second file of a type, is reported as extra and left out of the files
+    #
+    def test_extra_files_are_not_indexed(self):
+        self.file_write('cust_a_id.csv', b'xid|txn_id\n1|a\n')
+        self.file_write('cust_b_id.csv', b'xid|txn_id\n2|b\n')
+        self.file_write('cust_store.csv', b'store\n1\n')
+        folder = CSVManager(self.zfs_path).folder_index(['CAM-1'])[('CAM-1', 'CAM-2')]
+        self.assertEqual(folder['files'], [['id', self.path + 'cust_a_id.csv']])
+        self.assertEqual(folder['extra'], ['cust_b_id.csv', 'cust_store.csv'])
+        self.assertEqual(folder['missing'], ['upc'])
+        self.assertEqual(sorted(folder['sizes']), [self.path + 'cust_a_id.csv'])
+        self.assertEqual(folder['total bytes'], 15)
+
+    def structure_check(self, contents, window_size=64 * 1024 * 1024, report_lines=20):
+        self.file_write('cust_id.csv', contents)
+        return CSVManager.file_structure_check(self.path + 'cust_id.csv', report_lines, window_size)
+
+    # The same structure is found whatever the windows, lines split across windows are counted once
+    #
+    def test_bad_lines_are_reported_by_line_number(self):
+        for window_size in [1, 3, 7, 1024]:
+            structure = self.structure_check(MALFORMED, window_size)
+            self.assertEqual(structure, {'rows': 5, 'fields': 2, 'bad line count': 2, 'bad lines': [3, 5],
+                                         'ends with newline': True, 'valid': False}, window_size)
+        self.assertEqual(self.structure_check(MALFORMED, report_lines=1)['bad lines'], [3])
+
+    # A stream fed in blocks, as the pipeline read does, finds the same structure as the memory mapped scan
+    #
+    def test_stream_blocks_match_the_file_scan(self):
+        for block_size in [1, 4, 1024]:
+            scan = StructureScan(window_size=5)
+            for start in range(0, len(MALFORMED), block_size):
+                scan.scan_update(MALFORMED[start:start + block_size])
+            self.assertEqual(scan.scan_result(), self.structure_check(MALFORMED), block_size)
+
+    # A truncated last line is still a row, a short one is reported as a bad line and the file is not valid
+    #
+    def test_file_without_a_trailing_newline(self):
+        self.assertEqual(self.structure_check(b'xid|txn_id\n1|a\n2|b'),
+                         {'rows': 2, 'fields': 2, 'bad line count': 0, 'bad lines': [], 'ends with newline': False,
+                          'valid': False})
+        self.assertEqual(self.structure_check(b'xid|txn_id\n1|a\n2', window_size=4)['bad lines'], [3])
+        self.assertEqual(self.structure_check(b'xid|txn_id')['rows'], 0)
+        self.assertFalse(self.structure_check(b'')['valid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# test_history_manager module
+# Tests for the HistoryManager - the file statistics of the results files loaded into the store and a ticket's files
+# compared with the customer's trailing runs
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from history_manager import HistoryManager
+
+
+def upc_results(file_rows, txn_id_distinct, max_date='2019-03-31'):
+    return {'file name': 'Acme_2019-01-01_2019-03-31_upc.csv', 'file rows': '{:,}'.format(file_rows),
+            'txn_id distinct values': '{:,}'.format(txn_id_distinct), 'txn_id max length': '12',
+            'txn_id min length': '10', 'transactionDateTime max value': max_date,
+            'transactionDateTime min value': '2019-01-01', 'units max value': '30', 'units min value': '1'}
+
+
+class HistoryManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.history = HistoryManager(os.path.join(self.folder, 'history', 'history.db'), weeks=8, deviation=0.4,
+                                      min_runs=2)
+
+    def tearDown(self):
+        self.history.history_close()
+        shutil.rmtree(self.folder)
+
+    def results_write(self, run_day, run_results):
+        results_file_name = os.path.join(self.folder, 'post_processing_201904{:02d}.json'.format(run_day))
+        with open(results_file_name, 'w') as fp:
+            json.dump(run_results, fp)
+        return results_file_name
+
+    def test_results_ingest(self):
+        results_file_name = self.results_write(1, {'CAM-2': {'customer name': 'Acme', 'upc': upc_results(1000, 400),
+                                                             'jira write failures': []}})
+        with self.assertLogs('history_manager', 'INFO'):
+            self.assertEqual(self.history.results_ingest(results_file_name), 1)
+        rows = self.history.history_connect().execute(
+            "SELECT ticket, file_type, run_date, customer, statistic, value FROM file_statistics ORDER BY statistic")
+        self.assertEqual(rows.fetchall(), [
+            ('CAM-2', 'upc', '2019-04-01', 'Acme', 'file rows', 1000.0),
+            ('CAM-2', 'upc', '2019-04-01', 'Acme', 'transactionDateTime date span days', 89.0),
+            ('CAM-2', 'upc', '2019-04-01', 'Acme', 'txn_id distinct values', 400.0),
+            ('CAM-2', 'upc', '2019-04-01', 'Acme', 'txn_id max length', 12.0),
+            ('CAM-2', 'upc', '2019-04-01', 'Acme', 'txn_id min length', 10.0)])
+
+        # a ticket loaded again for the same date is replaced, not added twice
+        with self.assertLogs('history_manager', 'INFO'):
+            self.history.results_ingest(results_file_name)
+        self.assertEqual(self.history.history_connect().execute("SELECT COUNT(*) FROM file_statistics").fetchone(),
+                         (5,))
+
+    # Only the statistics that moved from the trailing median by more than the allowed deviation are reported
+    #
+    def test_history_compare_deviation(self):
+        for run_day, ticket_key, file_rows in [[1, 'CAM-2', 1000], [8, 'CAM-4', 1100], [15, 'CAM-6', 900]]:
+            with self.assertLogs('history_manager', 'INFO'):
+                self.history.results_ingest(self.results_write(run_day, {ticket_key: {
+                    'customer name': 'Acme', 'upc': upc_results(file_rows, 400)}}))
+
+        with self.assertLogs('history_manager', 'WARNING'):
+            history = self.history.history_compare('Acme', '2019-04-22', 'CAM-8',
+                                                   {'upc': upc_results(1500, 420, max_date='2019-01-31')})
+        self.assertEqual(history, {'weeks': 8, 'allowed deviation': '40%', 'statistics compared': 5, 'deviations': [
+            {'file type': 'upc', 'statistic': 'file rows', 'this run': '1,500', 'trailing median': '1,000',
+             'change': '+50%', 'runs': 3},
+            {'file type': 'upc', 'statistic': 'transactionDateTime date span days', 'this run': '30',
+             'trailing median': '89', 'change': '-66%', 'runs': 3}]})
+
+        # the runs outside the trailing weeks, of another customer or of the ticket itself are not compared with
+        checked_files = {'upc': upc_results(1000, 400)}
+        self.assertIsNone(self.history.history_compare('Acme', '2019-08-01', 'CAM-8', checked_files))
+        self.assertIsNone(self.history.history_compare('Other', '2019-04-22', 'CAM-8', checked_files))
+        self.assertEqual(self.history.history_compare('Acme', '2019-04-09', 'CAM-9', checked_files)['deviations'], [])
+        self.assertIsNone(self.history.history_compare('Acme', '2019-04-09', 'CAM-4', checked_files))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# test_integrity_manager module
+# Tests for the IntegrityManager - the id file key index and the txn_ids missing from either file
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from integrity_manager import IntegrityManager
+
+
+class IntegrityManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def file_write(self, file_name, header, rows):
+        file_name = os.path.join(self.folder, file_name)
+        with open(file_name, 'w') as fp:
+            fp.write('\n'.join([header] + rows) + '\n')
+        return file_name
+
+    # The keys repeated within and across the chunks (and the dedupe blocks) are held once, sorted
+    #
+    def test_key_index_holds_each_key_once(self):
+        txn_ids = ['t{}'.format(number % 7) for number in range(40)] + ['']
+        file_name = self.file_write('cust_id.csv', 'xid|txn_id', ['{}|{}'.format(number, txn_id)
+                                                                  for number, txn_id in enumerate(txn_ids)])
+        integrity = IntegrityManager(chunk_size=3)
+        index = integrity.key_index(file_name)
+        expected = np.unique(IntegrityManager.key_hashes(pd.Series(['t{}'.format(number) for number in range(7)])))
+        np.testing.assert_array_equal(index, expected)
+        self.assertEqual(index.dtype, np.uint64)
+
+    def test_sorted_dedupe(self):
+        values = np.array([1, 1, 2, 2, 2, 3, 5, 5, 8, 9, 9, 9], dtype=np.uint64)
+        for block_size in [1, 2, 3, 5, 100]:
+            deduped = values.copy()
+            count = IntegrityManager.sorted_dedupe(deduped, block_size)
+            np.testing.assert_array_equal(deduped[:count], [1, 2, 3, 5, 8, 9])
+
+    # The upc txn_ids missing from the id file and the id txn_ids with no upc rows are counted and sampled
+    #
+    def test_missing_keys_are_sampled(self):
+        id_file_name = self.file_write('cust_id.csv', 'xid|txn_id', ['1|a', '2|b', '3|c', '4|d', '5|a'])
+        upc_file_name = self.file_write('cust_upc.csv', 'txn_id|upc', ['a|1', 'x|2', 'b|3', 'x|4', 'y|5', 'z|6',
+                                                                       'a|7'])
+        with self.assertLogs('integrity_manager', 'INFO'):
+            integrity = IntegrityManager(chunk_size=2, sample_size=2).integrity_check(id_file_name, upc_file_name)
+        self.assertEqual(integrity, {
+            'id distinct txn_ids': '4',
+            'upc rows checked': '7',
+            'upc orphan rows': '4',
+            'upc orphan txn_ids': '3',
+            'upc orphan sample': ['x', 'y'],
+            'id orphan txn_ids': '2',
+            'id orphan sample': ['c', 'd']
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
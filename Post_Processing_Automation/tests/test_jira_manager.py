@@ -0,0 +1,45 @@
+# test_jira_manager module
+# Tests for the JiraManager run issue cache, shared by the main thread and the background Jira write threads
+#
+from concurrent.futures import ThreadPoolExecutor
+import time
+import unittest
+
+from jira_manager import JiraManager
+
+
+class StubTicket(object):
+    def __init__(self, key):
+        self.key = key
+
+
+# Stand-in for the jira client that counts the issues fetched from the server
+#
+class StubJiraClient(object):
+    def __init__(self):
+        self.fetches = []
+
+    def issue(self, key, fields=None):
+        self.fetches.append(key)
+        time.sleep(0.001)
+        return StubTicket(key)
+
+
+class JiraManagerTest(unittest.TestCase):
+    def test_issue_cache_counts_every_fetch_across_threads(self):
+        jira_client = StubJiraClient()
+        jira_pars = JiraManager(None, None, jira_client)
+        jira_pars.issue_cache_seed([StubTicket('CAM-1')])
+        tickets = [StubTicket('CAM-{}'.format(number % 4 + 1)) for number in range(400)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            issues = list(executor.map(jira_pars.issue_fetch, tickets))
+        self.assertEqual([issue.key for issue in issues], [ticket.key for ticket in tickets])
+        self.assertEqual(jira_pars.issue_cache_hits + jira_pars.issue_cache_misses, 400)
+        self.assertEqual(jira_pars.issue_cache_misses, len(jira_client.fetches))
+        self.assertEqual(sorted(jira_pars.issue_cache), ['CAM-1', 'CAM-2', 'CAM-3', 'CAM-4'])
+        # every caller gets the one cached copy of an issue
+        self.assertEqual(len(set(id(issue) for issue in issues)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# test_jira_write_manager module
+# Tests for the JiraWriteManager - retrying failed writes, holding the request rate, skipping the writes a recovered
+# ticket already has and stopping once the ticket's lease is lost
+#
+import time
+import unittest
+
+from jira_write_manager import JiraWriteManager, LEASE_LOST
+from metrics_manager import MetricsManager
+
+
+class StubTicket(object):
+    def __init__(self, key):
+        self.key = key
+
+
+class StubJiraError(Exception):
+    def __init__(self, status_code, headers=None, landed=False):
+        super(StubJiraError, self).__init__('HTTP {}'.format(status_code))
+        self.status_code = status_code
+        self.landed = landed            # the write was made before the answer failed
+        self.response = None
+        if headers is not None:
+            self.response = type('Response', (object,), {'status_code': status_code, 'headers': headers})()
+
+
+# Stand-in for the JiraManager that records the writes, the first write_errors writes raise the given errors, posted
+# are the writes already on the ticket
+#
+class StubJiraManager(object):
+    def __init__(self, write_errors=None, posted=None):
+        self.write_errors = list(write_errors or [])
+        self.posted = posted or []
+        self.writes = []
+        self.write_times = []
+        self.posted_checks = 0
+
+    def write(self, name, ticket):
+        self.write_times.append(time.monotonic())
+        error = self.write_errors.pop(0) if self.write_errors else None
+        if error is None or error.landed:
+            self.writes.append(name)
+        if error is not None:
+            raise error
+
+    def add_quality_checks_results_comment(self, ticket, quality_checks, rules):
+        self.write('jira quality comment', ticket)
+
+    def add_count_comment(self, ticket, zip_file_name, quality_checks):
+        self.write('jira count comment', ticket)
+
+    def update_field_value(self, ticket):
+        self.write('jira label update', ticket)
+
+    def ticket_writes_posted(self, ticket, zip_file_name, since=None):
+        self.posted_checks += 1
+        return self.posted + self.writes
+
+    def session_retries(self, max_retries):
+        return None
+
+
+class JiraWriteManagerTest(unittest.TestCase):
+    def write_manager(self, jira_pars, rate_per_second=0.0):
+        return JiraWriteManager(jira_pars, MetricsManager(), workers=0, rate_per_second=rate_per_second, retries=3,
+                                backoff_seconds=0.0)
+
+    def writes_post(self, write_manager, recovered=False, lease_check=None):
+        checked_files = {}
+        write_manager.ticket_writes_submit(StubTicket('CAM-1'), 'cam.zip', checked_files, True, None, recovered,
+                                           lease_check)
+        return checked_files['jira write failures']
+
+    def test_server_error_is_retried(self):
+        jira_pars = StubJiraManager([StubJiraError(429, {}), StubJiraError(502, {})])
+        with self.assertLogs('jira_write_manager', 'WARNING'):
+            self.assertEqual(self.writes_post(self.write_manager(jira_pars)), [])
+        self.assertEqual(jira_pars.writes, ['jira quality comment', 'jira count comment', 'jira label update'])
+
+    # A write still failing after its retries is recorded and the ticket's later writes are skipped
+    #
+    def test_failed_write_skips_the_later_writes(self):
+        jira_pars = StubJiraManager([StubJiraError(429, {})] * 4)
+        with self.assertLogs('jira_write_manager', 'ERROR'):
+            failures = self.writes_post(self.write_manager(jira_pars))
+        self.assertEqual([[failure['write'], failure['attempts']] for failure in failures],
+                         [['jira quality comment', 4], ['jira count comment', 0], ['jira label update', 0]])
+        self.assertEqual(jira_pars.writes, [])
+
+    def test_client_error_is_not_retried(self):
+        jira_pars = StubJiraManager([StubJiraError(400)])
+        with self.assertLogs('jira_write_manager', 'ERROR'):
+            failures = self.writes_post(self.write_manager(jira_pars))
+        self.assertEqual(failures[0]['attempts'], 1)
+
+    # A comment that landed despite the 502 answer is not posted again
+    #
+    def test_landed_comment_is_not_posted_again(self):
+        jira_pars = StubJiraManager([StubJiraError(502, {}, landed=True)])
+        with self.assertLogs('jira_write_manager', 'WARNING'):
+            self.assertEqual(self.writes_post(self.write_manager(jira_pars)), [])
+        self.assertEqual(jira_pars.writes, ['jira quality comment', 'jira count comment', 'jira label update'])
+
+    def test_rate_limit_spaces_the_requests(self):
+        jira_pars = StubJiraManager()
+        self.writes_post(self.write_manager(jira_pars, rate_per_second=20.0))
+        gaps = [later - earlier for earlier, later in zip(jira_pars.write_times, jira_pars.write_times[1:])]
+        self.assertEqual(len(gaps), 2)
+        self.assertTrue(all(gap >= 0.045 for gap in gaps), gaps)
+
+    # A recovered ticket reads the writes already on it and posts only the rest
+    #
+    def test_recovered_ticket_skips_the_posted_writes(self):
+        jira_pars = StubJiraManager(posted=['jira quality comment'])
+        self.assertEqual(self.writes_post(self.write_manager(jira_pars), recovered=True), [])
+        self.assertEqual(jira_pars.posted_checks, 1)
+        self.assertEqual(jira_pars.writes, ['jira count comment', 'jira label update'])
+
+    # Nothing more is posted once another worker has taken over the ticket's lease
+    #
+    def test_lost_lease_stops_the_writes(self):
+        jira_pars = StubJiraManager()
+        lease_checks = iter([True, False])
+        with self.assertLogs('jira_write_manager', 'ERROR'):
+            failures = self.writes_post(self.write_manager(jira_pars), lease_check=lambda: next(lease_checks))
+        self.assertEqual(jira_pars.writes, ['jira quality comment'])
+        self.assertEqual(failures[0], {'write': 'jira count comment', 'error': LEASE_LOST, 'attempts': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
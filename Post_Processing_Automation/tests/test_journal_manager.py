@@ -0,0 +1,85 @@
+# test_journal_manager module
+# Tests for the JournalManager - repairing a journal cut short by a crash and compacting the journals into the
+# results json file
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from journal_manager import JournalManager
+
+
+class JournalManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.results_file_name = os.path.join(self.folder, 'results_20190101.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    # A record cut short by a crash is removed and the next record is appended on a line of its own
+    #
+    def test_repair_removes_incomplete_record(self):
+        journal = JournalManager(self.results_file_name)
+        journal.journal_append('CAM-1', {'id': {'file rows': '10'}})
+        with open(journal.journal_file_name, 'a') as fp:
+            fp.write('{"ticket": "CAM-2", "status": "comp')
+
+        self.assertEqual(journal.journal_completed(), {'CAM-1'})
+        journal.journal_append('CAM-3', {})
+        self.assertEqual(journal.journal_completed(), {'CAM-1', 'CAM-3'})
+        with open(journal.journal_file_name, 'r') as fp:
+            self.assertEqual([json.loads(line)['ticket'] for line in fp], ['CAM-1', 'CAM-3'])
+
+    # The compacted file is the same as a json dump of the results, the latest record of a ticket is kept
+    #
+    def test_compact_keeps_latest_record(self):
+        journal = JournalManager(self.results_file_name)
+        journal.journal_append('CAM-1', {'id': {'file rows': '10'}})
+        journal.journal_append('CAM-2', {'upc': {'file rows': '20', 'empty value columns': []}})
+        journal.journal_append('CAM-1', {'id': {'file rows': '11'}})
+
+        self.assertEqual(journal.journal_compact(), 2)
+        with open(self.results_file_name, 'r') as fp:
+            results = json.load(fp)
+        self.assertEqual(results, {'CAM-1': {'id': {'file rows': '11'}},
+                                   'CAM-2': {'upc': {'file rows': '20', 'empty value columns': []}}})
+
+    # The journals of every worker sharing the run are compacted together
+    #
+    def test_compact_merges_worker_journals(self):
+        JournalManager(self.results_file_name, 'host-a.1').journal_append('CAM-1', {'id': {}})
+        JournalManager(self.results_file_name, 'host-b.2').journal_append('CAM-2', {'id': {}})
+        journal = JournalManager(self.results_file_name, 'host-a.1')
+
+        self.assertEqual(journal.journal_completed(), {'CAM-1', 'CAM-2'})
+        self.assertEqual(journal.journal_compact(), 2)
+        with open(self.results_file_name, 'r') as fp:
+            self.assertEqual(sorted(json.load(fp)), ['CAM-1', 'CAM-2'])
+
+    # Only a completed ticket is skipped by a restarted run, the results of every ticket are compacted
+    #
+    def test_blocked_and_write_failed_are_not_completed(self):
+        journal = JournalManager(self.results_file_name)
+        journal.journal_append('CAM-1', {'zip file created': True})
+        journal.journal_append('CAM-2', {'zip file created': False}, 'blocked')
+        journal.journal_append('CAM-3', {'jira write failures': [{'write': 'jira count comment'}]}, 'write failed')
+
+        self.assertEqual(journal.journal_completed(), {'CAM-1'})
+        self.assertEqual(journal.journal_statuses(), {'CAM-1': 'completed', 'CAM-2': 'blocked',
+                                                      'CAM-3': 'write failed'})
+        self.assertEqual(journal.journal_compact(), 3)
+
+        journal.journal_append('CAM-3', {'jira write failures': []})
+        self.assertEqual(journal.journal_completed(), {'CAM-1', 'CAM-3'})
+
+    def test_compact_empty_journal(self):
+        self.assertEqual(JournalManager(self.results_file_name).journal_compact(), 0)
+        with open(self.results_file_name, 'r') as fp:
+            self.assertEqual(json.load(fp), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
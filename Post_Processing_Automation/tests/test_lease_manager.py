@@ -0,0 +1,168 @@
+# test_lease_manager module
+# Tests for the LeaseManager - taking the lease of a ticket, taking over an expired lease and the done markers
+#
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from lease_manager import LeaseManager, MERGE_LOCK_KEY
+
+
+class LeaseManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.lease_path = tempfile.mkdtemp()
+        self.worker_a = LeaseManager(self.lease_path, 'host-a.1', lease_seconds=60, heartbeat_seconds=3600,
+                                     run_id='run-1')
+        self.worker_b = LeaseManager(self.lease_path, 'host-b.2', lease_seconds=60, heartbeat_seconds=3600,
+                                     run_id='run-1')
+
+    def tearDown(self):
+        self.worker_a.lease_stop()
+        self.worker_b.lease_stop()
+        shutil.rmtree(self.lease_path)
+
+    # Moves the modified time of a ticket's lease file back, as if its holder had stopped renewing it
+    #
+    def lease_age(self, ticket_key, seconds):
+        lease_time = time.time() - seconds
+        os.utime(self.worker_a.lease_name(ticket_key), (lease_time, lease_time))
+
+    def test_live_lease_is_held(self):
+        self.assertEqual(self.worker_a.lease_acquire('CAM-1'), 'acquired')
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'held')
+        self.assertTrue(self.worker_a.lease_owned('CAM-1'))
+
+    def test_expired_lease_is_taken_over(self):
+        self.assertEqual(self.worker_a.lease_acquire('CAM-1'), 'acquired')
+        self.lease_age('CAM-1', 120)
+
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'recovered')
+        self.assertTrue(self.worker_b.lease_owned('CAM-1'))
+        self.assertFalse(self.worker_a.lease_owned('CAM-1'))
+        self.assertEqual(sorted(os.listdir(self.lease_path)), ['CAM-1.lease'])
+
+    def test_live_lease_is_not_stolen(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.lease_age('CAM-1', 30)
+
+        self.assertFalse(self.worker_b.lease_steal('CAM-1'))
+        self.assertTrue(self.worker_a.lease_owned('CAM-1'))
+
+    # A lease renewed by its holder while the fresh lease of the takeover is written is left to its holder
+    #
+    def test_lease_renewed_during_takeover_is_kept(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.lease_age('CAM-1', 120)
+        lease_write = self.worker_b.lease_write
+
+        def renewing_write(lease_fd):
+            lease_write(lease_fd)
+            os.utime(self.worker_a.lease_name('CAM-1'))
+
+        self.worker_b.lease_write = renewing_write
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'held')
+        self.assertTrue(self.worker_a.lease_owned('CAM-1'))
+        self.assertEqual(sorted(os.listdir(self.lease_path)), ['CAM-1.lease'])
+
+    # A lease left by an earlier run of the same worker id is taken back straight away
+    #
+    def test_own_lease_is_recovered(self):
+        self.worker_a.lease_acquire('CAM-1')
+        restarted = LeaseManager(self.lease_path, 'host-a.1', lease_seconds=60, heartbeat_seconds=3600)
+        try:
+            self.assertEqual(restarted.lease_acquire('CAM-1'), 'recovered')
+        finally:
+            restarted.lease_stop()
+
+    def test_completed_ticket_is_done(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.worker_a.lease_complete('CAM-1')
+
+        self.assertFalse(os.path.exists(self.worker_a.lease_name('CAM-1')))
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'done')
+
+    # A blocked ticket is done for the rest of the run, also for a worker started after it was blocked, a later run
+    # works it again
+    #
+    def test_blocked_ticket_is_retried_by_a_later_run(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.worker_a.lease_complete('CAM-1', 'blocked')
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'done')
+
+        late_worker = LeaseManager(self.lease_path, 'host-c.3', lease_seconds=60, heartbeat_seconds=3600,
+                                   run_id='run-1')
+        self.assertEqual(late_worker.lease_acquire('CAM-1'), 'done')
+
+        later_run = LeaseManager(self.lease_path, 'host-b.2', lease_seconds=60, heartbeat_seconds=3600,
+                                 run_id='run-2')
+        try:
+            self.assertEqual(later_run.lease_acquire('CAM-1'), 'acquired')
+            self.assertFalse(os.path.exists(self.worker_a.done_name('CAM-1')))
+        finally:
+            later_run.lease_stop()
+
+    # The Jira writes that landed before a write failed are checked for when the ticket is worked again
+    #
+    def test_write_failed_ticket_is_recovered_by_a_later_run(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.worker_a.lease_complete('CAM-1', 'write failed')
+        later_run = LeaseManager(self.lease_path, 'host-b.2', lease_seconds=60, heartbeat_seconds=3600,
+                                 run_id='run-2')
+        try:
+            self.assertEqual(later_run.lease_acquire('CAM-1'), 'recovered')
+        finally:
+            later_run.lease_stop()
+
+    # A worker whose lease was taken over leaves the done marker to the new holder
+    #
+    def test_lost_lease_writes_no_done_marker(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.lease_age('CAM-1', 120)
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'recovered')
+
+        with self.assertLogs('lease_manager', 'ERROR'):
+            self.assertFalse(self.worker_a.lease_complete('CAM-1', 'blocked'))
+        self.assertFalse(os.path.exists(self.worker_a.done_name('CAM-1')))
+        self.assertTrue(self.worker_b.lease_owned('CAM-1'))
+
+    def test_released_lease_is_free(self):
+        self.worker_a.lease_acquire('CAM-1')
+        self.worker_a.lease_release('CAM-1')
+        self.assertEqual(self.worker_b.lease_acquire('CAM-1'), 'acquired')
+
+    # A worker waits for the merge lock until the worker holding it has merged
+    #
+    def test_merge_lock_waits_for_holder(self):
+        self.worker_a.merge_lock_acquire()
+        merged = threading.Event()
+
+        def merge():
+            self.worker_b.merge_lock_acquire(wait_seconds=0.01)
+            merged.set()
+            self.worker_b.merge_lock_release()
+
+        merge_thread = threading.Thread(target=merge)
+        merge_thread.start()
+        self.assertFalse(merged.wait(0.2))
+        self.worker_a.merge_lock_release()
+        merge_thread.join(5)
+        self.assertTrue(merged.is_set())
+        self.assertFalse(os.path.exists(self.worker_a.lease_name(MERGE_LOCK_KEY)))
+
+    # The merge lock of a worker that died part way through its merge is taken over once it expires
+    #
+    def test_expired_merge_lock_is_taken_over(self):
+        self.worker_a.merge_lock_acquire()
+        self.worker_a.heartbeat_stop.set()
+        self.lease_age(MERGE_LOCK_KEY, 120)
+
+        self.worker_b.merge_lock_acquire(wait_seconds=0.01)
+        self.assertTrue(self.worker_b.lease_owned(MERGE_LOCK_KEY))
+        self.worker_b.merge_lock_release()
+
+
+if __name__ == '__main__':
+    unittest.main()
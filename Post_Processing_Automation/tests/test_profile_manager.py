@@ -0,0 +1,83 @@
+# test_profile_manager module
+# Tests for the ProfileManager - the streaming profile of a csv file, read in one pass or in byte ranges profiled in
+# parallel, answers every data check the same as a full data-frame load
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from csv_manager import CSV_SCHEMAS
+from pandas_manager import PandasManager
+from profile_manager import ProfileManager
+
+# the upc file's rules in config.ini, the length check is on the string columns only as a column inferred as numbers
+# is measured as text from the chunk it widens at
+CHECKS = {'txn_id': ['length', 'distinct', 'empty'], 'transactionDateTime': ['value', 'empty'],
+          'upc': ['length', 'distinct', 'empty'], 'units': ['value', 'distinct', 'empty']}
+
+ROWS = ['t1|2019-01-03|0001|3', 't2|2019-01-01|0002|12', ' |2019-01-05|0003|7', 't4|2019-01-02||4',
+        't1|2019-01-04|0001|', 't6||0004|9', '  |2019-01-07|00005|1', 't8|2019-01-06|0002|30', 't9|2019-01-02|0006|2']
+
+
+class ProfileManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.folder, 'cust_upc.csv')
+        with open(self.file_name, 'w') as fp:
+            fp.write('\n'.join(['txn_id|transactionDateTime|upc|units'] + ROWS) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def profile(self, pandas_data_frame):
+        self.assertIsNotNone(pandas_data_frame.data_frame_load(self.file_name))
+        return [pandas_data_frame.data_frame_shape(), pandas_data_frame.data_frame_header_check()] + \
+            [pandas_data_frame.data_frame_column_checks(column, checks) for column, checks in CHECKS.items()]
+
+    def profile_manager(self, chunk_size, distinct_error=None):
+        checked = [[column for column, checks in CHECKS.items() if check in checks]
+                   for check in ['value', 'length', 'distinct', 'empty']]
+        return ProfileManager(chunk_size, checked[0], checked[1], checked[2], CSV_SCHEMAS['upc'],
+                              distinct_error=distinct_error, empty_columns=checked[3], empty_report_rows=3)
+
+    # Every chunk size, including chunks that split the blank and missing values apart, gives the full-frame results
+    #
+    def test_chunked_profile_equals_the_full_frame(self):
+        full_frame = self.profile(PandasManager(CSV_SCHEMAS['upc'], empty_report_rows=3))
+        self.assertEqual(full_frame[2]['blank values'], '2')
+        self.assertEqual(full_frame[2]['empty rows'], [4, 8])
+        for chunk_size in [1, 2, 4]:
+            # the missing units value in the second chunk widens the column read as integers to floats
+            with self.assertLogs('pandas_manager', 'WARNING'):
+                self.assertEqual(self.profile(self.profile_manager(chunk_size)), full_frame, chunk_size)
+        self.assertEqual(self.profile(self.profile_manager(100)), full_frame)
+
+    # The byte ranges profiled in separate processes and merged give the single pass results, the distinct estimate
+    # included as the sketches merge losslessly
+    #
+    def test_sharded_load_equals_a_single_pass(self):
+        for distinct_error in [None, 0.05]:
+            single_pass = self.profile_manager(2, distinct_error)
+            with self.assertLogs('pandas_manager', 'WARNING'):
+                single_pass = self.profile(single_pass)
+            for shard_workers in [2, 3, 20]:
+                sharded = self.profile_manager(2, distinct_error)
+                sharded.shard_workers = shard_workers
+                with self.assertLogs('pandas_manager', 'INFO') as logs:
+                    self.assertEqual(self.profile(sharded), single_pass, [distinct_error, shard_workers])
+                self.assertIn('byte range(s) with {} worker(s)'.format(shard_workers), logs.output[-1])
+
+    def test_byte_ranges_start_at_a_line(self):
+        with open(self.file_name, 'rb') as csv:
+            contents = csv.read()
+        for range_count in [1, 2, 5, 100]:
+            byte_ranges, header = ProfileManager.byte_ranges(self.file_name, range_count)
+            self.assertEqual(header, ['txn_id', 'transactionDateTime', 'upc', 'units'])
+            self.assertEqual(b''.join(contents[start:end] for start, end in byte_ranges),
+                             contents[contents.index(b'\n') + 1:])
+            self.assertTrue(all(contents[start - 1:start] == b'\n' for start, end in byte_ranges))
+
+
+if __name__ == '__main__':
+    unittest.main()
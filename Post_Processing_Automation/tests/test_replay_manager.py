@@ -0,0 +1,129 @@
+# test_replay_manager module
+# Tests for the ReplayManager - a run recorded from the Jira client is served back by the local stand-in, with the
+# same searches, issues and writes
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from jira_manager import JiraManager
+from replay_manager import ReplayManager, JiraRecorder
+
+ISSUES = [
+    {'key': 'CAM-1', 'fields': {'summary': 'Turn - Acme Foods'}},
+    {'key': 'CAM-2', 'fields': {'summary': 'Turn CAM-2', 'customfield_10431': '2019-01-01',
+                                'customfield_10418': '2019-03-31', 'reporter': {'key': 'jdoe'}, 'labels': ['Empty'],
+                                'parent': {'key': 'CAM-1'}, 'comment': {'comments': []}}}
+]
+
+
+def raw_fields(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**dict((name, raw_fields(item)) for name, item in value.items()))
+    return value
+
+
+class StubPage(list):
+    total = 0
+
+
+# Stand-in for an issue of the Jira server, its label update is made on the server's copy
+#
+class StubIssue(object):
+    def __init__(self, raw, server):
+        self.key = raw['key']
+        self.raw = raw
+        self.fields = raw_fields(raw['fields'])
+        self.server = server
+
+    def update(self, fields=None, **kwargs):
+        self.server.issues[self.key]['fields'].update(fields)
+
+    def __str__(self):
+        return self.key
+
+
+# Stand-in for the Jira server behind the recorded client, a search answers every issue of the type it asks for
+#
+class StubJiraServer(object):
+    def __init__(self):
+        self.issues = dict((raw['key'], json.loads(json.dumps(raw))) for raw in ISSUES)
+
+    def search_issues(self, jql_str, startAt=0, maxResults=50, fields=None, **kwargs):
+        keys = ['CAM-2'] if jql_str.startswith('parent in') else ['CAM-1']
+        page = StubPage(self.issue(key) for key in keys[startAt:startAt + maxResults])
+        page.total = len(keys)
+        return page
+
+    def issue(self, id, fields=None, expand=None):
+        return StubIssue(json.loads(json.dumps(self.issues[str(id)])), self)
+
+    def add_comment(self, issue, body, **kwargs):
+        self.issues[str(issue)]['fields']['comment']['comments'].append({'body': body})
+
+    def kill_session(self):
+        pass
+
+
+class ReplayManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.fixture_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.fixture_path)
+
+    # Runs the Jira side of a run - the ticket searches, the child tickets' dates, their count comments and label
+    # updates, returns the child ticket keys of each parent ticket and their date ranges
+    #
+    def jira_run(self, jira_client, posted_check=False):
+        jira_pars = JiraManager(None, None, jira_client)
+        parent_tickets = jira_pars.find_parent_tickets('Opportunity', "('Open')", "'Turn'")
+        child_tickets = jira_pars.find_child_tickets_bulk(parent_tickets, "'Post Processing'", 'Empty')
+        date_ranges = {}
+        for child_ticket in [ticket for tickets in child_tickets.values() for ticket in tickets]:
+            date_ranges[child_ticket.key] = jira_pars.child_information_pull(child_ticket)
+            jira_pars.add_count_comment(child_ticket, 'acme', {'id': {'file name': 'acme_id.csv', 'file rows': '9'}})
+            jira_pars.update_field_value(child_ticket)
+            # a replayed write is seen by the later reads of the ticket
+            if posted_check:
+                self.assertEqual(jira_pars.ticket_writes_posted(child_ticket, 'acme'),
+                                 ['jira count comment', 'jira label update'])
+        with self.assertLogs('jira_manager', 'INFO'):
+            jira_pars.kill_session()
+        child_keys = dict((parent_key, [ticket.key for ticket in tickets])
+                          for parent_key, tickets in child_tickets.items())
+        return child_keys, date_ranges
+
+    def test_replay_serves_the_recorded_run(self):
+        recorder = ReplayManager('record', self.fixture_path)
+        with self.assertLogs('replay_manager', 'INFO'):
+            recorded = self.jira_run(JiraRecorder(StubJiraServer(), recorder))
+
+        replay = ReplayManager('replay', self.fixture_path, latency_ms=0)
+        with self.assertLogs('replay_manager', 'INFO'):
+            replayed = self.jira_run(replay.jira_client(None, None), posted_check=True)
+
+        self.assertEqual(recorded, ({'CAM-1': ['CAM-2']}, {'CAM-2': '2019-01-01_2019-03-31'}))
+        self.assertEqual(replayed, recorded)
+        with open(os.path.join(self.fixture_path, 'replay_writes.json')) as fp:
+            self.assertEqual(json.load(fp), recorder.fixtures['writes'])
+        self.assertEqual([write['request'] for write in recorder.fixtures['writes']], ['comment', 'update'])
+
+    # Each scaled copy of a recorded ticket is served under its own keys, with the recorded ticket's fields
+    #
+    def test_scaled_replay(self):
+        with self.assertLogs('replay_manager', 'INFO'):
+            self.jira_run(JiraRecorder(StubJiraServer(), ReplayManager('record', self.fixture_path)))
+        replay = ReplayManager('replay', self.fixture_path, scale=3, latency_ms=0)
+        with self.assertLogs('replay_manager', 'INFO'):
+            replayed = self.jira_run(replay.jira_client(None, None))
+        self.assertEqual(replayed[0], {'CAM-1': ['CAM-2'], 'CAM-1-R2': ['CAM-2-R2'], 'CAM-1-R3': ['CAM-2-R3']})
+        self.assertEqual(set(replayed[1].values()), {'2019-01-01_2019-03-31'})
+        self.assertEqual(len(replay.replay_writes), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# test_rule_manager module
+# Tests for the RuleManager - parsing the [Rules] settings and planning them into the profiler passes
+#
+import unittest
+
+from rule_manager import RuleManager
+
+
+class RuleManagerTest(unittest.TestCase):
+    def test_rules_parse(self):
+        rules = RuleManager({'upc': 'txn_id: Length, empty; units: value;; transactionDateTime: date'})
+        self.assertEqual(rules.file_types(), ['upc'])
+        self.assertEqual(rules.rules('upc'), [['txn_id', 'length'], ['txn_id', 'empty'], ['units', 'value'],
+                                              ['transactionDateTime', 'date']])
+        self.assertEqual(rules.rules('id'), [])
+
+    def test_unknown_check_is_left_out(self):
+        with self.assertLogs('rule_manager', 'ERROR'):
+            rules = RuleManager({'id': 'xid: length, median'})
+        self.assertEqual(rules.rules('id'), [['xid', 'length']])
+
+    def test_malformed_rule_is_named(self):
+        with self.assertLogs('rule_manager', 'ERROR') as logs:
+            rules = RuleManager({'upc': 'txn_id length; : value; units:; upc: length,'})
+        self.assertEqual(rules.rules('upc'), [['upc', 'length']])
+        self.assertEqual(len(logs.output), 3)
+        self.assertIn("Malformed rule 'txn_id length' in the [Rules] upc setting", logs.output[0])
+
+    # A date is checked in the value pass, a column named by several rules of the same pass is planned once
+    #
+    def test_check_plan(self):
+        rules = RuleManager({'upc': 'units: value; transactionDateTime: date; units: value, distinct; '
+                                    'txn_id: length, distinct, empty'})
+        self.assertEqual(rules.check_plan('upc'), {'value': ['units', 'transactionDateTime'],
+                                                   'length': ['txn_id'],
+                                                   'distinct': ['units', 'txn_id'],
+                                                   'empty': ['txn_id']})
+        self.assertEqual(rules.check_plan('id'), {'value': [], 'length': [], 'distinct': [], 'empty': []})
+
+    def test_comment_rows(self):
+        rules = RuleManager({'id': 'xid: length; txn_id: distinct; missing: value'})
+        file_results = {'column headers': ['xid', 'txn_id'], 'xid max length': 12, 'xid min length': 10,
+                        'txn_id distinct values': '5', 'txn_id distinct method': 'estimated', 'txn_id count': '9'}
+        self.assertEqual(rules.comment_rows('id', file_results), [['xid', 'Max Length', 12],
+                                                                  [' ', 'Min Length', 10],
+                                                                  ['txn_id', 'Distinct Values (estimated)', '5'],
+                                                                  [' ', 'Total Values', '9']])
+
+    def test_rules_settings_follow_the_rules(self):
+        self.assertEqual(RuleManager({'id': 'xid: length'}).rules_settings(),
+                         RuleManager({'id': ' xid : LENGTH '}).rules_settings())
+        self.assertNotEqual(RuleManager({'id': 'xid: length'}).rules_settings(),
+                            RuleManager({'id': 'xid: length, empty'}).rules_settings())
+
+
+if __name__ == '__main__':
+    unittest.main()
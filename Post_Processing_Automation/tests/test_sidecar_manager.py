@@ -0,0 +1,56 @@
+# test_sidecar_manager module
+# Tests for the SidecarManager - the columnar copies are kept in the sidecar folder and the loads read back only the
+# checked columns
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from pandas_manager import PandasManager
+from sidecar_manager import SidecarManager, pa
+
+CONTENTS = b'txn_id|transactionDateTime|upc|units\na|2019-01-01|0001|3\nb|2019-01-02|0002|\nc|2019-01-03|0003|5\n'
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed')
+class SidecarManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.delivery_path = os.path.join(self.folder, 'CAM-1', 'CAM-2')
+        self.sidecar_path = os.path.join(self.folder, 'cache', 'sidecars')
+        os.makedirs(self.delivery_path)
+        self.file_name = os.path.join(self.delivery_path, 'cust_upc.csv')
+        with open(self.file_name, 'wb') as fp:
+            fp.write(CONTENTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self, check_columns, sidecar_format='arrow'):
+        pandas_data_frame = PandasManager(sidecar=SidecarManager(sidecar_format, self.sidecar_path),
+                                          check_columns=check_columns)
+        pandas_data_frame.data_frame_load(self.file_name)
+        return pandas_data_frame
+
+    def test_sidecar_is_kept_out_of_the_delivery_folder(self):
+        self.load(['units'])
+        self.assertEqual(os.listdir(self.delivery_path), ['cust_upc.csv'])
+        self.assertEqual(os.listdir(self.sidecar_path),
+                         [os.path.basename(SidecarManager('arrow', self.sidecar_path).sidecar_name(self.file_name))])
+
+    # A load from the sidecar reads only the checked columns and still reports every column of the file
+    #
+    def test_sidecar_load_reads_the_checked_columns(self):
+        for sidecar_format in ['arrow', 'parquet']:
+            csv_load = self.load(['units'], sidecar_format)
+            sidecar_load = self.load(['units'], sidecar_format)
+            self.assertEqual(sidecar_load.data_frame.columns.tolist(), ['units'])
+            self.assertEqual(sidecar_load.data_frame_header_check(), csv_load.data_frame_header_check())
+            self.assertEqual(sidecar_load.data_frame_shape(), ('3', '4'))
+            self.assertEqual(sidecar_load.data_frame_column_checks('units', ['value', 'empty']),
+                             csv_load.data_frame_column_checks('units', ['value', 'empty']))
+
+
+if __name__ == '__main__':
+    unittest.main()
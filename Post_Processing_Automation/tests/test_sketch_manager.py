@@ -0,0 +1,61 @@
+# test_sketch_manager module
+# Tests for the SketchManager - the HyperLogLog distinct count estimate and merging the sketches of parts of a column
+#
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sketch_manager import SketchManager
+
+
+class SketchManagerTest(unittest.TestCase):
+    # The estimate stays within three standard errors of the exact count, small and large, with repeats and blanks
+    #
+    def test_estimate_within_the_distinct_error(self):
+        rng = np.random.default_rng(2019)
+        for distinct_error in [0.01, 0.02, 0.05]:
+            for distinct_count in [50, 5000, 100000]:
+                values = pd.Series(['txn{}'.format(value) for value in rng.integers(0, distinct_count * 10,
+                                                                                  distinct_count * 2)])
+                values[::7] = None
+                sketch = SketchManager(distinct_error)
+                sketch.sketch_update(values)
+                exact = values.nunique()
+                self.assertLessEqual(abs(sketch.sketch_estimate() - exact), 3 * distinct_error * exact,
+                                     [distinct_error, exact, sketch.sketch_estimate()])
+
+    # The sketches of the chunks of a column merge into exactly the sketch of the whole column
+    #
+    def test_merge_is_lossless(self):
+        values = pd.Series(['txn{}'.format(value % 30011) for value in range(100000)])
+        whole = SketchManager(0.01)
+        whole.sketch_update(values)
+        merged = SketchManager(0.01)
+        for start in range(0, values.shape[0], 7919):
+            part = SketchManager(0.01)
+            part.sketch_update(values[start:start + 7919])
+            merged.sketch_merge(part)
+        np.testing.assert_array_equal(merged.registers, whole.registers)
+        self.assertEqual(merged.sketch_estimate(), whole.sketch_estimate())
+
+    # A column read as integers in one chunk and as floats in another (a missing value) counts each value once
+    #
+    def test_whole_floats_hash_as_integers(self):
+        integers = SketchManager(0.01)
+        integers.sketch_update(pd.Series([3, 12, 7, -4]))
+        mixed = SketchManager(0.01)
+        mixed.sketch_update(pd.Series([3, 12]))
+        mixed.sketch_update(pd.Series([7.0, None, -4.0]))
+        np.testing.assert_array_equal(mixed.registers, integers.registers)
+        mixed.sketch_update(pd.Series([7.5, float('inf')]))
+        self.assertEqual(mixed.sketch_estimate(), 6)
+
+    def test_empty_column(self):
+        sketch = SketchManager(0.01)
+        sketch.sketch_update(pd.Series([None, None], dtype=object))
+        self.assertEqual(sketch.sketch_estimate(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
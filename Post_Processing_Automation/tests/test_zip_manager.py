@@ -0,0 +1,103 @@
+# test_zip_manager module
+# Tests for the ZipManager - every compression type round-trips the csv files, whole, compressed in parallel and
+# assembled, or streamed a block at a time
+#
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from zipfile import ZipFile
+
+import zip_manager
+from zip_manager import ZipManager, COMPRESSION_TYPES
+
+
+class ZipManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp() + '/'
+        self.file_names = []
+        for file_type, contents in [['id', b'xid|txn_id\n' + b'12345|a1\n' * 5000],
+                                    ['upc', b'txn_id|upc|units\n' + b'a1|0001|2\n' * 5000]]:
+            file_name = '{}cust_2019-01-01_2019-01-07_{}.csv'.format(self.folder, file_type)
+            with open(file_name, 'wb') as fp:
+                fp.write(contents)
+            self.file_names.append([file_type, file_name])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def zip_check(self, zip_file_name, compression):
+        with ZipFile(zip_file_name) as zipped:
+            self.assertIsNone(zipped.testzip())
+            for file_type, file_name in self.file_names:
+                zip_info = zipped.getinfo(os.path.basename(file_name))
+                self.assertEqual(zip_info.compress_type, COMPRESSION_TYPES[compression])
+                with open(file_name, 'rb') as fp:
+                    self.assertEqual(zipped.read(zip_info), fp.read())
+        self.assertFalse(os.path.exists('{}.partial'.format(zip_file_name)))
+
+    def test_round_trip(self):
+        for compression in COMPRESSION_TYPES:
+            with self.subTest(compression=compression):
+                zipper = ZipManager(self.folder, compression, compression)
+                zipper.create_zip_file(self.file_names)
+                self.zip_check(zipper.zip_file_name, compression)
+
+    def test_parallel_round_trip(self):
+        for compression in COMPRESSION_TYPES:
+            with self.subTest(compression=compression):
+                zipper = ZipManager(self.folder, 'parallel_' + compression, compression, workers=2)
+                zipper.create_zip_file(self.file_names)
+                self.zip_check(zipper.zip_file_name, compression)
+
+    # The zip64 records of members and archives of 4 GB and more, written here from a lowered limit
+    #
+    def test_parallel_zip64_round_trip(self):
+        with mock.patch.object(zip_manager, 'ZIP64_LIMIT', 1):
+            zipper = ZipManager(self.folder, 'parallel_zip64', 'deflate', workers=2)
+            zipper.create_zip_file(self.file_names)
+        self.zip_check(zipper.zip_file_name, 'deflate')
+
+    # A file that fails to compress leaves no zip file and no partial one
+    #
+    def test_parallel_failure_leaves_no_zip(self):
+        zipper = ZipManager(self.folder, 'failed', 'deflate', workers=2)
+        with self.assertRaises(OSError):
+            zipper.create_zip_file(self.file_names + [['extra', self.folder + 'missing.csv']])
+        self.assertFalse([file_name for file_name in os.listdir(self.folder) if '.zip' in file_name])
+
+    def test_streamed_round_trip(self):
+        for compression in COMPRESSION_TYPES:
+            with self.subTest(compression=compression):
+                zipper = ZipManager(self.folder, 'streamed_' + compression, compression)
+                zipper.zip_open()
+                for file_type, file_name in self.file_names:
+                    zip_member = zipper.member_create(file_name)
+                    with open(file_name, 'rb') as fp:
+                        for block in iter(lambda: fp.read(4096), b''):
+                            zip_member.write(block)
+                    zip_member.close()
+                zipper.zip_close()
+                self.zip_check(zipper.zip_file_name, compression)
+
+    def test_discard_removes_partial_zip(self):
+        zipper = ZipManager(self.folder, 'discarded', 'deflate')
+        zipper.zip_open()
+        zipper.member_create(self.file_names[0][1]).write(b'xid|txn_id\n')
+        zipper.zip_discard()
+        self.assertEqual(sorted(os.listdir(self.folder)), sorted(os.path.basename(file_name)
+                                                                 for file_type, file_name in self.file_names))
+
+    def test_compression_level_range(self):
+        self.assertEqual(ZipManager(self.folder, 'z', 'bzip2', 1).compress_level, 1)
+        self.assertIsNone(ZipManager(self.folder, 'z', 'lzma', 9).compress_level)
+        for compression, compress_level in [['bzip2', 0], ['deflate', 10], ['deflate', -1]]:
+            with self.assertRaises(ValueError):
+                ZipManager(self.folder, 'z', compression, compress_level)
+        with self.assertRaises(ValueError):
+            ZipManager(self.folder, 'z', 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
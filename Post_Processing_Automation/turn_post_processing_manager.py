@@ -3,24 +3,34 @@
 # Class responsible for overall program management
 #
 from datetime import datetime, timedelta
+from functools import partial
 import time
 import os
-import json
+import io
 import logging
+import re
+import socket
 
-from jira_manager import JiraManager
-from csv_manager import CSVManager
-from pandas_manager import PandasManager
-from zip_manager import ZipManager
+from csv_manager import CSVManager, StructureScan, CSV_SCHEMAS
+from cache_manager import CacheManager
+from pipeline_manager import PipelineManager
+from metrics_manager import MetricsManager
+from journal_manager import JournalManager
+from rule_manager import RuleManager
 
-today_date = (datetime.now() - timedelta(hours=7)).strftime('%Y%m%d')
+# jira, pandas and the managers built on them, the zip manager and the process pool are imported by the methods that
+# use them, so a run with no tickets to process (and the worker processes, which never talk to Jira) only pay for
+# what they use
 
 
 class PostProcessingManager(object):
-    def __init__(self, config_params):
+    def __init__(self, config_params, jira_pars=None):
+        today_date = (datetime.now() - timedelta(hours=7)).strftime('%Y%m%d')
+        self.config_params = config_params
         self.jira_url = config_params['jira_url']
         self.jira_token = config_params['jira_token']
-        self.jira_pars = None
+        self.jira_pars = jira_pars                  # a Jira session kept open by the daemon is not ended by the run
+        self.jira_session_shared = jira_pars is not None
         self.jira_status_parent = config_params['jql_status_parent']
         self.jira_status_child = config_params['jql_status_child']
         self.jira_issuetype = config_params['jql_issuetype']
@@ -30,7 +40,59 @@ class PostProcessingManager(object):
         self.results_json_path = config_params['results_json_path']
         self.results_json_name = config_params['results_json_name']
         self.results_file_name = '{}{}_{}.json'.format(self.results_json_path, self.results_json_name, today_date)
-        self.results_dict = {}
+        self.child_ticket_workers = int(config_params['child_ticket_workers'])
+        self.pipeline_mode = config_params['pipeline_mode']
+        self.structure_check = config_params['structure_check']
+        self.structure_report_lines = int(config_params['structure_report_lines'])
+        self.pandas_chunk_size = int(config_params['pandas_chunk_size'])
+        self.pandas_engine = self.pandas_engine_check(config_params['pandas_engine'])
+        self.pandas_shard_workers = int(config_params['pandas_shard_workers'])
+        self.pandas_shard_min_bytes = int(config_params['pandas_shard_min_mb']) * 1024 * 1024
+        self.distinct_error = float(config_params['distinct_error']) if config_params['distinct_error'] else None
+        self.empty_report_rows = int(config_params['empty_report_rows'])
+        self.rules = RuleManager(config_params['check_rules'])
+        self.profile_cache = self.profile_cache_create(config_params)
+        self.sidecar_format = config_params['sidecar_format']
+        # the sidecars are kept with the cached results by default, never in the delivery folders
+        self.sidecar_path = config_params['sidecar_path']
+        if not self.sidecar_path and config_params['profile_cache_path']:
+            self.sidecar_path = os.path.join(config_params['profile_cache_path'], 'sidecars')
+        self.integrity_check_enabled = config_params['integrity_check']
+        self.integrity_sample_size = int(config_params['integrity_sample_size'])
+        self.zip_compression = config_params['zip_compression']
+        self.zip_compress_level = int(config_params['zip_level']) if config_params['zip_level'] else None
+        self.zip_workers = int(config_params['zip_workers'])
+        self.jira_write_workers = int(config_params['jira_write_workers'])
+        self.jira_write_rate = float(config_params['jira_write_rate'])
+        self.jira_write_retries = int(config_params['jira_write_retries'])
+        self.jira_write_backoff = float(config_params['jira_write_backoff'])
+        self.multi_host = config_params['multi_host']
+        self.worker_id = config_params['worker_id'] or '{}.{}'.format(socket.gethostname(), os.getpid())
+        self.lease_seconds = int(config_params['lease_seconds'])
+        self.heartbeat_seconds = int(config_params['heartbeat_seconds'])
+        self.run_id = config_params['run_id'] or today_date
+        self.replay_mode = config_params['replay_mode']
+        self.replay_fixture_path = config_params['replay_fixture_path']
+        self.replay_scale = int(config_params['replay_scale'])
+        self.replay_latency_ms = float(config_params['replay_latency_ms']) if config_params['replay_latency_ms'] \
+            else None
+        self.replay_read_error_rate = float(config_params['replay_read_error_rate'])
+        self.replay_write_error_rate = float(config_params['replay_write_error_rate'])
+        self.replay_seed = int(config_params['replay_seed'])
+        self.replay = None
+        self.history_path = config_params['history_path']
+        self.history_weeks = int(config_params['history_weeks'])
+        self.history_deviation = float(config_params['history_deviation'])
+        self.history_min_runs = int(config_params['history_min_runs'])
+        self.history_run_date = (datetime.now() - timedelta(hours=7)).strftime('%Y-%m-%d')
+        self.history = None
+        self.leases = None
+        self.recovered_tickets = set()              # tickets taken over from a worker whose lease expired
+        self.metrics = MetricsManager()
+        # with several hosts sharing the run each worker journals its own results, they are merged at the end
+        self.journal = JournalManager(self.results_file_name, self.worker_id if self.multi_host else None)
+        self.completed_tickets = set()
+        self.csv_index = {}                         # (parent key, child key) => the child folder's csv files
         self.parent_tickets = []
         self.child_tickets = []
         self.logger = logging.getLogger(__name__)
@@ -40,87 +102,469 @@ class PostProcessingManager(object):
     def parent_ticket_manager(self):
         # Create Jira instance and connect to the Jira Server, if successful, pull desired parent tickets running jql
         try:
-            self.jira_pars = JiraManager(self.jira_url, self.jira_token)
+            if not self.jira_session_shared:
+                with self.metrics.stage('jira connect'):
+                    from jira_manager import JiraManager
+                    self.replay = self.replay_manager_create()
+                    jira_client = self.replay.jira_client(self.jira_url, self.jira_token) if self.replay else None
+                    self.jira_pars = JiraManager(self.jira_url, self.jira_token, jira_client)
+                if self.replay is not None and self.replay.mode == 'replay' and self.replay.scale > 1:
+                    with self.metrics.stage('replay csv folders'):
+                        self.logger.info("{} csv folder(s) were linked for the scaled tickets".format(
+                            self.replay.csv_folders_scale(self.zfs_path)))
         except Exception as e:
             self.logger.info("There was a problem with the Jira server connection - {}".format(e))
         else:
-            self.parent_tickets = self.jira_pars.find_parent_tickets(self.jira_issuetype, self.jira_status_parent,
-                                                                     self.jira_text)
+            with self.metrics.stage('jira parent search'):
+                self.parent_tickets = self.jira_pars.find_parent_tickets(self.jira_issuetype, self.jira_status_parent,
+                                                                         self.jira_text)
 
         # Verifies that tickets were found that match the search criteria and logs count and a list of all tickets
         if self.parent_tickets:
             self.logger.info("{} parent ticket(s) were found that match the criteria.".format(len(self.parent_tickets)))
             self.logger.info("{}\n".format([ticket.key for ticket in self.parent_tickets]))
 
+            # Child tickets completed by an earlier run today, that was interrupted, are read from the results journal,
+            # the tickets it blocked or whose Jira writes failed are worked again
+            journal_statuses = self.journal.journal_statuses()
+            self.completed_tickets = set(ticket_key for ticket_key, status in journal_statuses.items()
+                                         if status == 'completed')
+            if self.completed_tickets:
+                self.logger.info("{} child ticket(s) were completed by an earlier run and will be "
+                                 "skipped.".format(len(self.completed_tickets)))
+            retried_tickets = sorted(ticket_key for ticket_key, status in journal_statuses.items()
+                                     if status != 'completed')
+            if retried_tickets:
+                self.logger.info("{} child ticket(s) were blocked or had Jira write failures in an earlier run and "
+                                 "will be worked again => {}".format(len(retried_tickets), retried_tickets))
+            # the writes that did land are checked on the ticket first, so they are not posted twice
+            self.recovered_tickets.update(ticket_key for ticket_key, status in journal_statuses.items()
+                                          if status == 'write failed')
+
+            # Pulls desired sub-tasks of every parent ticket running one paginated jql, grouped by parent ticket
+            with self.metrics.stage('jira child search'):
+                child_tickets = self.jira_pars.find_child_tickets_bulk(self.parent_tickets, self.jira_status_child,
+                                                                       self.jira_label)
+
             # Iterates through list of found parent tickets
+            ticket_jobs = []
             for parent_ticket in self.parent_tickets:
                 self.logger.info("\n\t\t\t\t\t\t\t  => Parent Ticket Number: {}".format(parent_ticket))
 
                 # Fetches the relevant parent ticket level information for zip file name creation
-                parent_ticket.customer_name = self.jira_pars.parent_information_pull(parent_ticket)
+                with self.metrics.stage('jira parent information', ticket=parent_ticket.key):
+                    parent_ticket.customer_name = self.jira_pars.parent_information_pull(parent_ticket)
                 self.logger.info("\t  => Account/Customer name: {}".format(parent_ticket.customer_name))
 
-                # Pulls desired sub-tasks running jql
-                self.child_tickets.clear()
-                self.child_tickets = self.jira_pars.find_child_tickets(parent_ticket, self.jira_status_child,
-                                                                       self.jira_label)
+                self.child_tickets = child_tickets.get(parent_ticket.key, [])
                 if self.child_tickets:
                     self.logger.info("\n{} child ticket(s) were found that match the "
                                      "criteria.".format(len(self.child_tickets)))
-                    self.child_ticket_manager(parent_ticket)
+                    ticket_jobs.extend(self.child_ticket_jobs(parent_ticket))
                 else:
                     self.logger.error("There were no child tickets found with the required criteria to process.")
 
-            # write the overall run results dict to a json file on zfs/operations_limited
-            self.json_file_write()
+            # Runs the data checks, zip file creation and jira updates for the child tickets of every parent ticket,
+            # without any child tickets to process pandas and the zip manager are never loaded
+            if ticket_jobs:
+                # Lists every child ticket folder once up front, the largest tickets are started first
+                with self.metrics.stage('csv index'):
+                    parent_keys = sorted(set(ticket_job[0].key for ticket_job in ticket_jobs))
+                    self.csv_index = CSVManager(self.zfs_path).folder_index(parent_keys)
+                self.history = self.history_manager_create()
+                self.child_ticket_manager(self.ticket_jobs_schedule(ticket_jobs))
+
+                # compacts the run results journal into the results json file on zfs/operations_limited
+                with self.metrics.stage('results write'):
+                    self.json_file_write()
+
+                # loads the run's file statistics into the run history store, for the comparisons of later runs
+                if self.history is not None:
+                    with self.metrics.stage('history write'):
+                        self.history_write()
 
         else:
+            # fast path, the run ends straight after the jira search without loading the data check modules
             self.logger.error("There were no parent tickets found with the required criteria to process.")
-        self.jira_pars.kill_session()
+        self.metrics.metrics_summary()
+        if self.jira_pars is not None and not self.jira_session_shared:
+            self.jira_pars.kill_session()
 
-    # Manages the process at the child ticket level, data checks, zip file creation, ftp posting
+    # Fetches the relevant child ticket level information for each child ticket of a parent and creates the zip file
+    # names, returns a list of jobs [parent ticket, child ticket, zip file name]
     #
-    def child_ticket_manager(self, parent_ticket):
+    def child_ticket_jobs(self, parent_ticket):
+        ticket_jobs = []
         for child_ticket in self.child_tickets:
-            self.logger.info("\n\t  => Child Ticket Number: {}".format(child_ticket))
-
-            # Fetches the relevant child ticket level information then creates zip file name and path
-            child_ticket.date_range = self.jira_pars.child_information_pull(child_ticket)
+            if child_ticket.key in self.completed_tickets:
+                self.logger.info("Child ticket {} has a completed results record, skipping".format(child_ticket.key))
+                continue
+            with self.metrics.stage('jira child information', ticket=child_ticket.key):
+                child_ticket.date_range = self.jira_pars.child_information_pull(child_ticket)
             zip_file_name = '{}_{}'.format(parent_ticket.customer_name, child_ticket.date_range)
-            child_ticket_zfs_path = '{}/{}/{}/'.format(self.zfs_path, parent_ticket.key, child_ticket.key)
+            ticket_jobs.append([parent_ticket, child_ticket, zip_file_name])
+        return ticket_jobs
 
-            # Collects the relevant csv file names and file nicknames - if they exist
-            csv_file_names = self.csv_data_fetch(parent_ticket, child_ticket)
+    # Flags the child tickets with missing or extra csv files and orders the jobs largest csv files first, so the
+    # slowest ticket is started at the beginning of the run and not left as its tail
+    #
+    def ticket_jobs_schedule(self, ticket_jobs):
+        for parent_ticket, child_ticket, zip_file_name in ticket_jobs:
+            folder = self.csv_index.get((parent_ticket.key, child_ticket.key))
+            if folder is None:
+                self.logger.error("No csv folder was found for ticket {}".format(child_ticket.key))
+            elif folder['missing'] or folder['extra']:
+                self.logger.error("The csv folder for ticket {} is missing the {} file(s) and has the extra file(s) "
+                                  "{}".format(child_ticket.key, folder['missing'], folder['extra']))
+        ticket_jobs = sorted(ticket_jobs, key=lambda job: -self.csv_index.get((job[0].key, job[1].key),
+                                                                             {}).get('total bytes', 0))
+        self.logger.info("Ticket order, largest csv files first: {}".format(
+            ['{} ({:,} MB)'.format(child_ticket.key, self.csv_index.get((parent_ticket.key, child_ticket.key), {})
+                                   .get('total bytes', 0) // 1048576)
+             for parent_ticket, child_ticket, zip_file_name in ticket_jobs]))
+        return ticket_jobs
 
-            # Performs all the required data checks on the csv files returns a dict with the check info
-            checked_files = self.pandas_data_check(csv_file_names)
+    # Manages the process at the child ticket level, data checks, zip file creation, ftp posting
+    #
+    def child_ticket_manager(self, ticket_jobs):
+        start_time = time.time()
+        # With several hosts sharing the run each ticket is only worked by the worker holding its lease, the tickets
+        # leased by other workers are tried again, each heartbeat, once this worker's own tickets are finished
+        self.leases = self.lease_manager_create()
+        jira_writes = self.jira_write_manager_create()
+        waiting_jobs = ticket_jobs
+        try:
+            while waiting_jobs:
+                held_jobs = []
+                self.child_ticket_round(self.ticket_jobs_claimed(waiting_jobs, held_jobs), jira_writes)
+                waiting_jobs = held_jobs
+                if waiting_jobs:
+                    # the finished tickets are marked done before waiting on the other workers
+                    for ticket_key, ticket_results in jira_writes.ticket_writes_done(wait=True):
+                        self.ticket_results_journal(ticket_key, ticket_results)
+                    self.logger.info("{} ticket(s) are leased by other workers, waiting for them to finish or for "
+                                     "their leases to expire".format(len(waiting_jobs)))
+                    time.sleep(self.heartbeat_seconds)
+
+            # every queued write is finished before the results are written and the jira session is ended
+            for ticket_key, ticket_results in jira_writes.writes_drain():
+                self.ticket_results_journal(ticket_key, ticket_results)
+        finally:
+            if self.leases:
+                self.leases.lease_stop()
+        self.logger.info("The data checks for {} child ticket(s) completed in {:.1f} seconds with {} "
+                         "worker(s)".format(len(ticket_jobs), time.time() - start_time, self.child_ticket_workers))
+
+    # Runs the data checks of the claimed ticket jobs and queues each ticket's jira writes as its checks complete
+    #
+    def child_ticket_round(self, claimed_jobs, jira_writes):
+        if self.child_ticket_workers > 1:
+            checked_jobs = self.child_ticket_parallel_checks(claimed_jobs)
+        else:
+            checked_jobs = ([parent_ticket, child_ticket, zip_file_name] +
+                            list(self.child_ticket_data_check(parent_ticket.key, child_ticket.key, zip_file_name))
+                            for parent_ticket, child_ticket, zip_file_name in claimed_jobs)
 
+        # The jira comments and label updates are queued to the background writers as each ticket's checks complete,
+        # the next ticket's checks run while they are posted
+        for parent_ticket, child_ticket, zip_file_name, checked_files, zip_created in checked_jobs:
             # Check that both csv files passed the checks, else by-pass zipping
             if checked_files and checked_files is not None:
-                # posts the panda results dictionary for each ticket into an overall run results dictionary
-                self.results_dict[child_ticket.key] = checked_files
-
-                # Posts the quality check results as comment on ticket
-                self.jira_pars.add_quality_checks_results_comment(child_ticket, checked_files)
-
-                # Creates the zip file on zfs, if successful posts row count comment on ticket, changes 'labels field'
-                if self.file_zip(child_ticket_zfs_path, zip_file_name, csv_file_names):
-                    self.jira_pars.add_count_comment(child_ticket, zip_file_name, checked_files)
-                    self.jira_pars.update_field_value(child_ticket)
+                checked_files['customer name'] = parent_ticket.customer_name
+                checked_files['zip file created'] = zip_created
+                self.history_check(child_ticket.key, checked_files)
+
+                # Posts the quality check results as comment on ticket, if the zip file was created on zfs, posts row
+                # count comment on ticket, changes 'labels field', a ticket taken over from a worker that died skips
+                # the writes it had already posted, and nothing is posted once this worker has lost the ticket's lease
+                lease_check = partial(self.leases.lease_owned, child_ticket.key) if self.leases else None
+                jira_writes.ticket_writes_submit(child_ticket, zip_file_name, checked_files, zip_created, self.rules,
+                                                 child_ticket.key in self.recovered_tickets, lease_check)
             else:
                 self.logger.error("The csv files for ticket {} have issues, they failed the data checks, "
                                   "NO zip file was created".format(child_ticket.key))
+                if self.leases:
+                    self.leases.lease_complete(child_ticket.key, 'blocked')
+            for ticket_key, ticket_results in jira_writes.ticket_writes_done():
+                self.ticket_results_journal(ticket_key, ticket_results)
+
+    # Journals the results of a ticket whose jira writes have finished, as completed only when the zip file was
+    # created and every write landed, a restarted run skips a completed ticket and works a blocked (no zip file) or
+    # write failed ticket again, any write that failed is part of the results
+    #
+    def ticket_results_journal(self, ticket_key, checked_files):
+        # a ticket whose lease was taken over is journaled and marked done by the worker holding the lease now
+        if self.leases and not self.leases.lease_owned(ticket_key):
+            self.logger.error("The lease of ticket {} was taken over by another worker, its results are left to that "
+                              "worker".format(ticket_key))
+            self.leases.lease_release(ticket_key)
+            return
+        # embeds the stage metrics for the ticket, from this process and any worker process, in the results
+        checked_files['metrics'] = self.metrics.ticket_records(ticket_key)
+        if checked_files.get('jira write failures'):
+            status = 'write failed'
+        elif not checked_files.get('zip file created'):
+            status = 'blocked'
+        else:
+            status = 'completed'
+        if status != 'completed':
+            self.logger.warning("Ticket {} is journaled as {}, the next run works it again".format(ticket_key, status))
+        try:
+            self.journal.journal_append(ticket_key, checked_files, status)
+        except Exception as e:
+            self.logger.warning("There was a problem writing the results of ticket {} to the results "
+                                "journal => {}".format(ticket_key, e))
+        # the done marker is only written once the ticket's jira writes have finished
+        if self.leases:
+            self.leases.lease_complete(ticket_key, status)
+
+    # Creates the lease manager when the run is shared between several hosts, otherwise returns None, the leases of a
+    # run are kept next to its results file and its done markers carry the run id
+    #
+    def lease_manager_create(self):
+        if not self.multi_host:
+            return None
+        from lease_manager import LeaseManager
+
+        return LeaseManager('{}.leases'.format(self.results_file_name), self.worker_id, self.lease_seconds,
+                            self.heartbeat_seconds, self.run_id)
+
+    # Yields the ticket jobs this worker holds the lease of, one at a time as they are asked for, so the other hosts
+    # share the rest, the jobs leased by another worker are added to held_jobs, without leases every job is yielded
+    #
+    def ticket_jobs_claimed(self, ticket_jobs, held_jobs):
+        for ticket_job in ticket_jobs:
+            if self.leases is None:
+                yield ticket_job
+                continue
+            lease_status = self.leases.lease_acquire(ticket_job[1].key)
+            if lease_status == 'held':
+                held_jobs.append(ticket_job)
+            elif lease_status in ('acquired', 'recovered'):
+                if lease_status == 'recovered':
+                    self.recovered_tickets.add(ticket_job[1].key)
+                yield ticket_job
+
+    # Creates the replay manager when the run records its Jira traffic or replays a recorded run, otherwise returns
+    # None and the run talks to the Jira server
+    #
+    def replay_manager_create(self):
+        if not self.replay_mode:
+            return None
+        if self.replay_mode not in ('record', 'replay'):
+            self.logger.error("Unknown Jira replay mode '{}', expected record or replay, the run talks to the Jira "
+                              "server".format(self.replay_mode))
+            return None
+        from replay_manager import ReplayManager
+
+        return ReplayManager(self.replay_mode, self.replay_fixture_path, self.replay_scale, self.replay_latency_ms,
+                             self.replay_read_error_rate, self.replay_write_error_rate, self.replay_seed)
+
+    # Creates the run history store when a history path is configured, otherwise returns None
+    #
+    def history_manager_create(self):
+        if not self.history_path:
+            return None
+        from history_manager import HistoryManager
+
+        return HistoryManager(self.history_path, self.history_weeks, self.history_deviation, self.history_min_runs)
+
+    # Compares the ticket's file statistics with the customer's earlier runs, the deviations are reported in the
+    # quality checks comment and do not stop the zip file
+    #
+    def history_check(self, ticket_key, checked_files):
+        if self.history is None:
+            return
+        try:
+            with self.metrics.stage('history compare', ticket=ticket_key):
+                history = self.history.history_compare(checked_files['customer name'], self.history_run_date,
+                                                       ticket_key, checked_files)
+        except Exception as e:
+            self.logger.warning("There was a problem comparing ticket {} with the run history - {}".format(
+                ticket_key, e))
+        else:
+            if history is not None:
+                checked_files['history'] = history
+
+    # Loads the results json file of the run into the run history store
+    #
+    def history_write(self):
+        try:
+            self.history.results_ingest(self.results_file_name, self.history_run_date)
+        except Exception as e:
+            self.logger.warning("There was a problem loading the results into the run history {} - {}".format(
+                self.history_path, e))
+        finally:
+            self.history.history_close()
+
+    # Creates the background jira writer for the run's session, with the configured threads, rate limit and retries
+    #
+    def jira_write_manager_create(self):
+        from jira_write_manager import JiraWriteManager
+
+        return JiraWriteManager(self.jira_pars, self.metrics, self.jira_write_workers, self.jira_write_rate,
+                                self.jira_write_retries, self.jira_write_backoff)
+
+    # Runs the data checks for the child tickets in a pool of worker processes, yielding each job with its results
+    # as it completes, a failure in one ticket is logged and does not stop the others, the jobs are taken from
+    # ticket_jobs as workers free up so a ticket is only claimed when it is about to be checked
+    #
+    def child_ticket_parallel_checks(self, ticket_jobs):
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+        ticket_jobs = iter(ticket_jobs)
+        with ProcessPoolExecutor(max_workers=self.child_ticket_workers) as executor:
+            futures = {}
+            while True:
+                for parent_ticket, child_ticket, zip_file_name in ticket_jobs:
+                    futures[executor.submit(child_ticket_data_check_worker, self.config_params, parent_ticket.key,
+                                            child_ticket.key, zip_file_name,
+                                            self.csv_data_fetch(parent_ticket.key, child_ticket.key,
+                                                                index_only=True))] = \
+                        [parent_ticket, child_ticket, zip_file_name]
+                    if len(futures) >= self.child_ticket_workers:
+                        break
+                if not futures:
+                    break
+                for future in wait(futures, return_when=FIRST_COMPLETED)[0]:
+                    yield self.child_ticket_parallel_result(future, futures.pop(future))
+
+    # Returns a ticket job with the data check results of its worker process
+    #
+    def child_ticket_parallel_result(self, future, ticket_job):
+        try:
+            checked_files, zip_created, metrics_records = future.result()
+            self.metrics.records.extend(metrics_records)
+        except Exception as e:
+            self.logger.error("The data checks for ticket {} failed in the worker process - "
+                              "{}".format(ticket_job[1].key, e))
+            checked_files, zip_created = None, False
+        return ticket_job + [checked_files, zip_created]
+
+    # Performs the file level work for a child ticket, csv file discovery, data checks and zip file creation, returns
+    # the data check results and whether the zip file was created
+    #
+    def child_ticket_data_check(self, parent_key, child_key, zip_file_name, csv_file_names=None):
+        self.logger.info("\n\t  => Child Ticket Number: {}".format(child_key))
+        self.metrics.current_ticket = child_key
+        child_ticket_zfs_path = '{}/{}/{}/'.format(self.zfs_path, parent_key, child_key)
+
+        # Collects the relevant csv file names and file nicknames - if they exist, unless the run's csv index gave them
+        if csv_file_names is None:
+            with self.metrics.stage('csv discovery'):
+                csv_file_names = self.csv_data_fetch(parent_key, child_key)
+        if not csv_file_names:
+            return None, False
+
+        # In pipeline mode the checks, checksums and zip file all come from a single read of each csv file
+        if self.pipeline_mode:
+            checked_files, zip_created = self.pipeline_data_check(child_ticket_zfs_path, zip_file_name,
+                                                                  csv_file_names)
+        else:
+            # Performs all the required data checks on the csv files returns a dict with the check info
+            checked_files = self.pandas_data_check(csv_file_names)
+
+            # Check that both csv files passed the checks and have no empty values, else by-pass zipping
+            zip_created = False
+            if checked_files and not self.empty_values_found(checked_files):
+                zip_created = self.file_zip(child_ticket_zfs_path, zip_file_name, csv_file_names)
+
+        # Cross-checks the txn_ids of the id and upc files, the orphan counts are reported and do not stop the zip file
+        if checked_files and self.integrity_check_enabled:
+            checked_files['integrity'] = self.integrity_check(csv_file_names)
+        return checked_files, zip_created
+
+    # Checks that every upc file txn_id exists in the id file and the reverse, returns the orphan counts and samples,
+    # or None when the ticket does not have both files or the check could not be run
+    #
+    def integrity_check(self, csv_file_names):
+        from integrity_manager import IntegrityManager
+
+        file_names = dict(csv_file_names)
+        if 'id' not in file_names or 'upc' not in file_names:
+            return None
+        integrity = IntegrityManager(self.pandas_chunk_size or 1000000, self.integrity_sample_size)
+        try:
+            with self.metrics.stage('integrity check'):
+                return integrity.integrity_check(file_names['id'], file_names['upc'])
+        except Exception as e:
+            self.logger.warning("The txn_id integrity check between the id and upc files failed - {}".format(e))
+            return None
+
+    # Reads each csv file once, feeding the data checks, a SHA-256 checksum and the file's member of the temporary zip
+    # file from the same blocks, the zip file is only published when every file passes its checks and has no empty
+    # values, otherwise the temporary zip file is removed
+    #
+    def pipeline_data_check(self, child_ticket_zfs_path, zip_file_name, csv_file_names):
+        ticket_quality_results = {}
+        zipper = None
+        try:
+            zipper = self.zip_manager_create(child_ticket_zfs_path, zip_file_name)
+            zipper.zip_open()
+            for file_name in csv_file_names:
+                zip_member = zipper.member_create(file_name[1])
+                with open(file_name[1], 'rb') as csv, self.metrics.stage('pipeline read', file_name[1]):
+                    # Stored results still need the file read for the checksum and zip member, only the parse is skipped
+                    pandas_data = self.profile_cache.cache_get(file_name[1]) if self.profile_cache else None
+
+                    # The structure scan is fed from the same blocks as the parse instead of its own read of the file
+                    structure_scan = None
+                    if pandas_data is None and self.structure_check:
+                        structure_scan = StructureScan(self.structure_report_lines)
+                    csv_stream = PipelineManager(csv, zip_member, structure_scan)
+                    if pandas_data is None:
+                        pandas_data = self.pandas_file_check(file_name, io.BufferedReader(csv_stream),
+                                                             csv_stream.file_structure if structure_scan else None)
+                        if pandas_data is not None and self.profile_cache:
+                            self.profile_cache.cache_put(file_name[1], pandas_data)
+                    csv_stream.drain()
+                zip_member.close()
+
+                if pandas_data is None:
+                    zipper.zip_discard()
+                    return None, False
+                pandas_data['file sha256'] = csv_stream.file_checksum()
+                ticket_quality_results[file_name[0]] = pandas_data
+
+            # Empty values block the zip file, the results are still returned for the quality checks comment
+            if self.empty_values_found(ticket_quality_results):
+                zipper.zip_discard()
+                return ticket_quality_results, False
+
+            with self.metrics.stage('zip close'):
+                zipper.zip_close()
+        except Exception as e:
+            if zipper is not None:
+                zipper.zip_discard()
+            self.logger.error("There was a problem in the single pass read for the zip file: {} - {}".format(
+                zip_file_name, e))
+            return None, False
+        else:
+            self.logger.info("The zip file {} has been created".format(zip_file_name))
+            return ticket_quality_results, True
+
+    # Returns the file types of the ticket's results with empty values in a checked column
+    #
+    @staticmethod
+    def empty_values_found(ticket_quality_results):
+        return [file_type for file_type, pandas_data in ticket_quality_results.items()
+                if pandas_data.get('empty value columns')]
 
-    # Creates a CSV Manager instance, calls the find_csv_files module and returns csv file names
+    # Creates a CSV Manager instance, calls the find_csv_files module and returns csv file names, taken from the run's
+    # csv index when the ticket's folder is in it, index_only returns None for a folder that is not
     #
-    def csv_data_fetch(self, parent_ticket, child_ticket):
+    def csv_data_fetch(self, parent_key, child_key, index_only=False):
+        if (parent_key, child_key) in self.csv_index:
+            return [list(file_name) for file_name in self.csv_index[(parent_key, child_key)]['files']]
+        if index_only:
+            return None
         csv_data = CSVManager(self.zfs_path)
 
         # Search zfs/Technology for related csv files, returning a sorted list of lists with file nicknames and names
         try:
-            csv_file_list = csv_data.find_csv_files(parent_ticket, child_ticket)
+            csv_file_list = csv_data.find_csv_files(parent_key, child_key)
         except Exception as e:
-            self.logger.error("There was a problem with the csv files for ticket: {} - {}".format(child_ticket.key, e))
+            self.logger.error("There was a problem with the csv files for ticket: {} - {}".format(child_key, e))
         else:
             return csv_data.sort_file_list(csv_file_list)
 
@@ -131,90 +575,215 @@ class PostProcessingManager(object):
 
         # Run the checks file by file
         for file_name in file_names:
-            pandas_data = {}  # dictionary to hold pandas data-check results for each file
+            # Reuse the stored results when the csv file has not changed since it was last profiled
+            pandas_data = self.profile_cache.cache_get(file_name[1]) if self.profile_cache else None
+            if pandas_data is None:
+                pandas_data = self.pandas_file_check(file_name)
+                if pandas_data is None:
+                    return None
+                if self.profile_cache:
+                    self.profile_cache.cache_put(file_name[1], pandas_data)
 
-            # Create a data frame instance and check for any missing values
-            pandas_data_frame = PandasManager()
+            # Add the dictionary pandas_data as a value in a ticket level results dictionary with key value of file_type
+            ticket_quality_results[file_name[0]] = pandas_data
+        return ticket_quality_results
 
-            # Check that the data_frame was created successfully and check for any null values
-            if pandas_data_frame.data_frame_load(file_name[1]) is not None:
-                # Assign the file name to dictionary
-                pandas_data['file name'] = file_name[1].split('/')[-1]
+    # Runs the data checks on a single csv file, returns a dictionary of the check results or None if a check failed,
+    # the file is read from csv_stream when given, and stream_structure returns the structure scanned from that
+    # stream once it has been read through
+    #
+    def pandas_file_check(self, file_name, csv_stream=None, stream_structure=None):
+        pandas_data = {}  # dictionary to hold pandas data-check results for each file
+
+        # Reject a malformed file (wrong field counts, truncated last line) before the expensive parse
+        structure = None
+        if self.structure_check and stream_structure is None:
+            with self.metrics.stage('csv structure check', file_name[1]) as record:
+                structure = CSVManager.file_structure_check(file_name[1], self.structure_report_lines)
+                # the memory mapped read is not seen by the process io counters
+                record['bytes read'] = os.path.getsize(file_name[1])
+            if not self.structure_valid(file_name, structure):
+                return None
 
-                # Find the data dimensions, rows and columns
-                try:
-                    row_count, column_count = pandas_data_frame.data_frame_shape()
-                except Exception as e:
-                    self.logger.error("The row and column counts failed." + " - {}".format(e))
-                    return None
-                else:
-                    pandas_data['file rows'] = row_count
-                    pandas_data['file columns'] = column_count
+        # Create a data frame instance and check for any missing values
+        pandas_data_frame = self.pandas_manager_create(file_name[0])
+
+        # Check that the data_frame was created successfully and check for any null values
+        with self.metrics.stage('pandas load', file_name[1]):
+            data_frame_loaded = pandas_data_frame.data_frame_load(file_name[1], csv_stream) is not None
 
-                # Find the column headers
+        # A structure scanned from the stream is only complete once the parse has read the file, it is checked then
+        if stream_structure is not None:
+            structure = stream_structure()
+            if not self.structure_valid(file_name, structure):
+                return None
+
+        if data_frame_loaded:
+            # Assign the file name to dictionary
+            pandas_data['file name'] = file_name[1].split('/')[-1]
+
+            # Find the data dimensions, rows and columns
+            try:
+                row_count, column_count = pandas_data_frame.data_frame_shape()
+            except Exception as e:
+                self.logger.error("The row and column counts failed." + " - {}".format(e))
+                return None
+            else:
+                pandas_data['file rows'] = row_count
+                pandas_data['file columns'] = column_count
+
+            # The structure check row count comes from the raw file, flag any rows the parser dropped or added
+            if structure:
+                pandas_data['file rows'] = '{:,}'.format(structure['rows'])
+                if pandas_data['file rows'] != row_count:
+                    self.logger.warning("The parsed row count {} differs from the file row count {} => "
+                                        "{}".format(row_count, pandas_data['file rows'], file_name[1]))
+
+            # Find the column headers
+            try:
+                col_headers = pandas_data_frame.data_frame_header_check()
+            except Exception as e:
+                self.logger.error("The row and column header check failed. - {}".format(e))
+                return None
+            else:
+                pandas_data['column headers'] = col_headers
+
+            # Run the checks planned from the file type's rules column by column, all the checks of a column are
+            # answered together from one set of aggregates - taken in a single pass of the loaded column, or kept by
+            # the profiler in its single pass of the file
+            check_plan = self.rules.check_plan(file_name[0])
+            empty_columns = []
+            for column in col_headers:
+                checks = [check for check, check_columns in check_plan.items() if column in check_columns]
+                if not checks:
+                    continue
                 try:
-                    col_headers = pandas_data_frame.data_frame_header_check()
+                    with self.metrics.stage('pandas check {}'.format(column), file_name[1]):
+                        column_checks = pandas_data_frame.data_frame_column_checks(column, checks)
                 except Exception as e:
-                    self.logger.error("The row and column header check failed. - {}".format(e))
+                    self.logger.error("The {} check(s) of column {} failed. - {}".format(checks, column, e))
                     return None
-                else:
-                    pandas_data['column headers'] = col_headers
-
-                # Run checks column by column
-                for column in col_headers:
-                    # Find maximum and minimum values in column
-                    if column in ['transactionDateTime', 'units']:
-                        try:
-                            col_max, col_min = pandas_data_frame.data_frame_min_max_col_value(str(column))
-                        except Exception as e:
-                            self.logger.error("The max and min values check failed. - {}".format(e))
-                            return None
-                        else:
-                            pandas_data[column + ' max value'] = col_max
-                            pandas_data[column + ' min value'] = col_min
-
-                    # Find maximum and minimum lengths in column
-                    if column in ['xid', 'txn_id', 'upc']:
-                        try:
-                            max_len, min_len = pandas_data_frame.data_frame_min_max_lengths(column)
-                        except Exception as e:
-                            self.logger.error("The max and min lengths check failed. - ".format(e))
-                            return None
-                        else:
-                            pandas_data[column + ' max length'] = max_len
-                            pandas_data[column + ' min length'] = min_len
-
-                    # Find total number and distinct number of values in column
-                    if column == 'txn_id' and file_name[0] == 'id':
-                        try:
-                            [distinct_values, col_count] = pandas_data_frame.data_frame_distinct_values(column)
-                        except Exception as e:
-                            self.logger.error("The distinct and total values check failed. - ".format(e))
-                            return None
-                        else:
-                            pandas_data[column + ' distinct values'] = distinct_values
-                            pandas_data[column + ' count'] = col_count
+                for result_name, result in column_checks.items():
+                    pandas_data['{} {}'.format(column, result_name)] = result
 
-            else:
-                self.logger.warning("Pandas data frame load issue => {}".format(file_name[1]),
-                                    "\n\t check that the csv file exists, if so, check for the proper delimiters - '|'",
-                                    "\n\n =>  Moving on to next csv file")
-                return None
+                # Any missing or whitespace-only value in column is a hard failure that blocks the zip file
+                if column_checks.get('empty values', '0') != '0':
+                    empty_columns.append(column)
 
-            # Add the dictionary pandas_data as a value in a ticket level results dictionary with key value of file_type
-            ticket_quality_results[file_name[0]] = pandas_data
-        return ticket_quality_results
+            pandas_data['empty value columns'] = empty_columns
+            if empty_columns:
+                self.logger.error("The csv file has empty values in column(s) {} => {}, the zip file will not be "
+                                  "created".format(empty_columns, file_name[1]))
+
+        else:
+            self.logger.warning("Pandas data frame load issue => {}".format(file_name[1]) +
+                                "\n\t check that the csv file exists, if so, check for the proper delimiters - '|'" +
+                                "\n\n =>  Moving on to next csv file")
+            return None
+
+        return pandas_data
+
+    # Logs a csv file that failed the structure check, returns whether the structure is valid
+    #
+    def structure_valid(self, file_name, structure):
+        if not structure['valid']:
+            self.logger.error("The csv file failed the structure check => {} - {:,} row(s) with a field count "
+                              "other than {}, first at line(s) {}, ends with a newline: "
+                              "{}".format(file_name[1], structure['bad line count'], structure['fields'],
+                                          structure['bad lines'], structure['ends with newline']))
+        return structure['valid']
+
+    # Returns the csv parser engine to read with, an engine other than c or pyarrow, or pyarrow without the pyarrow
+    # package or pandas 1.4+ installed, is rejected with an error and the c parser is used
+    #
+    @staticmethod
+    def pandas_engine_check(engine):
+        if engine == 'c':
+            return engine
+        logger = logging.getLogger(__name__)
+        if engine != 'pyarrow':
+            logger.error("Unknown [Pandas] engine '{}', expected c or pyarrow, the c parser is used".format(engine))
+            return 'c'
+        import importlib.util
+
+        # read without importing pandas, which a run only imports when it has tickets to process
+        try:
+            from importlib.metadata import version
+            pandas_version = version('pandas')
+        except ImportError:
+            import pandas
+            pandas_version = pandas.__version__
+        if importlib.util.find_spec('pyarrow') is None:
+            problem = 'the pyarrow package is not installed'
+        elif [int(part) for part in re.findall(r'\d+', pandas_version)[:2]] < [1, 4]:
+            problem = 'it needs pandas 1.4+ and pandas {} is installed'.format(pandas_version)
+        else:
+            return engine
+        logger.error("[Pandas] engine = pyarrow is rejected, {}, the c parser is used - see requirements.txt".format(
+            problem))
+        return 'c'
+
+    # Creates the data-frame manager for a file, a streaming profiler when a chunk size is configured otherwise a full
+    # data-frame load, both reading with the registered schema for the file type
+    #
+    def pandas_manager_create(self, file_type):
+        from pandas_manager import PandasManager
+        from profile_manager import ProfileManager
+
+        schema = CSVManager.file_schema(file_type)
+        sidecar = self.sidecar_manager_create()
+        check_plan = self.rules.check_plan(file_type)
+        if self.pandas_chunk_size > 0:
+            return ProfileManager(self.pandas_chunk_size, check_plan['value'], check_plan['length'],
+                                  check_plan['distinct'], schema, self.pandas_engine,
+                                  self.distinct_error, sidecar, self.pandas_shard_workers, self.pandas_shard_min_bytes,
+                                  check_plan['empty'], self.empty_report_rows)
+        return PandasManager(schema, self.pandas_engine, self.distinct_error, sidecar, self.empty_report_rows,
+                             [column for check_columns in check_plan.values() for column in check_columns])
+
+    # Creates the columnar sidecar manager when a sidecar format is configured, otherwise returns None
+    #
+    def sidecar_manager_create(self):
+        from sidecar_manager import SidecarManager, SIDECAR_FORMATS
+
+        if not self.sidecar_format:
+            return None
+        if self.sidecar_format not in SIDECAR_FORMATS:
+            self.logger.warning("Unknown sidecar format {}, expected one of {}, the sidecar files are "
+                                "disabled".format(self.sidecar_format, SIDECAR_FORMATS))
+            return None
+        if not self.sidecar_path:
+            self.logger.warning("Neither a [Sidecar] nor a [ProfileCache] path is set, the sidecar files are disabled, "
+                                "they are never written to the delivery folders")
+            return None
+        return SidecarManager(self.sidecar_format, self.sidecar_path)
+
+    # Creates the profiling results cache when a cache path is configured, the check settings are part of every cache
+    # key so results from a different set of checks are never reused
+    #
+    def profile_cache_create(self, config_params):
+        if not config_params['profile_cache_path']:
+            return None
+        # every setting that changes a file's results, stored results checked under other settings are not reused
+        check_settings = repr([self.rules.rules_settings(), self.distinct_error, self.empty_report_rows,
+                               self.structure_check, self.structure_report_lines, self.pandas_engine,
+                               self.pandas_chunk_size, sorted(CSV_SCHEMAS.items())])
+        return CacheManager(config_params['profile_cache_path'],
+                            int(config_params['profile_cache_max_mb']) * 1024 * 1024,
+                            config_params['profile_cache_content_hash'],
+                            config_params['profile_cache_refresh'],
+                            check_settings)
 
     # Creates a Zip Manager instance, calls the create_zip_file module and returns the full zip file path and name
     #
     def file_zip(self, child_ticket_zfs_path, zip_file_name, csv_file_names):
         # ***line below creates zip files in local directory instead of on zfs, comment out for production***
         #child_ticket_zfs_path = '/Users/bradley.ruck/CI_Projects/prod_versions/Data_Enablement_Turn_Post_Processing/'
-        zipper = ZipManager(child_ticket_zfs_path, zip_file_name)
-
         # Create zip file from the two csv files in zfs/Technology directory
         try:
-            zipper.create_zip_file(csv_file_names)
+            zipper = self.zip_manager_create(child_ticket_zfs_path, zip_file_name)
+            with self.metrics.stage('zip create'):
+                zipper.create_zip_file(csv_file_names)
         except Exception as e:
             self.logger.error("There was a problem zipping the file: {} - {}".format(zip_file_name, e))
             return False
@@ -222,18 +791,35 @@ class PostProcessingManager(object):
             self.logger.info("The zip file {} has been created".format(zip_file_name))
             return True
 
+    # Creates a Zip Manager instance with the configured compression
+    #
+    def zip_manager_create(self, child_ticket_zfs_path, zip_file_name):
+        from zip_manager import ZipManager
+
+        return ZipManager(child_ticket_zfs_path, zip_file_name, self.zip_compression, self.zip_compress_level,
+                          self.zip_workers)
+
     # Writes the run data to a json file as a history repository and potential further processing
     #
     def json_file_write(self):
+        merge_lock = None
         try:
-            # create json file for results repository, to be stored on zfs1/operations_limited drive
-            with open(self.results_file_name, 'w') as fp:
-                json.dump(self.results_dict, fp, indent=4)
+            # several hosts merge every worker's journal in turn, the last worker to finish writes the complete file,
+            # the merge lock is a lease file on the share like the tickets' leases (a flock is not reliable over nfs)
+            if self.multi_host:
+                merge_lock = self.leases or self.lease_manager_create()
+                merge_lock.merge_lock_acquire()
+            # create json file for results repository from the run results journal, to be stored on
+            # zfs1/operations_limited drive
+            self.journal.journal_compact()
         except Exception as e:
             self.logger.warning("There was a problem creating the json data file or posting it to "
                                 "/zfs1/operations_limitted => {}".format(e))
         else:
             self.logger.info("There results have been posted to: {}".format(self.results_file_name))
+        finally:
+            if merge_lock is not None:
+                merge_lock.merge_lock_release()
 
     # Checks the log directory for all files and removes those after a specified number of days
     #
@@ -242,6 +828,9 @@ class PostProcessingManager(object):
             self.logger.info("\n\t\tRemove {} days old files from the {} directory".format(purge_days, purge_dir))
             now = time.time()
             for file_purge in os.listdir(purge_dir):
+                # a run lock file is never removed, a run that took it would no longer keep the next run out
+                if file_purge.endswith('.lock'):
+                    continue
                 f_obs_path = os.path.join(purge_dir, file_purge)
                 if os.stat(f_obs_path).st_mtime < now - int(purge_days) * 86400:
                     time_stamp = time.strptime(time.strftime('%Y-%m-%d %H:%M:%S',
@@ -252,3 +841,14 @@ class PostProcessingManager(object):
 
         except Exception as e:
             self.logger.warning("{}".format(e))
+
+
+# Runs the file level work for a single child ticket in a worker process, the manager is rebuilt from the config
+# parameters as the jira session cannot be passed between processes, the csv file names come from the run's csv index
+# (None lists the ticket's folder), the worker's stage metrics are returned with the results
+#
+def child_ticket_data_check_worker(config_params, parent_key, child_key, zip_file_name, csv_file_names=None):
+    worker_manager = PostProcessingManager(config_params)
+    checked_files, zip_created = worker_manager.child_ticket_data_check(parent_key, child_key, zip_file_name,
+                                                                       csv_file_names)
+    return checked_files, zip_created, worker_manager.metrics.records
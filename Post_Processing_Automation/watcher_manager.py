@@ -0,0 +1,225 @@
+# watcher_manager module
+# Module holds the class => WatcherManager - manages the trigger folder watcher interface for the daemon mode
+# Class responsible for waiting on trigger file drops (inotify, or folder polling where inotify is not available),
+# claiming the triggers so a trigger is only ever run once, and keeping the Vault credential and the Jira session warm
+# between runs
+#
+import ctypes
+import ctypes.util
+import fcntl
+import logging
+import os
+import select
+import signal
+import socket
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+class WatcherManager(object):
+    def __init__(self, trigger_path, poll_seconds, credential_fetch, credential_ttl, jira_url):
+        self.trigger_path = trigger_path
+        self.claim_path = os.path.join(trigger_path, '.claimed')
+        self.poll_seconds = poll_seconds
+        self.credential_fetch = credential_fetch
+        self.credential_ttl = credential_ttl
+        self.credential = None
+        self.credential_time = 0
+        self.jira_url = jira_url
+        self.jira_pars = None
+        self.jira_token = None
+        self.host_name = socket.gethostname()
+        self.inotify_fd = None
+        self.running = True
+        self.logger = logging.getLogger(__name__)
+
+    # Yields the claimed trigger file names for each run, triggers dropped together (or while a run is in progress)
+    # are claimed together and run once, stops after a SIGTERM or SIGINT once the current run has finished
+    #
+    def trigger_jobs(self):
+        signal.signal(signal.SIGTERM, self.watcher_stop)
+        signal.signal(signal.SIGINT, self.watcher_stop)
+        if not os.path.isdir(self.claim_path):
+            os.makedirs(self.claim_path)
+        self.claim_recover()
+        self.inotify_fd = self.inotify_create()
+        self.logger.info("Watching {} for triggers ({})".format(
+            self.trigger_path, 'inotify' if self.inotify_fd is not None else
+            'polling every {} seconds'.format(self.poll_seconds)))
+        try:
+            while self.running:
+                claimed = self.trigger_claim()
+                if claimed:
+                    yield claimed
+                else:
+                    self.trigger_wait()
+        finally:
+            if self.inotify_fd is not None:
+                os.close(self.inotify_fd)
+            self.jira_close()
+            self.logger.info("Watcher stopped")
+
+    # Claims every trigger file waiting in the trigger folder by renaming it into the claim folder, a trigger that
+    # another process renamed first is not ours to run
+    #
+    def trigger_claim(self):
+        claimed = []
+        for entry in os.scandir(self.trigger_path):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            claim_name = os.path.join(self.claim_path, '{}.{}.{}'.format(entry.name, self.host_name, os.getpid()))
+            try:
+                os.rename(entry.path, claim_name)
+            except FileNotFoundError:
+                continue
+            claimed.append(claim_name)
+        if len(claimed) > 1:
+            self.logger.info("{} triggers were claimed together and will be run once".format(len(claimed)))
+        return claimed
+
+    # Removes the claimed trigger files once their run has finished
+    #
+    def trigger_complete(self, claimed):
+        for claim_name in claimed:
+            try:
+                os.remove(claim_name)
+            except OSError as e:
+                self.logger.warning("There was a problem removing the claimed trigger {} - {}".format(claim_name, e))
+
+    # Returns triggers claimed on this host by a watcher that is no longer running to the trigger folder, so a run
+    # cut short by a crash or restart is run again
+    #
+    def claim_recover(self):
+        for entry in os.scandir(self.claim_path):
+            trigger_name, separator, claim_owner = entry.name.partition('.{}.'.format(self.host_name))
+            if not separator or not claim_owner.isdigit() or self.process_running(int(claim_owner)):
+                continue
+            self.logger.info("Returning the unfinished trigger {} to the trigger folder".format(trigger_name))
+            os.rename(entry.path, os.path.join(self.trigger_path, trigger_name))
+
+    # Waits for a change in the trigger folder, or for the poll interval to pass
+    #
+    def trigger_wait(self):
+        if self.inotify_fd is None:
+            time.sleep(self.poll_seconds)
+            return
+        readable = select.select([self.inotify_fd], [], [], self.poll_seconds)[0]
+        if readable:
+            # the events are only a wake up, the trigger folder is scanned for what arrived
+            try:
+                while os.read(self.inotify_fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    # Returns a non-blocking inotify descriptor watching the trigger folder, None where inotify is not available
+    #
+    def inotify_create(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            inotify_fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if inotify_fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            if libc.inotify_add_watch(inotify_fd, self.trigger_path.encode(),
+                                      IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(inotify_fd)
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (AttributeError, OSError, TypeError) as e:
+            self.logger.info("inotify is not available, falling back to polling - {}".format(e))
+            return None
+        return inotify_fd
+
+    # Returns the Jira credential, fetched from Vault when it is missing or older than its time to live, a failed
+    # refresh keeps the cached credential for this run
+    #
+    def credential_get(self):
+        if self.credential is None or time.time() - self.credential_time > self.credential_ttl:
+            try:
+                self.credential = self.credential_fetch()
+            except Exception as e:
+                if self.credential is None:
+                    raise
+                self.logger.warning("There was a problem refreshing the Vault credential, using the cached "
+                                    "credential - {}".format(e))
+            else:
+                self.credential_time = time.time()
+        return self.credential
+
+    # Returns the warm Jira session, reconnecting when the credential has changed or the session no longer answers
+    #
+    def jira_session(self):
+        jira_token = self.credential_get()
+        if self.jira_pars is not None and jira_token == self.jira_token:
+            try:
+                self.jira_pars.jira.myself()
+            except Exception as e:
+                self.logger.info("The Jira session has expired, reconnecting - {}".format(e))
+                self.jira_close()
+        elif self.jira_pars is not None:
+            self.jira_close()
+
+        if self.jira_pars is None:
+            from jira_manager import JiraManager
+            self.jira_pars = JiraManager(self.jira_url, jira_token)
+            self.jira_token = jira_token
+        self.jira_pars.session_refresh()
+        return self.jira_pars
+
+    # Drops the warm Jira session, the next run reconnects and fetches a fresh credential
+    #
+    def jira_reset(self):
+        self.jira_close()
+        self.credential = None
+
+    def jira_close(self):
+        if self.jira_pars is not None:
+            try:
+                self.jira_pars.kill_session()
+            except Exception as e:
+                self.logger.info("There was a problem closing the Jira session - {}".format(e))
+            self.jira_pars = None
+
+    def watcher_stop(self, signal_number, frame):
+        self.logger.info("Watcher received signal {}, stopping after the current run".format(signal_number))
+        self.running = False
+
+    @staticmethod
+    def process_running(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+
+# Helper class for the post processing runs - an exclusive lock on a lock file on local disk so only one run on the host
+# (a daemon run or a run started by ActiveBatch) processes the tickets at a time, released by the operating system if
+# the process dies
+#
+class RunLock(object):
+    def __init__(self, lock_file_name):
+        self.lock_file_name = lock_file_name
+        self.lock_file = None
+
+    # Takes the lock, waiting for a run in progress to finish or returning False straight away if wait is False
+    #
+    def acquire(self, wait=True):
+        self.lock_file = open(self.lock_file_name, 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+        return True
+
+    def release(self):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
@@ -1,18 +1,300 @@
 # zip_manager module
 # Module holds the class => ZipManager - manages zip file creation interface
-# Class responsible for all zip file related interactions including creation on zfs/Technology drive
+# Module holds the class => ZipMember - compresses one member of a zip file into a temporary file
+# Class responsible for all zip file related interactions including creation on zfs/Technology drive, the csv files
+# are compressed on separate threads (zlib, bz2 and lzma release the GIL) and then assembled into one archive written
+# in the zip file format (PKWARE APPNOTE.TXT), with zip64 records for members and archives of 4 GB and more
 #
-from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA
+import bz2
+import logging
+import lzma
 import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+COMPRESSION_TYPES = {'stored': ZIP_STORED, 'deflate': ZIP_DEFLATED, 'bzip2': ZIP_BZIP2, 'lzma': ZIP_LZMA}
+
+# compression => the [low, high] compression levels it accepts, None where a level is ignored
+COMPRESSION_LEVELS = {'stored': None, 'deflate': [0, 9], 'bzip2': [1, 9], 'lzma': None}
+
+# compression => the zip version needed to extract a member, 4.5 for a member with zip64 records
+EXTRACT_VERSIONS = {ZIP_STORED: 10, ZIP_DEFLATED: 20, ZIP_BZIP2: 46, ZIP_LZMA: 63}
+ZIP64_VERSION = 45
+
+# sizes and offsets from ZIP64_LIMIT on are written to the zip64 records, their 32 bit fields hold ZIP64_MARKER
+ZIP64_LIMIT = 0xffffffff
+ZIP64_MARKER = 0xffffffff
+
+# an lzma member is a raw lzma1 stream after a header of the lzma sdk version and the coder properties, the properties
+# are set here so the header is known without the lzma module's private property encoder
+LZMA_DICT_SIZE = 8 * 1024 * 1024
+LZMA_FILTERS = [{'id': lzma.FILTER_LZMA1, 'preset': 6, 'dict_size': LZMA_DICT_SIZE, 'lc': 3, 'lp': 0, 'pb': 2}]
+LZMA_HEADER = struct.pack('<BBHBI', 9, 4, 5, (2 * 5 + 0) * 9 + 3, LZMA_DICT_SIZE)
 
 
 class ZipManager(object):
-    def __init__(self, child_ticket_zfs_path, zip_file_name):
+    def __init__(self, child_ticket_zfs_path, zip_file_name, compression='stored', compress_level=None, workers=1):
+        if compression not in COMPRESSION_TYPES:
+            raise ValueError("Unknown zip compression '{}', expected one of {}".format(compression,
+                                                                                      sorted(COMPRESSION_TYPES)))
+        level_range = COMPRESSION_LEVELS[compression]
+        if level_range is None:
+            compress_level = None
+        elif compress_level is not None and not level_range[0] <= compress_level <= level_range[1]:
+            raise ValueError("The zip compression level {} is out of the {}-{} range of {} compression".format(
+                compress_level, level_range[0], level_range[1], compression))
         self.zip_file_name = '{}{}.zip'.format(child_ticket_zfs_path, zip_file_name)
+        self.temp_file_name = '{}.partial'.format(self.zip_file_name)
+        self.compress_type = COMPRESSION_TYPES[compression]
+        self.compress_level = compress_level
+        self.workers = workers              # threads compressing the csv files, 1 writes them through ZipFile in turn
+        self.zipped = None
+        self.member = None                  # member stream being written, closed before the archive is discarded
+        self.start_time = None
+        self.logger = logging.getLogger(__name__)
 
-    # Creates a zip file in the zfs/Technology directory where the csv files are located
+    # Creates a zip file in the zfs/Technology directory where the csv files are located, written under a temporary
+    # name and renamed into place so the zip file only ever appears complete, with more than one worker the csv files
+    # are compressed on separate threads and then assembled into the archive
     #
     def create_zip_file(self, file_names):
-        with ZipFile(self.zip_file_name, 'w') as zipped:
+        if self.workers > 1 and len(file_names) > 1:
+            self.start_time = time.time()
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(file_names))) as executor:
+                compressions = [executor.submit(self.member_compress, file[1]) for file in file_names]
+            members = [compression.result() for compression in compressions if compression.exception() is None]
+            if len(members) < len(compressions):
+                for member in members:
+                    member.discard()
+                raise next(compression.exception() for compression in compressions
+                           if compression.exception() is not None)
+            self.zip_assemble(members)
+            return
+
+        self.zip_open()
+        try:
             for file in file_names:
-                zipped.write(file[1], os.path.basename(file[1]))
+                self.zipped.write(file[1], os.path.basename(file[1]))
+        except Exception:
+            self.zip_discard()
+            raise
+        self.zip_close()
+
+    # Compresses a single csv file into a temporary member file, returns the member
+    #
+    def member_compress(self, file_name, block_size=8 * 1024 * 1024):
+        member = ZipMember(file_name, self.compress_type, self.compress_level)
+        try:
+            with open(file_name, 'rb') as csv:
+                for block in iter(lambda: csv.read(block_size), b''):
+                    member.write(block)
+            member.finish()
+        except Exception:
+            member.discard()
+            raise
+        return member
+
+    # Writes the compressed members and the central directory into the temporary archive and renames it into place,
+    # the temporary member files are always removed
+    #
+    def zip_assemble(self, members):
+        try:
+            with open(self.temp_file_name, 'wb') as zipped:
+                central_directory = []
+                for member in members:
+                    central_directory.append(member.central_header(zipped.tell()))
+                    zipped.write(member.local_header())
+                    member.data_copy(zipped)
+                directory_offset = zipped.tell()
+                zipped.write(b''.join(central_directory))
+                zipped.write(self.end_records(len(members), directory_offset, zipped.tell() - directory_offset))
+            os.replace(self.temp_file_name, self.zip_file_name)
+        except Exception:
+            self.zip_discard()
+            raise
+        finally:
+            for member in members:
+                member.discard()
+        self.zip_report(sum(member.file_size for member in members))
+
+    # Returns the end of central directory record, after the zip64 end record and its locator when the archive needs
+    # them
+    #
+    @staticmethod
+    def end_records(entry_count, directory_offset, directory_size):
+        end_records = b''
+        if entry_count >= 0xffff or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            end_records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, ZIP64_VERSION, ZIP64_VERSION, 0, 0, entry_count,
+                                       entry_count, directory_size, directory_offset)
+            end_records += struct.pack('<IIQI', 0x07064b50, 0, directory_offset + directory_size, 1)
+            entry_count = min(entry_count, 0xffff)
+            directory_size = min(directory_size, ZIP64_MARKER)
+            directory_offset = min(directory_offset, ZIP64_MARKER)
+        return end_records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, entry_count, entry_count, directory_size,
+                                         directory_offset, 0)
+
+    # Opens the temporary archive for the members to be written into
+    #
+    def zip_open(self):
+        self.start_time = time.time()
+        self.zipped = ZipFile(self.temp_file_name, 'w', self.compress_type, compresslevel=self.compress_level)
+
+    # Returns a writable stream for a csv file's member of the open archive, written block by block, one member is
+    # open at a time and must be closed before the next is created
+    #
+    def member_create(self, file_name):
+        # the size of a streamed member is not known up front, the zip64 header keeps a member over 2 GB valid
+        self.member = self.zipped.open(os.path.basename(file_name), 'w', force_zip64=True)
+        return self.member
+
+    # Closes the archive and renames it into place
+    #
+    def zip_close(self):
+        try:
+            file_bytes = sum(zip_info.file_size for zip_info in self.zipped.infolist())
+            self.zipped.close()
+            os.replace(self.temp_file_name, self.zip_file_name)
+        except Exception:
+            self.zip_discard()
+            raise
+        self.zipped = None
+        self.zip_report(file_bytes)
+
+    # Logs the sizes, compression rate and time to ready of the zip file
+    #
+    def zip_report(self, file_bytes):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        zip_bytes = os.path.getsize(self.zip_file_name)
+        self.logger.info("Zipped {:,} bytes into {:,} bytes ({:.1%} of original) in {:.1f} seconds - {:.1f} MB/s, "
+                         "{}".format(file_bytes, zip_bytes, zip_bytes / float(file_bytes or 1), elapsed,
+                                     file_bytes / elapsed / (1024 * 1024), self.zip_file_name))
+
+    # Closes and removes a partly written archive
+    #
+    def zip_discard(self):
+        if self.zipped is not None:
+            try:
+                if self.member is not None:
+                    self.member.close()
+                self.zipped.close()
+            except Exception:
+                pass
+            self.zipped = None
+        if os.path.exists(self.temp_file_name):
+            os.remove(self.temp_file_name)
+
+
+# Helper class for the ZipManager - compresses one archive member from a stream of blocks into an anonymous temporary
+# file (removed by the operating system once closed, even when the process dies), keeping the CRC and sizes for the
+# member's zip headers
+#
+class ZipMember(object):
+    def __init__(self, file_name, compress_type, compress_level=None):
+        self.file_stat = os.stat(file_name)
+        self.compress_type = compress_type
+        self.data_file = tempfile.TemporaryFile()
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.flag_bits = 0
+        # the member name as stored in the headers, a name that is not plain ascii is flagged as utf-8
+        try:
+            self.header_name = os.path.basename(file_name).encode('ascii')
+        except UnicodeEncodeError:
+            self.header_name = os.path.basename(file_name).encode('utf-8')
+            self.flag_bits |= 0x0800
+        self.compressor = None
+        if compress_type == ZIP_DEFLATED:
+            self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if compress_level is None else compress_level,
+                                               zlib.DEFLATED, -15)
+        elif compress_type == ZIP_BZIP2:
+            self.compressor = bz2.BZ2Compressor(9 if compress_level is None else compress_level)
+        elif compress_type == ZIP_LZMA:
+            self.compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+            # the raw stream ends with an end of stream marker, flagged in the headers
+            self.flag_bits |= 0x02
+            self.data_write(LZMA_HEADER)
+
+    # Adds the next block of the file to the member
+    #
+    def write(self, block):
+        self.crc = zlib.crc32(block, self.crc)
+        self.file_size += len(block)
+        self.data_write(self.compressor.compress(block) if self.compressor else block)
+
+    # Flushes the compressor once the whole file has been written
+    #
+    def finish(self):
+        if self.compressor:
+            self.data_write(self.compressor.flush())
+
+    def data_write(self, block):
+        self.data_file.write(block)
+        self.compress_size += len(block)
+
+    # Copies the compressed member into the archive
+    #
+    def data_copy(self, zipped):
+        self.data_file.seek(0)
+        shutil.copyfileobj(self.data_file, zipped, 8 * 1024 * 1024)
+
+    def discard(self):
+        self.data_file.close()
+
+    # Returns the local file header written before the member's data, the zip64 extra field holds both sizes when
+    # either is too large for its 32 bit field
+    #
+    def local_header(self):
+        file_size, compress_size, extra = self.file_size, self.compress_size, b''
+        if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+            extra = struct.pack('<HHQQ', 0x0001, 16, file_size, compress_size)
+            file_size = compress_size = ZIP64_MARKER
+        dos_time, dos_date = self.dos_date_time()
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, self.extract_version(bool(extra)), self.flag_bits,
+                           self.compress_type, dos_time, dos_date, self.crc, compress_size, file_size,
+                           len(self.header_name), len(extra)) + self.header_name + extra
+
+    # Returns the member's central directory header, the zip64 extra field holds just the sizes and offset too large
+    # for their 32 bit fields, in the order the format gives them
+    #
+    def central_header(self, header_offset):
+        file_size, compress_size = self.file_size, self.compress_size
+        zip64_values = []
+        if file_size >= ZIP64_LIMIT:
+            zip64_values.append(file_size)
+            file_size = ZIP64_MARKER
+        if compress_size >= ZIP64_LIMIT:
+            zip64_values.append(compress_size)
+            compress_size = ZIP64_MARKER
+        if header_offset >= ZIP64_LIMIT:
+            zip64_values.append(header_offset)
+            header_offset = ZIP64_MARKER
+        extra = b''
+        if zip64_values:
+            extra = struct.pack('<HH{}Q'.format(len(zip64_values)), 0x0001, 8 * len(zip64_values), *zip64_values)
+        extract_version = self.extract_version(bool(extra) or self.file_size >= ZIP64_LIMIT or
+                                               self.compress_size >= ZIP64_LIMIT)
+        dos_time, dos_date = self.dos_date_time()
+        # made by unix (3), the file's permissions in the high bytes of the external attributes
+        return struct.pack('<IBBHHHHHIIIHHHHHII', 0x02014b50, extract_version, 3, extract_version, self.flag_bits,
+                           self.compress_type, dos_time, dos_date, self.crc, compress_size, file_size,
+                           len(self.header_name), len(extra), 0, 0, 0, (self.file_stat.st_mode & 0xffff) << 16,
+                           header_offset) + self.header_name + extra
+
+    def extract_version(self, zip64):
+        return max(EXTRACT_VERSIONS[self.compress_type], ZIP64_VERSION if zip64 else 0)
+
+    # Returns the file's modified time as the zip headers hold it, [ms-dos time, ms-dos date], dates before 1980 (the
+    # first the format can hold) are written as 1980-01-01
+    #
+    def dos_date_time(self):
+        modified = time.localtime(self.file_stat.st_mtime)
+        if modified.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        return (modified.tm_hour << 11 | modified.tm_min << 5 | modified.tm_sec // 2,
+                (modified.tm_year - 1980) << 9 | modified.tm_mon << 5 | modified.tm_mday)